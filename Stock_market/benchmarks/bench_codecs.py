@@ -0,0 +1,61 @@
+"""
+Пропускная способность кодеков Kafka (kafka.codecs) на типичных сообщениях.
+
+Запуск из каталога Stock_market:
+    python -m benchmarks.bench_codecs [-n 100000]
+"""
+
+import argparse
+import os
+import timeit
+import uuid
+from datetime import datetime, timezone
+
+# config требует эти переменные при импорте; подключения не создаются
+os.environ.setdefault("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from kafka.codecs import CODECS  # noqa: E402
+from kafka.schemas import TradeUpdatePayload  # noqa: E402
+from kafka.schemas import OrderStatus, OrderStatusPayload  # noqa: E402
+
+MESSAGES = {
+    "TradeUpdatePayload": TradeUpdatePayload(
+        trade_id=uuid.uuid4(),
+        buyer_id=uuid.uuid4(),
+        seller_id=uuid.uuid4(),
+        instrument="MEME",
+        price=105,
+        quantity=7,
+        timestamp=datetime.now(timezone.utc),
+    ),
+    "OrderStatusPayload": OrderStatusPayload(
+        order_id=uuid.uuid4(),
+        status=OrderStatus.PARTIALLY_EXECUTED,
+        timestamp=datetime.now(timezone.utc),
+    ),
+}
+
+
+def bench(number: int):
+    print(
+        f"{'schema':<20} {'codec':<8} {'bytes':>6} "
+        f"{'encode/s':>12} {'decode/s':>12}"
+    )
+    for schema, message in MESSAGES.items():
+        # В outbox сообщения хранятся JSON-совместимыми словарями
+        payload = message.model_dump(mode="json")
+        for name, codec in CODECS.items():
+            data = codec.encode(payload, schema)
+            encode = timeit.timeit(lambda: codec.encode(payload, schema), number=number)
+            decode = timeit.timeit(lambda: codec.decode(data, schema), number=number)
+            print(
+                f"{schema:<20} {name:<8} {len(data):>6} "
+                f"{number / encode:>12,.0f} {number / decode:>12,.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=100_000)
+    bench(parser.parse_args().number)
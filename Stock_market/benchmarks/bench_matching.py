@@ -0,0 +1,463 @@
+"""
+Нагрузочный бенчмарк исполнения заявок на SQLite.
+
+Синтетический поток заявок прогоняется двумя путями:
+- crud — create_order / cancel_order по одной, как в очереди инструмента;
+- api — приложение FastAPI через ASGI-клиент httpx, с очередями
+  инструментов, outbox и брокером Kafka в памяти процесса (memory://).
+
+Поток: пуассоновские поступления, цена каждого инструмента — случайное
+блуждание, смесь лимитных, рыночных заявок и отмен стоящих заявок. Поток
+определяется --seed; его можно сохранить (--save-flow) и воспроизвести
+(--flow). С --rate путь api работает с открытым циклом: запрос уходит в
+момент поступления, задержка считается от него, а не от отправки.
+
+Отчёт: пропускная способность, задержки p50/p99/p999, запросов к БД на
+операцию. --out сохраняет JSON, --compare сравнивает с сохранённым.
+Чтобы БД была в памяти, файл SQLite кладётся на tmpfs: --db-dir /dev/shm.
+
+Запуск из каталога Stock_market:
+    python -m benchmarks.bench_matching --orders 20000 --out bench.json
+    python -m benchmarks.bench_matching --driver api --rate 300 --compare bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import string
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from itertools import product
+from typing import Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+KINDS = ("limit", "market", "cancel")
+SIDES = ("BUY", "SELL")
+
+
+@dataclass
+class FlowEvent:
+    """Операция потока; для отмены target — номер события её заявки"""
+
+    at: float
+    kind: str
+    ticker: str
+    user: int
+    direction: str = "BUY"
+    qty: int = 0
+    price: int = 0
+    target: int = -1
+
+
+def ticker_names(count: int) -> List[str]:
+    letters = ("".join(p) for p in product(string.ascii_uppercase, repeat=2))
+    return [f"BN{suffix}" for _, suffix in zip(range(count), letters)]
+
+
+def generate_flow(args) -> List[FlowEvent]:
+    rng = random.Random(args.seed)
+    tickers = ticker_names(args.tickers)
+    mids = {t: args.price for t in tickers}
+    resting: Dict[str, List[int]] = {t: [] for t in tickers}
+    events: List[FlowEvent] = []
+    # Без --rate время поступления только задаёт порядок
+    rate = args.rate or 1000.0
+    at = 0.0
+
+    for _ in range(args.orders):
+        at += rng.expovariate(rate)
+        ticker = rng.choice(tickers)
+        mid = max(args.spread + 1, round(mids[ticker] + rng.gauss(0, args.volatility)))
+        mids[ticker] = mid
+
+        roll = rng.random()
+        if roll < args.cancel and resting[ticker]:
+            target = resting[ticker].pop(rng.randrange(len(resting[ticker])))
+            events.append(
+                FlowEvent(at, "cancel", ticker, events[target].user, target=target)
+            )
+            continue
+
+        user = rng.randrange(args.users)
+        direction = rng.choice(SIDES)
+        qty = rng.randint(1, args.max_qty)
+        if roll < args.cancel + args.market:
+            events.append(FlowEvent(at, "market", ticker, user, direction, qty))
+        else:
+            # Цена вокруг середины: около половины заявок пересекает спред
+            price = max(1, mid + round(rng.gauss(0, args.spread)))
+            resting[ticker].append(len(events))
+            events.append(FlowEvent(at, "limit", ticker, user, direction, qty, price))
+    return events
+
+
+def save_flow(path: str, flow: List[FlowEvent]):
+    with open(path, "w") as f:
+        for e in flow:
+            f.write(json.dumps(asdict(e)) + "\n")
+
+
+def load_flow(path: str) -> List[FlowEvent]:
+    with open(path) as f:
+        return [FlowEvent(**json.loads(line)) for line in f if line.strip()]
+
+
+class QueryCounter:
+    """Запросы к БД со всех потоков, включая очереди и relay"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+def latency_stats(values: List[float]) -> dict:
+    values = sorted(values)
+    ms = 1000
+    return {
+        "count": len(values),
+        "mean_ms": sum(values) / len(values) * ms if values else 0.0,
+        "p50_ms": percentile(values, 0.50) * ms,
+        "p99_ms": percentile(values, 0.99) * ms,
+        "p999_ms": percentile(values, 0.999) * ms,
+        "max_ms": (values[-1] if values else 0.0) * ms,
+    }
+
+
+class Recorder:
+    def __init__(self, counter: QueryCounter):
+        self.counter = counter
+        self.latencies: Dict[str, List[float]] = {kind: [] for kind in KINDS}
+        self.errors: Dict[str, int] = {}
+        self.skipped = 0
+
+    def error(self, reason: str):
+        self.errors[reason] = self.errors.get(reason, 0) + 1
+
+    def start(self):
+        self.queries = self.counter.count
+        self.started = time.perf_counter()
+
+    def finish(self, trades: int) -> dict:
+        seconds = time.perf_counter() - self.started
+        queries = self.counter.count - self.queries
+        everything = [v for values in self.latencies.values() for v in values]
+        return {
+            "operations": len(everything),
+            "errors": sum(self.errors.values()),
+            "error_reasons": self.errors,
+            "skipped": self.skipped,
+            "trades": trades,
+            "seconds": seconds,
+            "throughput_ops": len(everything) / seconds if seconds else 0.0,
+            "queries": queries,
+            "queries_per_op": queries / len(everything) if everything else 0.0,
+            "latency": latency_stats(everything),
+            "by_kind": {
+                kind: latency_stats(values)
+                for kind, values in self.latencies.items()
+                if values
+            },
+        }
+
+
+def prepare(args) -> List[Tuple[UUID, str]]:
+    """Чистая схема, инструменты и пользователи с балансами"""
+    import crud
+    import models
+    import schemas
+    from config import settings
+    from database import Base, SessionLocal, engine
+    from matching.book import books
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    books.reset_all()
+    # Снимки прошлого прогона относятся к удалённым таблицам
+    if settings.JOURNAL_DIR:
+        shutil.rmtree(settings.JOURNAL_DIR, ignore_errors=True)
+
+    tickers = ticker_names(args.tickers)
+    db = SessionLocal()
+    try:
+        for ticker in tickers:
+            crud.create_instrument(db, models.Instrument(name=ticker, ticker=ticker))
+        users = []
+        for i in range(args.users):
+            user = crud.create_user(db, models.NewUser(name=f"bench{i}"))
+            users.append((user.id, user.api_key))
+            db.add(schemas.Balance(user_id=user.id, ticker="RUB", amount=10**9))
+            db.add_all(
+                schemas.Balance(user_id=user.id, ticker=t, amount=10**6)
+                for t in tickers
+            )
+        db.commit()
+        return users
+    finally:
+        db.close()
+
+
+def count_trades() -> int:
+    from sqlalchemy import func, select
+
+    import schemas
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return db.scalar(select(func.count()).select_from(schemas.Transaction))
+    finally:
+        db.close()
+
+
+def order_body(event: FlowEvent) -> dict:
+    body = {"direction": event.direction, "ticker": event.ticker, "qty": event.qty}
+    if event.kind == "limit":
+        body["price"] = event.price
+    return body
+
+
+def run_crud(flow: List[FlowEvent], users, counter: QueryCounter) -> dict:
+    from fastapi import HTTPException
+    from pydantic import TypeAdapter
+
+    import crud
+    import models
+    from database import WriterSessionLocal
+
+    bodies = TypeAdapter(Union[models.LimitOrderBody, models.MarketOrderBody])
+    order_ids: Dict[int, UUID] = {}
+    recorder = Recorder(counter)
+    recorder.start()
+    for i, event in enumerate(flow):
+        user_id = users[event.user][0]
+        if event.kind == "cancel" and event.target not in order_ids:
+            recorder.skipped += 1
+            continue
+
+        started = time.perf_counter()
+        db = WriterSessionLocal()
+        try:
+            if event.kind == "cancel":
+                crud.cancel_order(db, order_ids[event.target], user_id)
+            else:
+                order = crud.create_order(
+                    db, bodies.validate_python(order_body(event)), user_id
+                )
+                order_ids[i] = order.id
+        except HTTPException as e:
+            recorder.error(str(e.detail))
+        except ValueError as e:
+            recorder.error(str(e))
+        finally:
+            db.close()
+        recorder.latencies[event.kind].append(time.perf_counter() - started)
+    return recorder.finish(count_trades())
+
+
+async def run_api(
+    flow: List[FlowEvent], users, counter: QueryCounter, rate: float, concurrency: int
+) -> dict:
+    import httpx
+
+    from main import app
+
+    order_ids: Dict[int, str] = {}
+    recorder = Recorder(counter)
+
+    async def send(client: httpx.AsyncClient, i: int, event: FlowEvent, due: float):
+        headers = {"Authorization": f"TOKEN {users[event.user][1]}"}
+        if event.kind == "cancel":
+            target = order_ids.get(event.target)
+            if target is None:
+                # Заявка ещё не принята (открытый цикл) или отклонена
+                recorder.skipped += 1
+                return
+            response = await client.delete(f"/api/v1/order/{target}", headers=headers)
+        else:
+            response = await client.post(
+                "/api/v1/order", json=order_body(event), headers=headers
+            )
+            if response.status_code == 200:
+                order_ids[i] = response.json()["order_id"]
+        recorder.latencies[event.kind].append(time.perf_counter() - due)
+        if response.status_code != 200:
+            recorder.error(f"{response.status_code} {response.json().get('detail')}")
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench"
+        ) as client:
+            recorder.start()
+            if rate:
+                # Каждый запрос держит соединение из пула, пока ждёт очередь
+                # инструмента: без предела перегрузка исчерпывает пул.
+                # Задержка всё равно считается от момента поступления
+                in_flight = asyncio.Semaphore(concurrency)
+
+                async def scheduled(i: int, event: FlowEvent, due: float):
+                    async with in_flight:
+                        await send(client, i, event, due)
+
+                tasks = []
+                for i, event in enumerate(flow):
+                    due = recorder.started + event.at
+                    await asyncio.sleep(max(0.0, due - time.perf_counter()))
+                    tasks.append(asyncio.create_task(scheduled(i, event, due)))
+                await asyncio.gather(*tasks)
+            else:
+                queue = iter(enumerate(flow))
+
+                async def worker():
+                    for i, event in queue:
+                        await send(client, i, event, time.perf_counter())
+
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+            # Очереди инструментов и relay успевают досчитать хвост
+            return recorder.finish(count_trades())
+    finally:
+        await app.router.shutdown()
+
+
+def compare(baseline_path: str, report: dict):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    metrics = [
+        ("throughput_ops", lambda r: r["throughput_ops"]),
+        ("p50_ms", lambda r: r["latency"]["p50_ms"]),
+        ("p99_ms", lambda r: r["latency"]["p99_ms"]),
+        ("p999_ms", lambda r: r["latency"]["p999_ms"]),
+        ("queries_per_op", lambda r: r["queries_per_op"]),
+    ]
+    print(
+        f"\n{'driver':<6} {'metric':<15} {'baseline':>12} {'current':>12} {'change':>8}"
+    )
+    for driver, result in report["drivers"].items():
+        before = baseline.get("drivers", {}).get(driver)
+        if before is None:
+            continue
+        for name, get in metrics:
+            old, new = get(before), get(result)
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+            print(f"{driver:<6} {name:<15} {old:>12.2f} {new:>12.2f} {change:>8}")
+
+
+def print_result(driver: str, result: dict):
+    latency = result["latency"]
+    print(
+        f"{driver:<6} {result['operations']:>7} ops {result['seconds']:>7.2f}s "
+        f"{result['throughput_ops']:>9.1f} ops/s  p50 {latency['p50_ms']:.2f} "
+        f"p99 {latency['p99_ms']:.2f} p999 {latency['p999_ms']:.2f} ms  "
+        f"{result['queries_per_op']:.1f} queries/op  {result['trades']} trades  "
+        f"{result['errors']} errors"
+    )
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--driver", choices=["crud", "api", "both"], default="both")
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--tickers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument(
+        "--rate", type=float, default=0.0, help="заявок/с, 0 — без пауз"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="запросов api в обработке"
+    )
+    parser.add_argument("--market", type=float, default=0.1, help="доля рыночных")
+    parser.add_argument("--cancel", type=float, default=0.2, help="доля отмен")
+    parser.add_argument("--price", type=int, default=1000)
+    parser.add_argument("--volatility", type=float, default=2.0)
+    parser.add_argument("--spread", type=int, default=5)
+    parser.add_argument("--max-qty", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--flow", help="воспроизвести сохранённый поток")
+    parser.add_argument("--save-flow", help="сохранить поток в JSON Lines")
+    parser.add_argument("--db-dir", help="каталог для файла SQLite")
+    parser.add_argument("--journal", action="store_true", help="с журналом стаканов")
+    parser.add_argument("--out", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранёнными результатами")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-matching-", dir=args.db_dir)
+    # Настройки читаются при импорте приложения, поэтому задаются до него
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}"
+    os.environ["KAFKA_BOOTSTRAP_SERVERS"] = "memory://"
+    os.environ["ORDER_INGESTION"] = "sync"
+    os.environ["ASYNC_DB"] = "false"
+    os.environ.pop("JOURNAL_DIR", None)
+    if args.journal:
+        os.environ["JOURNAL_DIR"] = os.path.join(workdir, "journal")
+    logging.disable(logging.ERROR)
+
+    flow = load_flow(args.flow) if args.flow else generate_flow(args)
+    if args.save_flow:
+        save_flow(args.save_flow, flow)
+
+    try:
+        from database import engine
+        from matching.journal import journal
+
+        counter = QueryCounter(engine)
+        drivers = ["crud", "api"] if args.driver == "both" else [args.driver]
+        report = {
+            "config": {
+                k: v for k, v in vars(args).items() if k not in ("out", "compare")
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "drivers": {},
+        }
+        for driver in drivers:
+            users = prepare(args)
+            if driver == "crud":
+                journal.open()
+                try:
+                    result = run_crud(flow, users, counter)
+                finally:
+                    journal.close()
+            else:
+                result = asyncio.run(
+                    run_api(flow, users, counter, args.rate, args.concurrency)
+                )
+            report["drivers"][driver] = result
+            print_result(driver, result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(args.compare, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Планы и время горячих запросов к orders / transactions до и после индексов
+схемы (0002 и keyset-индексы 0004 / 0005).
+
+Нужен PostgreSQL с применёнными миграциями (alembic upgrade head).
+Рабочие таблицы не трогаются: данные генерируются во временные таблицы
+orders / transactions, которые в рамках соединения закрывают рабочие, —
+поэтому запросы и индексы берутся из crud и schemas как есть.
+
+    python -m benchmarks.bench_order_indexes --rows 1000000 --out indexes.json
+"""
+
+import argparse
+import hashlib
+import json
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.schema import CreateIndex
+
+import crud
+import schemas
+from config import settings
+
+# Временные таблицы в pg_temp, он первый в search_path
+SETUP = [
+    "CREATE TEMP TABLE orders (LIKE public.orders INCLUDING DEFAULTS)",
+    "CREATE TEMP TABLE transactions (LIKE public.transactions INCLUDING DEFAULTS)",
+    "ALTER TABLE orders ADD PRIMARY KEY (id)",
+    "ALTER TABLE transactions ADD PRIMARY KEY (id)",
+]
+
+FILL_ORDERS = """
+INSERT INTO orders (
+    id, user_id, instrument_ticker, direction, type, price,
+    quantity, filled, status, created_at, updated_at
+)
+SELECT
+    gen_random_uuid(),
+    md5((g % :users)::text)::uuid,
+    'T' || (g % :tickers),
+    (CASE WHEN g % 2 = 0 THEN 'BUY' ELSE 'SELL' END)::order_direction,
+    (CASE WHEN g % 10 = 0 THEN 'MARKET' ELSE 'LIMIT' END)::order_type,
+    CASE WHEN g % 10 = 0 THEN NULL ELSE 900 + (random() * 200)::int END,
+    10,
+    0,
+    (CASE
+        WHEN random() < :active THEN 'NEW'
+        WHEN random() < 0.2 THEN 'CANCELLED'
+        ELSE 'EXECUTED'
+    END)::order_status,
+    now() - g * interval '10 ms',
+    now() - g * interval '10 ms'
+FROM generate_series(1, :rows) AS g
+"""
+
+FILL_TRANSACTIONS = """
+INSERT INTO transactions (
+    id, buyer_id, seller_id, instrument_ticker, price, quantity, created_at
+)
+SELECT
+    gen_random_uuid(),
+    md5((g % :users)::text)::uuid,
+    md5(((g + 1) % :users)::text)::uuid,
+    'T' || (g % :tickers),
+    900 + (random() * 200)::int,
+    1 + (random() * 10)::int,
+    now() - g * interval '10 ms'
+FROM generate_series(1, :rows / 2) AS g
+"""
+
+# Те же определения, что создают миграции: head совпадает со schemas
+INDEXES = sorted(
+    schemas.Order.__table__.indexes | schemas.Transaction.__table__.indexes,
+    key=lambda index: index.name,
+)
+
+
+def queries(conn) -> dict:
+    """Запросы crud с литералами: EXPLAIN и замеры идут одним текстом"""
+    user_id = UUID(hashlib.md5(b"1").hexdigest())
+    # Курсор в середине сгенерированной истории (шаг 10 мс на строку)
+    cursor = (datetime.now(timezone.utc) - timedelta(minutes=30), UUID(int=0))
+    statements = {
+        "book_load": crud.book_statement("T1"),
+        "user_orders": crud.orders_statement(user_id, limit=100),
+        "user_orders_page": crud.orders_statement(user_id, cursor=cursor, limit=100),
+        "user_active": crud.orders_statement(user_id, active=True, limit=100),
+        "transactions": crud.transactions_statement("T1", limit=100),
+        "transactions_page": crud.transactions_statement(
+            "T1", before=cursor, limit=100
+        ),
+        "transactions_export": crud.transactions_statement(
+            "T1", since=cursor[0], after=cursor, limit=1000
+        ),
+    }
+    return {
+        name: str(
+            stmt.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        )
+        for name, stmt in statements.items()
+    }
+
+
+def measure(conn, sql: str, repeat: int) -> dict:
+    explain = conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}"))
+    plan = explain.scalar()[0]
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        conn.execute(text(sql)).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    return {
+        "plan": plan["Plan"]["Node Type"],
+        "index": _find_index(plan["Plan"]),
+        "execution_ms": plan["Execution Time"],
+        "median_ms": statistics.median(timings),
+    }
+
+
+def _find_index(node: dict):
+    if "Index Name" in node:
+        return node["Index Name"]
+    for child in node.get("Plans", []):
+        found = _find_index(child)
+        if found:
+            return found
+    return None
+
+
+def run(rows: int, tickers: int, users: int, active: float, repeat: int) -> dict:
+    engine = create_engine(settings.db_url)
+    params = {"rows": rows, "tickers": tickers, "users": users, "active": active}
+
+    with engine.connect() as conn:
+        for statement in SETUP:
+            conn.execute(text(statement))
+        conn.execute(text(FILL_ORDERS), params)
+        conn.execute(text(FILL_TRANSACTIONS), params)
+        conn.execute(text("ANALYZE orders"))
+        conn.execute(text("ANALYZE transactions"))
+
+        sql = queries(conn)
+        before = {name: measure(conn, q, repeat) for name, q in sql.items()}
+
+        for index in INDEXES:
+            conn.execute(CreateIndex(index))
+        conn.execute(text("ANALYZE orders"))
+        conn.execute(text("ANALYZE transactions"))
+
+        after = {name: measure(conn, q, repeat) for name, q in sql.items()}
+        conn.rollback()
+
+    return {"params": params, "before": before, "after": after}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--tickers", type=int, default=20)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--active", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--out", help="Сохранить результат в JSON")
+    args = parser.parse_args()
+
+    result = run(args.rows, args.tickers, args.users, args.active, args.repeat)
+
+    print(f"{'query':<22}{'before':>34}{'after':>40}")
+    for name in result["after"]:
+        b, a = result["before"][name], result["after"][name]
+        print(
+            f"{name:<22}"
+            f"{b['plan']:>22} {b['median_ms']:>9.2f}ms  "
+            f"{a['plan'] + ' ' + (a['index'] or ''):>28} {a['median_ms']:>9.2f}ms"
+        )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Iterable, List, Optional
+from uuid import UUID
+
+from config import settings
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением времени жизни записей.
+    Потокобезопасен: синхронные эндпоинты работают в пуле потоков.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._evict(next(iter(self._data)))
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            if key in self._data:
+                self._evict(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def _evict(self, key: Hashable):
+        del self._data[key]
+
+
+@dataclass(frozen=True)
+class AuthUser:
+    """Данные пользователя, нужные для авторизации запроса"""
+
+    id: UUID
+    name: str
+    role: str
+    api_key: str
+    is_active: bool
+
+
+class AuthCache(TTLCache):
+    """
+    api_key -> AuthUser.
+    Явно сбрасывается при удалении пользователя в этом процессе; в остальных
+    воркерах устаревшая запись живёт не дольше ttl.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize, ttl)
+        self._keys_by_user: Dict[UUID, str] = {}
+
+    def set(self, key: str, value: AuthUser):
+        with self._lock:
+            self._keys_by_user[value.id] = key
+        super().set(key, value)
+
+    def invalidate_user(self, user_id: UUID):
+        with self._lock:
+            key = self._keys_by_user.get(user_id)
+        if key is not None:
+            self.pop(key)
+
+    def _evict(self, key: str):
+        value, _ = self._data.pop(key)
+        self._keys_by_user.pop(value.id, None)
+
+
+auth_cache = AuthCache(maxsize=settings.AUTH_CACHE_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+# ticker -> OrderBook, прочитанный из БД на узле, который стакан не ведёт
+remote_books = TTLCache(maxsize=1000, ttl=settings.REMOTE_BOOK_TTL)
+
+
+@dataclass(frozen=True)
+class InstrumentInfo:
+    """Инструмент без сессии БД: проверка тикера не требует запроса"""
+
+    ticker: str
+    name: str
+    is_active: bool = True
+
+
+class InstrumentRegistry:
+    """
+    ticker -> InstrumentInfo, все инструменты в памяти процесса.
+    Инструменты меняются только через админские методы: этот процесс
+    обновляет реестр после коммита, остальные — по событию из топика
+    инструментов (kafka.consumer.InstrumentWatcher).
+    """
+
+    def __init__(self):
+        self.loaded = False
+        # Изменения заменяют словарь целиком, поэтому чтение без блокировки
+        self._data: Dict[str, InstrumentInfo] = {}
+        self._lock = threading.Lock()
+
+    def replace(self, instruments: Iterable[InstrumentInfo]):
+        data = {instrument.ticker: instrument for instrument in instruments}
+        with self._lock:
+            self._data = data
+            self.loaded = True
+
+    def get(self, ticker: str) -> Optional[InstrumentInfo]:
+        return self._data.get(ticker)
+
+    def active(self, skip: int = 0, limit: int = 100) -> List[InstrumentInfo]:
+        listed = sorted(
+            (item for item in self._data.values() if item.is_active),
+            key=lambda item: item.ticker,
+        )
+        return listed[skip : skip + limit]
+
+    def put(self, instrument: InstrumentInfo):
+        with self._lock:
+            self._data = {**self._data, instrument.ticker: instrument}
+
+    def remove(self, ticker: str):
+        with self._lock:
+            if ticker in self._data:
+                data = dict(self._data)
+                del data[ticker]
+                self._data = data
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self.loaded = False
+
+
+instruments = InstrumentRegistry()
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 
 from pydantic import computed_field
 from pydantic_settings import BaseSettings
@@ -7,9 +7,72 @@ from pydantic_settings import BaseSettings
 class Settings(BaseSettings):
     # Основные переменные
     DATABASE_URL: Optional[str] = None
+    # memory:// — брокер в памяти процесса (kafka.memory)
     KAFKA_BOOTSTRAP_SERVERS: str
     ALLOWED_ORIGINS: List[str] = ["http://localhost:3000"]
 
+    # Потоки, в которых исполняются очереди инструментов
+    MATCHING_THREADS: int = 8
+
+    # Асинхронный доступ к БД (AsyncSession + asyncpg) для роутеров
+    ASYNC_DB: bool = False
+
+    # Размер очереди сообщений одного WebSocket-клиента; при переполнении
+    # клиент отключается
+    WS_QUEUE_SIZE: int = 256
+
+    # Сколько закрытых свечей каждого интервала держать в памяти
+    CANDLE_HISTORY: int = 1000
+
+    # Отправка событий из outbox: размер пачки и период опроса таблицы (с)
+    OUTBOX_BATCH_SIZE: int = 500
+    OUTBOX_POLL_INTERVAL: float = 0.5
+    # Пачка, не отправленная за это время, достаётся другому ретранслятору
+    OUTBOX_CLAIM_TIMEOUT: float = 30.0
+
+    # Батчинг producer'а Kafka
+    KAFKA_LINGER_MS: int = 20
+    KAFKA_COMPRESSION: Optional[str] = "gzip"
+    KAFKA_MAX_BATCH_SIZE: int = 256 * 1024
+
+    # Приём заявок: sync — исполнение в HTTP-запросе, kafka — заявка и отмена
+    # публикуются в топик команд и исполняются consumer group (kafka.consumer)
+    ORDER_INGESTION: Literal["sync", "kafka"] = "sync"
+    KAFKA_ORDERS_GROUP: str = "matching"
+    INGESTION_BATCH_SIZE: int = 500
+
+    # Кодек сообщений Kafka: json, orjson или struct (kafka.codecs);
+    # KAFKA_TOPIC_CODECS переопределяет его по шаблону топика, например
+    # {"stockmarket.trades": "struct"}
+    KAFKA_CODEC: str = "json"
+    KAFKA_TOPIC_CODECS: Dict[str, str] = {}
+
+    # Журнал стаканов (matching.journal): каталог, пусто — журнал выключен;
+    # пауза перед общим fsync (мс), размер сегмента, записей между снимками
+    JOURNAL_DIR: Optional[str] = None
+    JOURNAL_FSYNC_INTERVAL_MS: float = 2.0
+    JOURNAL_SEGMENT_BYTES: int = 64 * 1024 * 1024
+    JOURNAL_SNAPSHOT_EVERY: int = 10000
+
+    # Логи (logging_setup): уровень, формат text или json, файл с ротацией
+    # (пусто — только консоль), размер очереди к потоку записи. INFO-записи
+    # одного места вызова сверх LOG_SAMPLE_BURST в секунду пишутся раз
+    # в LOG_SAMPLE_EVERY, 1 — без прореживания
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: Literal["text", "json"] = "json"
+    LOG_FILE: Optional[str] = "logs/app.log"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_SAMPLE_BURST: int = 20
+    LOG_SAMPLE_EVERY: int = 100
+
+    # Кэш авторизации по api_key
+    AUTH_CACHE_TTL: float = 30.0
+    AUTH_CACHE_SIZE: int = 10000
+
+    # Срез стакана, который ведёт другой узел (ORDER_INGESTION=kafka):
+    # столько секунд отдаётся прочитанный из БД
+    REMOTE_BOOK_TTL: float = 0.5
+
     # Опциональные
     POSTGRES_USER: Optional[str] = None
     POSTGRES_PASSWORD: Optional[str] = None
@@ -25,6 +88,19 @@ class Settings(BaseSettings):
             return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@db:5432/{self.POSTGRES_DB}"
         raise ValueError("DATABASE_URL is not set and can't be constructed")
 
+    @property
+    def async_db_url(self) -> str:
+        """db_url с асинхронным драйвером"""
+        url = self.db_url
+        for sync_prefix, async_prefix in (
+            ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+            ("postgresql://", "postgresql+asyncpg://"),
+            ("sqlite://", "sqlite+aiosqlite://"),
+        ):
+            if url.startswith(sync_prefix):
+                return async_prefix + url[len(sync_prefix) :]
+        return url
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
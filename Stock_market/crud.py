@@ -1,20 +1,44 @@
 import logging
+import time
 import uuid
-from collections import defaultdict
-from datetime import datetime
-from typing import Union
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from uuid import UUID
 
 from fastapi import HTTPException, status
+from sqlalchemy import Select, case, delete, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 
+import metrics
 import models
+import pagination
 import schemas
-from models import Level
-from schemas import Balance
-from schemas import Instrument as ORMInstrument
-from schemas import User
+from cache import InstrumentInfo, auth_cache, instruments
+from kafka.producer import (
+    Event,
+    bulk_cancel_event,
+    instrument_event,
+    order_event,
+    order_status_event,
+    trade_event,
+)
+from matching.book import (
+    BookOrder,
+    BookSnapshot,
+    Fill,
+    OrderBook,
+    books,
+    spend_from,
+)
+from matching.candles import INTERVALS, Candle, candles
+from matching.journal import journal
+from matching.settlement import Settlement
+from pagination import Cursor
+from schemas import Balance, Instrument as ORMInstrument, User
 
 logger = logging.getLogger(__name__)
 
@@ -23,7 +47,7 @@ def get_user(db: Session, user_id: UUID):
     try:
         return db.query(schemas.User).filter(schemas.User.id == user_id).first()
     except Exception as e:
-        logger.error(f"Error getting user {user_id}: {str(e)}", exc_info=True)
+        logger.error("Error getting user %s: %s", user_id, e, exc_info=True)
         raise
 
 
@@ -31,7 +55,7 @@ def get_user_by_api_key(db: Session, api_key: str):
     try:
         return db.query(schemas.User).filter(schemas.User.api_key == api_key).first()
     except Exception as e:
-        logger.error(f"Error getting user by API key: {str(e)}", exc_info=True)
+        logger.error("Error getting user by API key: %s", e, exc_info=True)
         raise
 
 
@@ -41,42 +65,48 @@ def create_user(db: Session, user: models.NewUser):
         db.add(db_user)
         db.commit()
         db.refresh(db_user)
-        logger.info(f"New user created: {db_user.name}")
+        logger.info("New user created: %s", db_user.name)
         return db_user
     except IntegrityError as e:
-        logger.error(f"User creation failed (duplicate name?): {str(e)}")
+        logger.error("User creation failed (duplicate name?): %s", e)
         raise
     except Exception as e:
-        logger.error(f"Error creating user: {str(e)}", exc_info=True)
+        logger.error("Error creating user: %s", e, exc_info=True)
         raise
 
 
-def get_instruments(db: Session, skip: int = 0, limit: int = 100):
-    try:
-        return (
-            db.query(schemas.Instrument)
-            .filter(schemas.Instrument.is_active == True)
-            .offset(skip)
-            .limit(limit)
-            .all()
-        )
-    except Exception as e:
-        logger.error(f"Error getting instruments: {str(e)}", exc_info=True)
-        raise
+def instrument_info(instrument: ORMInstrument) -> InstrumentInfo:
+    return InstrumentInfo(
+        ticker=instrument.ticker,
+        name=instrument.name,
+        is_active=bool(instrument.is_active),
+    )
 
 
-def get_instrument(db: Session, ticker: str):
+def load_instruments(db: Session):
+    """Перечитать реестр инструментов из БД"""
     try:
-        return (
-            db.query(schemas.Instrument)
-            .filter(schemas.Instrument.ticker == ticker)
-            .first()
-        )
+        rows = db.query(schemas.Instrument).all()
+        instruments.replace(instrument_info(row) for row in rows)
+        logger.info("Loaded %s instruments", len(rows))
     except Exception as e:
-        logger.error(f"Error getting instrument {ticker}: {str(e)}", exc_info=True)
+        logger.error("Error loading instruments: %s", e, exc_info=True)
         raise
 
 
+def get_instruments(db: Session, skip: int = 0, limit: int = 100):
+    if not instruments.loaded:
+        load_instruments(db)
+    return instruments.active(skip, limit)
+
+
+def get_instrument(db: Session, ticker: str) -> Optional[InstrumentInfo]:
+    """Проверка тикера — поиск в реестре; БД нужна только до его загрузки"""
+    if not instruments.loaded:
+        load_instruments(db)
+    return instruments.get(ticker)
+
+
 def create_instrument(db: Session, instrument: models.Instrument):
     try:
         existing_instrument = (
@@ -86,7 +116,7 @@ def create_instrument(db: Session, instrument: models.Instrument):
         )
 
         if existing_instrument:
-            logger.error(f"Instrument already exists: {instrument.ticker}")
+            logger.error("Instrument already exists: %s", instrument.ticker)
             raise HTTPException(
                 status_code=status.HTTP_409_CONFLICT,
                 detail=f"Instrument with ticker {instrument.ticker} already exists",
@@ -97,12 +127,14 @@ def create_instrument(db: Session, instrument: models.Instrument):
         )
 
         db.add(db_instrument)
+        add_event(db, instrument_event(instrument.ticker, instrument.name, "CREATED"))
         db.commit()
         db.refresh(db_instrument)
+        instruments.put(instrument_info(db_instrument))
         return db_instrument
     except Exception as e:
         logger.error(
-            f"Error creating instrument {instrument.ticker}: {str(e)}", exc_info=True
+            "Error creating instrument %s: %s", instrument.ticker, e, exc_info=True
         )
         raise
 
@@ -115,97 +147,156 @@ def delete_instrument(db: Session, ticker: str) -> bool:
             .first()
         )
         if not instrument:
-            logger.error(f"Instrument not found for deletion: {ticker}")
+            logger.error("Instrument not found for deletion: %s", ticker)
             return False
-        db.delete(instrument)
-        db.commit()
-        return True
-    except Exception as e:
-        logger.error(f"Error deleting instrument {ticker}: {str(e)}", exc_info=True)
-        raise
-
-
-def get_orderbook(db: Session, ticker: str, limit: int = 10):
-    try:
-        bids_raw = (
+        # Заявки удалятся каскадом, их резервы нужно вернуть владельцам
+        resting = (
             db.query(schemas.Order)
             .filter(
                 schemas.Order.instrument_ticker == ticker,
-                schemas.Order.direction == "BUY",
-                schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
                 schemas.Order.type == "LIMIT",
-                schemas.Order.price != None,
-            )
-            .order_by(schemas.Order.price.desc(), schemas.Order.created_at.asc())
-            .all()
-        )
-
-        asks_raw = (
-            db.query(schemas.Order)
-            .filter(
-                schemas.Order.instrument_ticker == ticker,
-                schemas.Order.direction == "SELL",
                 schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
-                schemas.Order.type == "LIMIT",
-                schemas.Order.price != None,
             )
-            .order_by(schemas.Order.price.asc(), schemas.Order.created_at.asc())
             .all()
         )
+        release_holds(db, resting)
+        journal.reset(db, ticker)
+        add_event(db, instrument_event(ticker, instrument.name, "DELETED"))
+        db.delete(instrument)
+        db.commit()
+        instruments.remove(ticker)
+        books.reset(ticker)
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error("Error deleting instrument %s: %s", ticker, e, exc_info=True)
+        raise
 
-        def aggregate(orders, direction: str):
-            grouped = defaultdict(int)
-            for o in orders:
-                grouped[o.price] += o.quantity - o.filled
-
-            reverse = direction == "BUY"
-            return [
-                Level(price=price, qty=qty)
-                for price, qty in sorted(grouped.items(), reverse=reverse)
-                if qty > 0
-            ]
-
-        bids = aggregate(bids_raw, "BUY")[:limit]
-        asks = aggregate(asks_raw, "SELL")[:limit]
-
-        return bids, asks
 
+def get_orderbook(db: Session, ticker: str, limit: int = 10) -> BookSnapshot:
+    """L2-срез из стакана в памяти, без чтения заявок из БД"""
+    try:
+        return get_book(db, ticker).snapshot(limit)
     except Exception as e:
-        logger.error(f"Error getting orderbook for {ticker}: {str(e)}", exc_info=True)
+        logger.error("Error getting orderbook for %s: %s", ticker, e, exc_info=True)
         raise
 
 
-def get_transactions(db: Session, ticker: str, limit: int = 10):
+def transactions_statement(
+    ticker: str,
+    before: Optional[Cursor] = None,
+    after: Optional[Cursor] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Select:
+    """
+    Сделки по инструменту от новых к старым; с after — от старых к новым,
+    чтобы страницы шли вперёд от курсора.
+    """
+    model = schemas.Transaction
+    stmt = select(model).where(model.instrument_ticker == ticker)
+    if since is not None:
+        stmt = stmt.where(model.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(model.created_at < until)
+    if before is not None:
+        stmt = stmt.where(pagination.before(model, before))
+    if after is not None:
+        stmt = stmt.where(pagination.after(model, after))
+        stmt = stmt.order_by(*pagination.oldest_first(model))
+    else:
+        stmt = stmt.order_by(*pagination.newest_first(model))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def get_transactions(db: Session, ticker: str, limit: int = 10, **filters):
     try:
         return (
-            db.query(schemas.Transaction)
-            .filter(schemas.Transaction.instrument_ticker == ticker)
-            .order_by(schemas.Transaction.created_at.desc())
-            .limit(limit)
+            db.execute(transactions_statement(ticker, limit=limit, **filters))
+            .scalars()
             .all()
         )
     except Exception as e:
-        logger.error(
-            f"Error getting transactions for {ticker}: {str(e)}", exc_info=True
-        )
+        logger.error("Error getting transactions for %s: %s", ticker, e, exc_info=True)
         raise
 
 
-def get_orders(db: Session, user_id: UUID):
+def iter_transactions(
+    db: Session, ticker: str, chunk_size: int = 1000, **filters
+) -> Iterator[List]:
+    """
+    Сделки пачками по chunk_size строк через серверный курсор (yield_per):
+    в памяти одновременно только одна пачка, сколько бы строк ни было.
+    Выбираются колонки таблицы, а не ORM-объекты, чтобы не наполнять
+    identity map сессии.
+    """
+    stmt = transactions_statement(ticker, **filters)
+    stmt = stmt.with_only_columns(*schemas.Transaction.__table__.c)
     try:
-        return db.query(schemas.Order).filter(schemas.Order.user_id == user_id).all()
+        result = db.execute(stmt.execution_options(yield_per=chunk_size))
+        for chunk in result.partitions():
+            yield chunk
     except Exception as e:
         logger.error(
-            f"Error getting orders for user {user_id}: {str(e)}", exc_info=True
+            "Error exporting transactions for %s: %s", ticker, e, exc_info=True
         )
         raise
 
 
+def orders_statement(
+    user_id: UUID,
+    active: bool = False,
+    ticker: Optional[str] = None,
+    order_status: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+) -> Select:
+    """Заявки пользователя от новых к старым с фильтрами и keyset-курсором"""
+    stmt = select(schemas.Order).where(schemas.Order.user_id == user_id)
+    if active:
+        stmt = stmt.where(schemas.ACTIVE_ORDER)
+    if ticker is not None:
+        stmt = stmt.where(schemas.Order.instrument_ticker == ticker)
+    if order_status is not None:
+        stmt = stmt.where(schemas.Order.status == order_status)
+    if since is not None:
+        stmt = stmt.where(schemas.Order.created_at >= since)
+    if until is not None:
+        stmt = stmt.where(schemas.Order.created_at < until)
+    if cursor is not None:
+        stmt = stmt.where(pagination.before(schemas.Order, cursor))
+    stmt = stmt.order_by(*pagination.newest_first(schemas.Order))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+
+def get_orders(db: Session, user_id: UUID, **filters):
+    try:
+        return db.execute(orders_statement(user_id, **filters)).scalars().all()
+    except Exception as e:
+        logger.error("Error getting orders for user %s: %s", user_id, e, exc_info=True)
+        raise
+
+
 def get_order(db: Session, order_id: UUID):
     try:
         return db.query(schemas.Order).filter(schemas.Order.id == order_id).first()
     except Exception as e:
-        logger.error(f"Error getting order {order_id}: {str(e)}", exc_info=True)
+        logger.error("Error getting order %s: %s", order_id, e, exc_info=True)
+        raise
+
+
+def get_orders_by_ids(db: Session, order_ids: List[UUID]):
+    try:
+        return db.query(schemas.Order).filter(schemas.Order.id.in_(order_ids)).all()
+    except Exception as e:
+        logger.error("Error getting orders by ids: %s", e, exc_info=True)
         raise
 
 
@@ -213,98 +304,540 @@ def create_order(
     db: Session,
     order: Union[models.LimitOrderBody, models.MarketOrderBody],
     user_id: UUID,
+    order_id: Optional[UUID] = None,
 ):
+    """
+    order_id задаётся для заявок из топика команд; повторно доставленная
+    команда вернёт уже созданную заявку.
+    """
     try:
+        if order_id is not None:
+            existing = db.get(schemas.Order, order_id)
+            if existing is not None:
+                return existing
+
         instrument = get_instrument(db, order.ticker)
 
         if not instrument:
-            logger.error(f"Invalid ticker for order: {order.ticker}")
+            logger.error("Invalid ticker for order: %s", order.ticker)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid ticker"
             )
 
-        if order.qty <= 0:
-            logger.error(f"Invalid order quantity: {order.qty}")
+        try:
+            db_order, prints = _place_order(db, order, user_id, order_id)
+            committing = time.perf_counter()
+            db.commit()
+            metrics.COMMIT.observe(time.perf_counter() - committing)
+        except Exception:
+            db.rollback()
+            # Стакан мог разойтись с БД — перечитаем его при следующем обращении
+            books.reset(order.ticker)
+            raise
+
+        record_candles(db, order.ticker, prints)
+        db.refresh(db_order)
+        return db_order
+    except Exception as e:
+        logger.error("Error creating order: %s", e, exc_info=True)
+        raise
+
+
+def _place_order(
+    db: Session,
+    order: Union[models.LimitOrderBody, models.MarketOrderBody],
+    user_id: UUID,
+    order_id: Optional[UUID] = None,
+) -> Tuple[schemas.Order, List[Tuple[int, int, datetime]]]:
+    """
+    Проверяет, вставляет и исполняет заявку без коммита.
+    Возвращает заявку и сделки (цена, количество, время) для свечей.
+    Инструмент проверяет вызывающий код.
+    """
+    if order.qty <= 0:
+        logger.error("Invalid order quantity: %s", order.qty)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Order quantity must be greater than zero",
+        )
+
+    if isinstance(order, models.LimitOrderBody) and order.price is None:
+        logger.error("Limit order created without price")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Limit order must include a price",
+        )
+
+    # Рыночная продажа исполняется сразу и не резервирует, только проверяет
+    if order.direction == "SELL" and isinstance(order, models.MarketOrderBody):
+        user_balance = get_balance(db, user_id, order.ticker)
+        if not user_balance or user_balance.amount - user_balance.locked < order.qty:
+            logger.error(
+                "Insufficient balance for sell order: user %s, ticker %s",
+                user_id,
+                order.ticker,
+            )
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Insufficient balance",
+            )
+
+    # Стакан загружается до вставки заявки, иначе она попадёт в него дважды
+    get_book(db, order.ticker)
+
+    db_order = schemas.Order(
+        user_id=user_id,
+        instrument_ticker=order.ticker,
+        direction=order.direction.value,
+        type="LIMIT" if isinstance(order, models.LimitOrderBody) else "MARKET",
+        price=order.price if isinstance(order, models.LimitOrderBody) else None,
+        quantity=order.qty,
+        status="NEW",
+    )
+    if order_id is not None:
+        db_order.id = order_id
+    if db_order.type == "LIMIT":
+        hold_balance(db, user_id, *order_hold(db_order, order.qty))
+    db.add(db_order)
+    db.flush()
+    add_event(db, order_event(db_order, "PLACED"))
+
+    trades = match_order(db, db_order)
+    # После коммита объекты истекут, значения для свечей берём сейчас
+    prints = [(t.price, t.quantity, t.created_at) for t in trades]
+    return db_order, prints
+
+
+def amend_order(
+    db: Session, order_id: UUID, user_id: UUID, amend: models.AmendOrderBody
+) -> schemas.Order:
+    """
+    Изменение цены и/или количества стоящей лимитной заявки одной транзакцией.
+    Уменьшение количества без смены цены сохраняет место в очереди; иначе
+    заявка снимается и ставится заново под тем же id (created_at обновляется,
+    чтобы приоритет сохранился и после перечитывания стакана) и может сразу
+    исполниться по новой цене.
+    """
+    try:
+        order = db.query(schemas.Order).filter(schemas.Order.id == order_id).first()
+        if not order or order.user_id != user_id:
+            logger.error("Order not found for amend: %s", order_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
+            )
+
+        if order.type != "LIMIT" or order.status not in ["NEW", "PARTIALLY_EXECUTED"]:
+            logger.error("Cannot amend order %s - status: %s", order_id, order.status)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Order quantity must be greater than zero",
+                detail="Only active limit orders can be amended",
             )
 
-        if isinstance(order, models.LimitOrderBody) and order.price is None:
-            logger.error("Limit order created without price")
+        price = amend.price if amend.price is not None else order.price
+        qty = amend.qty if amend.qty is not None else order.quantity
+        if qty <= order.filled:
+            logger.error(
+                "Amended quantity %s of order %s not above filled %s",
+                qty,
+                order_id,
+                order.filled,
+            )
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Limit order must include a price",
+                detail="Quantity must be greater than the filled quantity",
             )
 
-        if order.direction == "SELL":
-            user_balance = get_balance(db, user_id, order.ticker)
-            required_amount = order.qty
-            if not user_balance or user_balance.amount < required_amount:
-                logger.error(
-                    f"Insufficient balance for sell order: user {user_id}, ticker {order.ticker}"
-                )
-                raise HTTPException(
-                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-                    detail="Insufficient balance",
-                )
+        requeue = price != order.price or qty > order.quantity
+
+        # Резерв пересчитывается под новый остаток: добирается или освобождается
+        hold_ticker, held = order_hold(order, order.quantity - order.filled)
+        remaining = qty - order.filled
+        needed = remaining if order.direction == "SELL" else remaining * price
+
+        ticker = order.instrument_ticker
+        book = get_book(db, ticker)
+        prints = []
+        try:
+            if needed > held:
+                hold_balance(db, user_id, hold_ticker, needed - held)
+            elif needed < held:
+                apply_balance_deltas(db, {}, {(user_id, hold_ticker): needed - held})
+            if requeue:
+                book.cancel(order.id)
+                journal.cancel(db, ticker, [order.id])
+                order.price = price
+                order.quantity = qty
+                order.created_at = schemas.utcnow()
+                db.flush()
+                add_event(db, order_event(order, "AMENDED"))
+                trades = match_order(db, order)
+                prints = [(t.price, t.quantity, t.created_at) for t in trades]
+            else:
+                order.quantity = qty
+                book.reduce(order.id, qty - order.filled)
+                journal.reduce(db, ticker, order.id, qty - order.filled)
+                add_event(db, order_event(order, "AMENDED"))
+            db.commit()
+        except Exception:
+            db.rollback()
+            books.reset(ticker)
+            raise
+
+        record_candles(db, ticker, prints)
+        db.refresh(order)
+        return order
+    except Exception as e:
+        logger.error("Error amending order %s: %s", order_id, e, exc_info=True)
+        raise
+
+
+BatchItem = Tuple[Optional[schemas.Order], Optional[str]]
+
+
+def execute_batch(
+    db: Session,
+    ticker: str,
+    user_id: UUID,
+    orders: List[Union[models.LimitOrderBody, models.MarketOrderBody]],
+    cancels: List[UUID],
+) -> Tuple[List[BatchItem], List[BatchItem]]:
+    """
+    Пакет заявок одного инструмента в одной транзакции: сначала отмены, затем
+    новые заявки по порядку. Каждая операция — в своей точке сохранения,
+    ошибка одной не отменяет остальные.
+    Возвращает для отмен и для заявок пары (заявка, None) или (None, ошибка).
+    """
+    # Объекты нужны и после коммита, без перечитывания каждого
+    db.expire_on_commit = False
+    cancelled, placed, prints = [], [], []
+
+    def run(fn, *args):
+        version = get_book(db, ticker).version
+        mark = journal.mark(db)
+        try:
+            with db.begin_nested():
+                return fn(*args), None
+        except HTTPException as e:
+            error = e.detail
+        except ValueError as e:
+            error = str(e)
+        journal.discard(db, mark)
+        # Откат точки сохранения не возвращает стакан: перечитываем его
+        book = books.get(ticker)
+        if book is None or book.version != version:
+            books.reset(ticker)
+        return None, error
+
+    try:
+        if get_instrument(db, ticker) is None:
+            logger.error("Invalid ticker for batch: %s", ticker)
+            error = (None, "Invalid ticker")
+            return [error] * len(cancels), [error] * len(orders)
+
+        for order_id in cancels:
+            cancelled.append(run(_cancel_order, db, order_id, user_id))
+        for order in orders:
+            result, error = run(_place_order, db, order, user_id)
+            if result is not None:
+                prints.extend(result[1])
+                result = result[0]
+            placed.append((result, error))
+
+        try:
+            committing = time.perf_counter()
+            db.commit()
+            metrics.COMMIT.observe(time.perf_counter() - committing)
+        except Exception:
+            db.rollback()
+            books.reset(ticker)
+            raise
+    except Exception as e:
+        logger.error("Error executing batch for %s: %s", ticker, e, exc_info=True)
+        raise
+
+    record_candles(db, ticker, prints)
+    for order, _ in cancelled + placed:
+        # Встречные заявки, задетые откатом точки сохранения, истекли
+        if order is not None and inspect(order).expired_attributes:
+            db.refresh(order)
+    return cancelled, placed
+
+
+def reject_order(
+    db: Session,
+    order: Union[models.LimitOrderBody, models.MarketOrderBody],
+    user_id: UUID,
+    order_id: UUID,
+) -> Optional[schemas.Order]:
+    """
+    Сохранить заявку из топика команд, не прошедшую проверки, со статусом
+    REJECTED: клиент уже получил её id. None, если инструмента больше нет.
+    """
+    try:
+        existing = db.get(schemas.Order, order_id)
+        if existing is not None:
+            return existing
+        if get_instrument(db, order.ticker) is None:
+            logger.error(
+                "Cannot record rejected order %s: no %s", order_id, order.ticker
+            )
+            return None
 
         db_order = schemas.Order(
+            id=order_id,
             user_id=user_id,
             instrument_ticker=order.ticker,
             direction=order.direction.value,
             type="LIMIT" if isinstance(order, models.LimitOrderBody) else "MARKET",
             price=order.price if isinstance(order, models.LimitOrderBody) else None,
             quantity=order.qty,
-            status="NEW",
+            status="REJECTED",
         )
         db.add(db_order)
         db.flush()
-
-        match_order(db, db_order)
-
+        add_event(db, order_event(db_order, "REJECTED"))
         db.commit()
         db.refresh(db_order)
         return db_order
     except Exception as e:
-        logger.error(f"Error creating order: {str(e)}", exc_info=True)
+        db.rollback()
+        logger.error("Error rejecting order %s: %s", order_id, e, exc_info=True)
         raise
 
 
-def cancel_order(db: Session, order_id: UUID) -> bool:
+def cancel_order(db: Session, order_id: UUID, user_id: Optional[UUID] = None) -> bool:
     try:
-        order = db.query(schemas.Order).filter(schemas.Order.id == order_id).first()
+        order = _cancel_order(db, order_id, user_id)
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+            books.reset(order.instrument_ticker)
+            raise
+        return True
+    except Exception as e:
+        logger.error("Error cancelling order %s: %s", order_id, e, exc_info=True)
+        raise
+
 
-        if not order:
-            logger.error(f"Order not found for cancellation: {order_id}")
+def get_resting_tickers(
+    db: Session, user_id: UUID, direction: Optional[str] = None
+) -> List[str]:
+    """Инструменты, по которым у пользователя есть заявки в стакане"""
+    try:
+        query = db.query(schemas.Order.instrument_ticker).filter(
+            schemas.Order.user_id == user_id,
+            schemas.Order.type == "LIMIT",
+            schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
+        )
+        if direction is not None:
+            query = query.filter(schemas.Order.direction == direction)
+        return [row.instrument_ticker for row in query.distinct()]
+    except Exception as e:
+        logger.error(
+            "Error getting resting tickers for user %s: %s",
+            user_id,
+            e,
+            exc_info=True,
+        )
+        raise
+
+
+def cancel_all_orders(
+    db: Session, ticker: str, user_id: UUID, direction: Optional[str] = None
+) -> List[UUID]:
+    """
+    Отменяет все стоящие заявки пользователя по инструменту одним UPDATE
+    и снимает их из стакана за один проход. Возвращает id отменённых заявок.
+    """
+    try:
+        conditions = [
+            schemas.Order.user_id == user_id,
+            schemas.Order.instrument_ticker == ticker,
+            schemas.Order.type == "LIMIT",
+            schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
+        ]
+        if direction is not None:
+            conditions.append(schemas.Order.direction == direction)
+
+        result = db.execute(
+            update(schemas.Order)
+            .where(*conditions)
+            .values(status="CANCELLED", updated_at=schemas.utcnow())
+            .returning(
+                schemas.Order.id,
+                schemas.Order.user_id,
+                schemas.Order.instrument_ticker,
+                schemas.Order.direction,
+                schemas.Order.type,
+                schemas.Order.price,
+                schemas.Order.quantity,
+                schemas.Order.filled,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        cancelled = result.all()
+        order_ids = [row.id for row in cancelled]
+        if order_ids:
+            release_holds(db, cancelled)
+            add_event(db, bulk_cancel_event(user_id, ticker, order_ids))
+            # Незагруженный стакан не меняется, но журнал должен знать об отмене
+            journal.cancel(db, ticker, order_ids)
+            # До коммита: снимок, который запишет журнал после него, уже без
+            # отменённых. Незагруженный стакан прочитает отменённое состояние
+            book = books.get(ticker)
+            if book is not None:
+                book.cancel_many(order_ids)
+        try:
+            db.commit()
+        except Exception:
+            db.rollback()
+            books.reset(ticker)
+            raise
+        logger.info(
+            "Cancelled %s orders of user %s in %s", len(order_ids), user_id, ticker
+        )
+        return order_ids
+    except Exception as e:
+        db.rollback()
+        logger.error(
+            "Error cancelling orders of user %s in %s: %s",
+            user_id,
+            ticker,
+            e,
+            exc_info=True,
+        )
+        raise
+
+
+def _cancel_order(
+    db: Session, order_id: UUID, user_id: Optional[UUID] = None
+) -> schemas.Order:
+    """Отменяет заявку без коммита и снимает её из стакана"""
+    order = db.query(schemas.Order).filter(schemas.Order.id == order_id).first()
+
+    if not order or (user_id is not None and order.user_id != user_id):
+        logger.error("Order not found for cancellation: %s", order_id)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
+        )
+
+    if order.type == "MARKET":
+        if order.status != "NEW" or order.filled > 0:
+            logger.error(
+                "Cannot cancel market order %s - status: %s, filled: %s",
+                order_id,
+                order.status,
+                order.filled,
+            )
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
+                status_code=status.HTTP_402_PAYMENT_REQUIRED,
+                detail="Cannot cancel market order (already executed or processing)",
+            )
+    else:
+        if order.status not in ["NEW", "PARTIALLY_EXECUTED"]:
+            logger.error(
+                "Cannot cancel limit order %s - status: %s", order_id, order.status
+            )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=(
+                    "Cannot cancel limit order "
+                    "(already executed, cancelled, or rejected)"
+                ),
             )
 
-        if order.type == "MARKET":
-            if order.status != "NEW" or order.filled > 0:
-                logger.error(
-                    f"Cannot cancel market order {order_id} - status: {order.status}, filled: {order.filled}"
-                )
-                raise HTTPException(
-                    status_code=status.HTTP_402_PAYMENT_REQUIRED,
-                    detail="Cannot cancel market order (already executed or processing)",
-                )
-        else:
-            if order.status not in ["NEW", "PARTIALLY_EXECUTED"]:
-                logger.error(
-                    f"Cannot cancel limit order {order_id} - status: {order.status}"
-                )
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Cannot cancel limit order (already executed, cancelled, or rejected)",
+    order.status = "CANCELLED"
+    add_event(db, order_event(order, "CANCELLED"))
+    release_holds(db, [order])
+    db.flush()
+
+    get_book(db, order.instrument_ticker).cancel(order.id)
+    journal.cancel(db, order.instrument_ticker, [order.id])
+    return order
+
+
+def add_event(db: Session, event: Event):
+    """
+    Записать событие в outbox без коммита: оно уйдёт в Kafka, только если
+    транзакция изменения зафиксируется.
+    """
+    topic, key, payload, payload_schema = event
+    db.add(
+        schemas.OutboxEvent(
+            topic=topic, key=key, payload=payload, payload_schema=payload_schema
+        )
+    )
+
+
+def claim_outbox_batch(
+    db: Session, limit: int, lease: float
+) -> List[schemas.OutboxEvent]:
+    """
+    Первые limit событий по порядку записи, закреплённые за вызывающим на
+    lease секунд. Транзакция коммитится сразу: отправка в Kafka идёт без неё.
+    Пока пачка другого ретранслятора не отправлена и не истекла, возвращает
+    пустой список, иначе события инструмента ушли бы не по порядку.
+    """
+    model = schemas.OutboxEvent
+    try:
+        now = schemas.utcnow()
+        # Блокировка первых строк: второй ретранслятор дождётся коммита и
+        # увидит их уже закреплёнными
+        events = (
+            db.execute(select(model).order_by(model.id).limit(limit).with_for_update())
+            .scalars()
+            .all()
+        )
+        if (
+            not events
+            or db.execute(
+                select(model.id).where(
+                    model.id == events[0].id, model.claimed_until > now
                 )
+            ).first()
+        ):
+            db.rollback()
+            return []
+        db.execute(
+            update(model)
+            .where(model.id.in_([event.id for event in events]))
+            .values(claimed_until=now + timedelta(seconds=lease))
+        )
+        # Отправляются уже после коммита, без повторного чтения
+        db.expunge_all()
+        db.commit()
+        return events
+    except Exception as e:
+        db.rollback()
+        logger.error("Error claiming outbox batch: %s", e, exc_info=True)
+        raise
 
-        order.status = "CANCELLED"
+
+def release_outbox_events(db: Session, event_ids: List[int]):
+    """Снять закрепление, чтобы пачку можно было отправить снова сразу"""
+    try:
+        db.execute(
+            update(schemas.OutboxEvent)
+            .where(schemas.OutboxEvent.id.in_(event_ids))
+            .values(claimed_until=None)
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error("Error releasing outbox events: %s", e, exc_info=True)
+        raise
+
+
+def delete_outbox_events(db: Session, event_ids: List[int]):
+    try:
+        db.execute(
+            delete(schemas.OutboxEvent).where(schemas.OutboxEvent.id.in_(event_ids))
+        )
         db.commit()
-        return True
     except Exception as e:
-        logger.error(f"Error cancelling order {order_id}: {str(e)}", exc_info=True)
+        db.rollback()
+        logger.error("Error deleting outbox events: %s", e, exc_info=True)
         raise
 
 
@@ -319,7 +852,10 @@ def get_balance(db: Session, user_id: UUID, ticker: str):
         )
     except Exception as e:
         logger.error(
-            f"Error getting balance for user {user_id}, ticker {ticker}: {str(e)}",
+            "Error getting balance for user %s, ticker %s: %s",
+            user_id,
+            ticker,
+            e,
             exc_info=True,
         )
         raise
@@ -332,7 +868,7 @@ def get_balances(db: Session, user_id: UUID):
         )
     except Exception as e:
         logger.error(
-            f"Error getting balances for user {user_id}: {str(e)}", exc_info=True
+            "Error getting balances for user %s: %s", user_id, e, exc_info=True
         )
         raise
 
@@ -341,7 +877,7 @@ def update_balance(db: Session, user_id: UUID, ticker: str, amount: int):
     try:
         user = db.query(schemas.User).filter(schemas.User.id == user_id).first()
         if user is None:
-            logger.error(f"User not found for balance update: {user_id}")
+            logger.error("User not found for balance update: %s", user_id)
             raise HTTPException(status_code=404, detail=f"User {user_id} not found")
 
         balance = (
@@ -349,11 +885,13 @@ def update_balance(db: Session, user_id: UUID, ticker: str, amount: int):
             .filter(
                 schemas.Balance.user_id == user_id, schemas.Balance.ticker == ticker
             )
+            .with_for_update()
             .first()
         )
 
-        if balance and (balance.amount + amount < 0):
-            logger.error(f"Insufficient balance for user {user_id}, ticker {ticker}")
+        # Зарезервированное под заявки списать нельзя
+        if balance and (balance.amount + amount < balance.locked):
+            logger.error("Insufficient balance for user %s, ticker %s", user_id, ticker)
             raise ValueError("Insufficient balance to deduct")
 
         if balance:
@@ -367,203 +905,461 @@ def update_balance(db: Session, user_id: UUID, ticker: str, amount: int):
         return balance
     except Exception as e:
         logger.error(
-            f"Error updating balance for user {user_id}, ticker {ticker}: {str(e)}",
+            "Error updating balance for user %s, ticker %s: %s",
+            user_id,
+            ticker,
+            e,
+            exc_info=True,
+        )
+        raise
+
+
+def apply_balance_deltas(
+    db: Session,
+    deltas: Dict[Tuple[UUID, str], int],
+    locked: Optional[Dict[Tuple[UUID, str], int]] = None,
+):
+    """
+    Применяет изменения балансов и резервов одним INSERT ... ON CONFLICT DO UPDATE.
+    Не коммитит: вызывается внутри транзакции исполнения заявки.
+    """
+    locked = locked or {}
+    # Единый порядок строк — единый порядок блокировок между очередями тикеров
+    rows = [
+        {
+            "user_id": user_id,
+            "ticker": ticker,
+            "amount": deltas.get((user_id, ticker), 0),
+            "locked": locked.get((user_id, ticker), 0),
+        }
+        for user_id, ticker in sorted(
+            set(deltas) | set(locked), key=lambda key: (str(key[0]), key[1])
+        )
+    ]
+    rows = [row for row in rows if row["amount"] != 0 or row["locked"] != 0]
+    if not rows:
+        return
+
+    try:
+        stmt = _insert(db, schemas.Balance).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[schemas.Balance.user_id, schemas.Balance.ticker],
+            set_={
+                "amount": schemas.Balance.amount + stmt.excluded.amount,
+                "locked": schemas.Balance.locked + stmt.excluded.locked,
+            },
+        ).returning(
+            schemas.Balance.user_id,
+            schemas.Balance.ticker,
+            schemas.Balance.amount,
+            schemas.Balance.locked,
+        )
+        result = db.execute(stmt).all()
+    except Exception as e:
+        logger.error("Error applying balance deltas: %s", e, exc_info=True)
+        raise
+
+    for row in result:
+        if row.locked < 0 or row.amount < row.locked:
+            logger.error(
+                "Insufficient balance for user %s, ticker %s", row.user_id, row.ticker
+            )
+            raise ValueError("Insufficient balance to deduct")
+
+        # Загруженные в сессию балансы иначе остались бы со старыми суммами
+        cached = db.identity_map.get(
+            db.identity_key(schemas.Balance, (row.user_id, row.ticker))
+        )
+        if cached is not None:
+            set_committed_value(cached, "amount", row.amount)
+            set_committed_value(cached, "locked", row.locked)
+
+
+def order_hold(order: schemas.Order, qty: int) -> Tuple[str, int]:
+    """
+    Резерв под qty единиц лимитной заявки: бумаги для продажи, рубли по
+    цене заявки для покупки. Возвращает (тикер баланса, сумма).
+    """
+    if order.direction == "SELL":
+        return order.instrument_ticker, qty
+    return "RUB", qty * order.price
+
+
+def hold_balance(db: Session, user_id: UUID, ticker: str, amount: int):
+    """Резервирует свободные средства под заявку без коммита"""
+    balance = (
+        db.query(schemas.Balance)
+        .filter(schemas.Balance.user_id == user_id, schemas.Balance.ticker == ticker)
+        .with_for_update()
+        .first()
+    )
+    if balance is None or balance.amount - balance.locked < amount:
+        logger.error(
+            "Insufficient balance to hold: user %s, ticker %s", user_id, ticker
+        )
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Insufficient balance",
+        )
+    balance.locked += amount
+
+
+def release_holds(db: Session, orders: List[schemas.Order]):
+    """Снимает резервы неисполненных остатков лимитных заявок без коммита"""
+    released: Dict[Tuple[UUID, str], int] = {}
+    for order in orders:
+        if order.type != "LIMIT" or order.quantity <= order.filled:
+            continue
+        ticker, amount = order_hold(order, order.quantity - order.filled)
+        key = (order.user_id, ticker)
+        released[key] = released.get(key, 0) - amount
+    apply_balance_deltas(db, {}, released)
+
+
+def _insert(db: Session, table):
+    """INSERT с ON CONFLICT для диалекта текущей БД"""
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite_insert(table)
+    return pg_insert(table)
+
+
+def save_candles(db: Session, closed: List[Candle]):
+    """
+    Сохраняет свечи. Если свеча с тем же началом уже есть (часть, сохранённая
+    до перезапуска), они сливаются: объём добавляется сверх saved_volume.
+    """
+    if not closed:
+        return
+    try:
+        stmt = _insert(db, schemas.Candle).values(
+            [
+                {
+                    "ticker": c.ticker,
+                    "interval": c.interval,
+                    "start_time": datetime.fromtimestamp(c.start, timezone.utc),
+                    "open": c.open,
+                    "high": c.high,
+                    "low": c.low,
+                    "close": c.close,
+                    "volume": c.volume - c.saved_volume,
+                }
+                for c in closed
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                schemas.Candle.ticker,
+                schemas.Candle.interval,
+                schemas.Candle.start_time,
+            ],
+            set_={
+                "high": case(
+                    (stmt.excluded.high > schemas.Candle.high, stmt.excluded.high),
+                    else_=schemas.Candle.high,
+                ),
+                "low": case(
+                    (stmt.excluded.low < schemas.Candle.low, stmt.excluded.low),
+                    else_=schemas.Candle.low,
+                ),
+                "close": stmt.excluded.close,
+                "volume": schemas.Candle.volume + stmt.excluded.volume,
+            },
+        )
+        db.execute(stmt)
+        db.commit()
+    except Exception as e:
+        logger.error("Error saving candles: %s", e, exc_info=True)
+        db.rollback()
+        raise
+
+
+def get_candle_history(
+    db: Session, ticker: str, interval: str, start: int, end: int
+) -> List[Candle]:
+    """Свечи из БД с началом в [start, end), время — unix-секунды"""
+    try:
+        rows = (
+            db.query(schemas.Candle)
+            .filter(
+                schemas.Candle.ticker == ticker,
+                schemas.Candle.interval == interval,
+                schemas.Candle.start_time
+                >= datetime.fromtimestamp(start, timezone.utc),
+                schemas.Candle.start_time < datetime.fromtimestamp(end, timezone.utc),
+            )
+            .order_by(schemas.Candle.start_time.asc())
+            .all()
+        )
+        return [candle_from_row(row) for row in rows]
+    except Exception as e:
+        logger.error(
+            "Error getting candles for %s (%s): %s",
+            ticker,
+            interval,
+            e,
             exc_info=True,
         )
         raise
 
 
+def get_open_candles(db: Session) -> List[Candle]:
+    """Сохранённые свечи, интервал которых ещё не закончился"""
+    now = int(time.time())
+    try:
+        rows = []
+        for interval, seconds in INTERVALS.items():
+            since = now - now % seconds
+            rows.extend(
+                db.query(schemas.Candle).filter(
+                    schemas.Candle.interval == interval,
+                    schemas.Candle.start_time
+                    >= datetime.fromtimestamp(since, timezone.utc),
+                )
+            )
+    except Exception as e:
+        logger.error("Error getting open candles: %s", e, exc_info=True)
+        raise
+
+    open_candles = []
+    for row in rows:
+        candle = candle_from_row(row)
+        candle.saved_volume = candle.volume
+        open_candles.append(candle)
+    return open_candles
+
+
+def candle_from_row(row: schemas.Candle) -> Candle:
+    start = row.start_time
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return Candle(
+        ticker=row.ticker,
+        interval=row.interval,
+        start=int(start.timestamp()),
+        open=row.open,
+        high=row.high,
+        low=row.low,
+        close=row.close,
+        volume=row.volume,
+    )
+
+
 def delete_user(db: Session, user_id: UUID):
     try:
         user = db.query(schemas.User).filter(schemas.User.id == user_id).first()
         if user:
             db.delete(user)
             db.commit()
+            auth_cache.invalidate_user(user_id)
             return True
-        logger.error(f"User not found for deletion: {user_id}")
+        logger.error("User not found for deletion: %s", user_id)
         return False
     except Exception as e:
-        logger.error(f"Error deleting user {user_id}: {str(e)}", exc_info=True)
+        logger.error("Error deleting user %s: %s", user_id, e, exc_info=True)
         raise
 
 
-def match_order(db: Session, new_order: schemas.Order):
+def record_candles(db: Session, ticker: str, prints: List[Tuple[int, int, datetime]]):
+    """
+    Обновляет свечи по сделкам (цена, количество, время) уже закоммиченной
+    заявки. Ошибка записи свечей не должна отменять исполнение.
+    """
+    closed = []
+    for price, qty, ts in prints:
+        closed.extend(candles.on_trade(ticker, price, qty, ts))
     try:
-        is_market_order = new_order.type == "MARKET"
-        opposite_side = "BUY" if new_order.direction == "SELL" else "SELL"
+        save_candles(db, closed)
+    except Exception:
+        # Уже залогировано в save_candles
+        pass
+
+
+def get_book(db: Session, ticker: str) -> OrderBook:
+    """
+    Стакан инструмента. При первом обращении берётся восстановленный из
+    журнала, иначе загружается из таблицы orders.
+    """
+
+    def load() -> OrderBook:
+        book = journal.recovered(ticker)
+        if book is None:
+            book = load_book(db, ticker)
+            journal.loaded(db, ticker)
+        return book
+
+    return books.get_or_load(ticker, load)
+
+
+def book_statement(ticker: str) -> Select:
+    """Стоящие заявки инструмента в порядке поступления"""
+    return (
+        select(schemas.Order)
+        .where(
+            schemas.Order.instrument_ticker == ticker,
+            schemas.Order.type == "LIMIT",
+            schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
+        )
+        .order_by(schemas.Order.created_at.asc())
+    )
 
-        with db.begin_nested():
-            base_query = db.query(schemas.Order).filter(
-                schemas.Order.instrument_ticker == new_order.instrument_ticker,
-                schemas.Order.direction == opposite_side,
-                schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
-                schemas.Order.price.isnot(None),
-            )
 
-            if not is_market_order:
-                if new_order.direction == "BUY":
-                    base_query = base_query.filter(
-                        schemas.Order.price <= new_order.price
-                    )
-                else:
-                    base_query = base_query.filter(
-                        schemas.Order.price >= new_order.price
-                    )
-
-            matching_orders = (
-                base_query.order_by(
-                    (
-                        schemas.Order.price.asc()
-                        if new_order.direction == "BUY"
-                        else schemas.Order.price.desc()
-                    ),
-                    schemas.Order.created_at.asc(),
+def load_book(db: Session, ticker: str) -> OrderBook:
+    try:
+        resting = db.execute(book_statement(ticker)).scalars().all()
+    except Exception as e:
+        logger.error("Error loading orderbook for %s: %s", ticker, e, exc_info=True)
+        raise
+
+    book = OrderBook(ticker)
+    for o in resting:
+        if o.quantity > o.filled:
+            book.add(
+                BookOrder(
+                    id=o.id,
+                    user_id=o.user_id,
+                    direction=o.direction,
+                    price=o.price,
+                    remaining=o.quantity - o.filled,
                 )
-                .with_for_update()
-                .all()
             )
+    logger.info("Orderbook for %s loaded: %s resting orders", ticker, len(book.orders))
+    return book
+
+
+def _match_in_book(
+    db: Session, new_order: schemas.Order, qty: int, budget: Optional[int]
+) -> Tuple[List[Fill], Dict[UUID, schemas.Order]]:
+    """Исполнение по стакану в памяти и встречные заявки сделок из БД"""
+    ticker = new_order.instrument_ticker
+    book = get_book(db, ticker)
+    journal.order(db, new_order, qty, budget)
+    scanning = time.perf_counter()
+    fills = book.match(
+        new_order.direction,
+        qty,
+        new_order.price if new_order.type == "LIMIT" else None,
+        spend_from(budget) if budget is not None else None,
+    )
+    metrics.SCAN.observe(time.perf_counter() - scanning)
+    journal.fills(db, ticker, fills)
+
+    counter_orders = {}
+    if fills:
+        counter_orders = {
+            o.id: o
+            for o in db.query(schemas.Order).filter(
+                schemas.Order.id.in_([f.maker_id for f in fills])
+            )
+        }
+    return fills, counter_orders
 
-            qty_to_fill = new_order.quantity - new_order.filled
-            trades = []
-
-            for counter_order in matching_orders:
-                if qty_to_fill <= 0:
-                    break
-
-                available_qty = counter_order.quantity - counter_order.filled
-                trade_qty = min(qty_to_fill, available_qty)
-
-                if trade_qty <= 0:
-                    continue
-
-                trade_price = counter_order.price
-
-                if new_order.direction == "BUY":
-                    buyer_rub_balance = get_balance(db, new_order.user_id, "RUB")
-                    seller_ticker_balance = get_balance(
-                        db, counter_order.user_id, new_order.instrument_ticker
-                    )
-
-                    required_rub = trade_qty * trade_price
-
-                    if not buyer_rub_balance or buyer_rub_balance.amount < required_rub:
-                        logger.error(f"Insufficient RUB for user {new_order.user_id}")
-                        continue
-
-                    if (
-                        not seller_ticker_balance
-                        or seller_ticker_balance.amount < trade_qty
-                    ):
-                        logger.error(
-                            f"Insufficient {new_order.instrument_ticker} for user {counter_order.user_id}"
-                        )
-                        continue
-                else:
-                    seller_ticker_balance = get_balance(
-                        db, new_order.user_id, new_order.instrument_ticker
-                    )
-                    buyer_rub_balance = get_balance(db, counter_order.user_id, "RUB")
-
-                    required_rub = trade_qty * trade_price
-
-                    if (
-                        not seller_ticker_balance
-                        or seller_ticker_balance.amount < trade_qty
-                    ):
-                        logger.error(
-                            f"Insufficient {new_order.instrument_ticker} for user {new_order.user_id}"
-                        )
-                        continue
-
-                    if not buyer_rub_balance or buyer_rub_balance.amount < required_rub:
-                        logger.error(
-                            f"Insufficient RUB for user {counter_order.user_id}"
-                        )
-                        continue
-
-                trade = schemas.Transaction(
-                    instrument_ticker=new_order.instrument_ticker,
-                    price=trade_price,
-                    quantity=trade_qty,
-                    buyer_id=(
-                        new_order.user_id
-                        if new_order.direction == "BUY"
-                        else counter_order.user_id
-                    ),
-                    seller_id=(
-                        counter_order.user_id
-                        if new_order.direction == "BUY"
-                        else new_order.user_id
-                    ),
-                    created_at=datetime.utcnow(),
-                )
-                db.add(trade)
-                trades.append(trade)
 
-                new_order.filled += trade_qty
-                counter_order.filled += trade_qty
+def match_order(db: Session, new_order: schemas.Order):
+    """
+    Исполняет заявку по стакану в памяти.
+    Таблица orders обновляется только для фактически исполненных встречных заявок,
+    балансы и освобождаемые резервы — одной записью по всем сделкам. Сделки
+    и смены статусов обеих сторон пишутся в outbox. Коммит делает вызывающий код.
+    Возвращает созданные сделки.
+    """
+    ticker = new_order.instrument_ticker
+    status_before = {new_order.id: new_order.status}
+    try:
+        is_buy = new_order.direction == "BUY"
+
+        # Лимитные заявки обеих сторон исполняются из резерва, проверять
+        # приходится только рубли рыночной покупки
+        budget = None
+        if is_buy and new_order.type == "MARKET":
+            balance = get_balance(db, new_order.user_id, "RUB")
+            budget = balance.amount - balance.locked if balance else 0
+
+        qty = new_order.quantity - new_order.filled
+        mark = journal.mark(db)
+        fills, counter_orders = _match_in_book(db, new_order, qty, budget)
+        stale = {f.maker_id for f in fills if f.maker_id not in counter_orders}
+        if stale:
+            # Встречных заявок уже нет в БД (удалены каскадом в обход стакана):
+            # стакан перечитывается, исполнение повторяется по нему
+            logger.warning(
+                "Book of %s has %s orders missing in database, reloading",
+                ticker,
+                len(stale),
+            )
+            journal.discard(db, mark)
+            books.reset(ticker)
+            journal.reset(db, ticker)
+            # Заявка уже вставлена и попадёт в перечитанный стакан
+            get_book(db, ticker).cancel(new_order.id)
+            fills, counter_orders = _match_in_book(db, new_order, qty, budget)
+        book = get_book(db, ticker)
+        status_before.update((o.id, o.status) for o in counter_orders.values())
+        settling = time.perf_counter()
+
+        settlement = Settlement()
+        trades = []
+        now = datetime.utcnow()
+        for fill in fills:
+            counter_order = counter_orders[fill.maker_id]
+            buyer_id = new_order.user_id if is_buy else counter_order.user_id
+            seller_id = counter_order.user_id if is_buy else new_order.user_id
+
+            trade = schemas.Transaction(
+                instrument_ticker=ticker,
+                price=fill.price,
+                quantity=fill.qty,
+                buyer_id=buyer_id,
+                seller_id=seller_id,
+                created_at=now,
+            )
+            db.add(trade)
+            trades.append(trade)
+            settlement.trade(buyer_id, seller_id, ticker, fill.qty, fill.price)
+            settlement.release(
+                counter_order.user_id, *order_hold(counter_order, fill.qty)
+            )
+            if new_order.type == "LIMIT":
+                settlement.release(new_order.user_id, *order_hold(new_order, fill.qty))
+
+            new_order.filled += fill.qty
+            counter_order.filled += fill.qty
+            counter_order.status = (
+                "EXECUTED"
+                if counter_order.filled == counter_order.quantity
+                else "PARTIALLY_EXECUTED"
+            )
 
-                new_order.status = (
-                    "EXECUTED"
-                    if new_order.filled == new_order.quantity
-                    else "PARTIALLY_EXECUTED" if new_order.filled > 0 else "NEW"
-                )
-                counter_order.status = (
-                    "EXECUTED"
-                    if counter_order.filled == counter_order.quantity
-                    else "PARTIALLY_EXECUTED"
+        if new_order.filled > 0:
+            new_order.status = (
+                "EXECUTED"
+                if new_order.filled == new_order.quantity
+                else "PARTIALLY_EXECUTED"
+            )
+
+        if new_order.type == "LIMIT" and new_order.filled < new_order.quantity:
+            book.add(
+                BookOrder(
+                    id=new_order.id,
+                    user_id=new_order.user_id,
+                    direction=new_order.direction,
+                    price=new_order.price,
+                    remaining=new_order.quantity - new_order.filled,
                 )
+            )
 
-                db.add(new_order)
-                db.add(counter_order)
-                qty_to_fill -= trade_qty
+        apply_balance_deltas(db, settlement.deltas, settlement.locked)
+        db.flush()
 
         for trade in trades:
-            try:
-                if new_order.direction == "BUY":
-                    update_balance(
-                        db, trade.buyer_id, new_order.instrument_ticker, trade.quantity
-                    )
-                    update_balance(
-                        db, trade.buyer_id, "RUB", -trade.quantity * trade.price
-                    )
-                    update_balance(
-                        db, trade.seller_id, "RUB", trade.quantity * trade.price
-                    )
-                    update_balance(
-                        db,
-                        trade.seller_id,
-                        new_order.instrument_ticker,
-                        -trade.quantity,
-                    )
-                else:
-                    update_balance(
-                        db, trade.seller_id, "RUB", trade.quantity * trade.price
-                    )
-                    update_balance(
-                        db,
-                        trade.seller_id,
-                        new_order.instrument_ticker,
-                        -trade.quantity,
-                    )
-                    update_balance(
-                        db, trade.buyer_id, new_order.instrument_ticker, trade.quantity
-                    )
-                    update_balance(
-                        db, trade.buyer_id, "RUB", -trade.quantity * trade.price
-                    )
-            except ValueError as e:
-                logger.error(f"Balance update failed for trade {trade.id}: {str(e)}")
-                db.rollback()
-                raise
-
-        db.commit()
-        db.refresh(new_order)
-        return new_order
+            add_event(db, trade_event(trade))
+        for order in [new_order, *counter_orders.values()]:
+            if order.status != status_before[order.id]:
+                add_event(db, order_status_event(order, now))
+        metrics.SETTLEMENT.observe(time.perf_counter() - settling)
+        return trades
 
     except Exception as e:
         logger.error(
-            f"Order matching failed for order {new_order.id}: {str(e)}", exc_info=True
+            "Order matching failed for order %s: %s", new_order.id, e, exc_info=True
         )
-        db.rollback()
         raise
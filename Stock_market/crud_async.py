@@ -0,0 +1,416 @@
+"""
+Асинхронные версии функций crud для роутеров.
+
+С AsyncSession запросы выполняются через async-драйвер; с обычной Session
+вызывается синхронная функция из crud в пуле потоков, так что event loop
+не блокируется в обоих режимах.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+import crud
+import models
+import schemas
+from cache import InstrumentInfo, auth_cache, instruments, remote_books
+from database import DbSession, SessionLocal
+from kafka.consumer import ingestor
+from kafka.producer import instrument_event
+from matching.book import BookSnapshot, OrderBook, books
+from matching.candles import Candle, candles
+from matching.sequencer import sequencer
+
+logger = logging.getLogger(__name__)
+
+
+async def refresh(db: DbSession, obj):
+    if isinstance(db, AsyncSession):
+        await db.refresh(obj)
+    else:
+        await run_in_threadpool(db.refresh, obj)
+
+
+async def rollback(db: DbSession):
+    if isinstance(db, AsyncSession):
+        await db.rollback()
+    else:
+        await run_in_threadpool(db.rollback)
+
+
+async def get_user(db: DbSession, user_id: UUID):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_user, db, user_id)
+    try:
+        result = await db.execute(
+            select(schemas.User).where(schemas.User.id == user_id)
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error("Error getting user %s: %s", user_id, e, exc_info=True)
+        raise
+
+
+async def get_user_by_api_key(db: DbSession, api_key: str):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_user_by_api_key, db, api_key)
+    try:
+        result = await db.execute(
+            select(schemas.User).where(schemas.User.api_key == api_key)
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error("Error getting user by API key: %s", e, exc_info=True)
+        raise
+
+
+async def create_user(db: DbSession, user: models.NewUser):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.create_user, db, user)
+    try:
+        db_user = schemas.User(name=user.name, api_key=str(uuid.uuid4()))
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        logger.info("New user created: %s", db_user.name)
+        return db_user
+    except IntegrityError as e:
+        logger.error("User creation failed (duplicate name?): %s", e)
+        raise
+    except Exception as e:
+        logger.error("Error creating user: %s", e, exc_info=True)
+        raise
+
+
+async def delete_user(db: DbSession, user_id: UUID):
+    # Заявки пользователя удалятся каскадом: сначала они снимаются из
+    # стаканов в очередях их инструментов
+    tickers = await get_resting_tickers(db, user_id)
+    for ticker in tickers:
+        await sequencer.submit(ticker, crud.cancel_all_orders, ticker, user_id)
+    if tickers:
+        # Транзакция запроса читала до отмен: на SQLite она уже не сможет
+        # писать. Пользователь перечитывается ниже
+        await rollback(db)
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.delete_user, db, user_id)
+    try:
+        user = await get_user(db, user_id)
+        if user:
+            await db.delete(user)
+            await db.commit()
+            auth_cache.invalidate_user(user_id)
+            return True
+        logger.error("User not found for deletion: %s", user_id)
+        return False
+    except Exception as e:
+        logger.error("Error deleting user %s: %s", user_id, e, exc_info=True)
+        raise
+
+
+async def load_instruments(db: DbSession):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.load_instruments, db)
+    try:
+        result = await db.execute(select(schemas.Instrument))
+        rows = result.scalars().all()
+        instruments.replace(crud.instrument_info(row) for row in rows)
+        logger.info("Loaded %s instruments", len(rows))
+    except Exception as e:
+        logger.error("Error loading instruments: %s", e, exc_info=True)
+        raise
+
+
+async def get_instruments(db: DbSession, skip: int = 0, limit: int = 100):
+    if not instruments.loaded:
+        await load_instruments(db)
+    return instruments.active(skip, limit)
+
+
+async def get_instrument(db: DbSession, ticker: str) -> Optional[InstrumentInfo]:
+    if not instruments.loaded:
+        await load_instruments(db)
+    return instruments.get(ticker)
+
+
+async def create_instrument(db: DbSession, instrument: models.Instrument):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.create_instrument, db, instrument)
+    try:
+        # Реестр мог ещё не получить событие другого процесса
+        existing = await db.get(schemas.Instrument, instrument.ticker)
+        if existing is not None:
+            logger.error("Instrument already exists: %s", instrument.ticker)
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Instrument with ticker {instrument.ticker} already exists",
+            )
+
+        db_instrument = schemas.Instrument(
+            ticker=instrument.ticker, name=instrument.name
+        )
+        db.add(db_instrument)
+        crud.add_event(
+            db, instrument_event(instrument.ticker, instrument.name, "CREATED")
+        )
+        await db.commit()
+        await db.refresh(db_instrument)
+        instruments.put(crud.instrument_info(db_instrument))
+        return db_instrument
+    except Exception as e:
+        logger.error(
+            "Error creating instrument %s: %s", instrument.ticker, e, exc_info=True
+        )
+        raise
+
+
+async def delete_instrument(db: DbSession, ticker: str) -> bool:
+    # Удаление снимает резервы стоящих заявок, поэтому идёт в очереди
+    # инструмента, а не параллельно с исполнением
+    return await sequencer.submit(ticker, crud.delete_instrument, ticker)
+
+
+def _read_book(ticker: str) -> OrderBook:
+    db = SessionLocal()
+    try:
+        return crud.load_book(db, ticker)
+    finally:
+        db.close()
+
+
+# Чтения стаканов других узлов в процессе: одно на тикер
+_remote_loads: Dict[str, asyncio.Future] = {}
+
+
+async def get_orderbook(ticker: str, limit: int = 10) -> BookSnapshot:
+    """
+    Срез стакана из памяти. Если стакан ещё не загружен, он загружается
+    в очереди инструмента, а не в запросе.
+    """
+    if not ingestor.owns(ticker):
+        # Стакан ведёт другой узел: в памяти он был бы устаревшим. Читается
+        # из БД вне очереди инструмента и отдаётся REMOTE_BOOK_TTL секунд
+        book = remote_books.get(ticker)
+        if book is None:
+            loading = _remote_loads.get(ticker)
+            if loading is None:
+                loading = asyncio.ensure_future(run_in_threadpool(_read_book, ticker))
+                _remote_loads[ticker] = loading
+                loading.add_done_callback(lambda _: _remote_loads.pop(ticker, None))
+            book = await asyncio.shield(loading)
+            remote_books.set(ticker, book)
+        return book.snapshot(limit)
+
+    book = books.get(ticker)
+    if book is None:
+        book = await sequencer.submit(ticker, crud.get_book, ticker)
+    return book.snapshot(limit)
+
+
+async def get_transactions(db: DbSession, ticker: str, limit: int = 10, **filters):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(
+            crud.get_transactions, db, ticker, limit, **filters
+        )
+    try:
+        result = await db.execute(
+            crud.transactions_statement(ticker, limit=limit, **filters)
+        )
+        return result.scalars().all()
+    except Exception as e:
+        logger.error("Error getting transactions for %s: %s", ticker, e, exc_info=True)
+        raise
+
+
+async def get_candle_history(
+    db: DbSession, ticker: str, interval: str, start: int, end: int
+) -> List[Candle]:
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(
+            crud.get_candle_history, db, ticker, interval, start, end
+        )
+    try:
+        result = await db.execute(
+            select(schemas.Candle)
+            .where(
+                schemas.Candle.ticker == ticker,
+                schemas.Candle.interval == interval,
+                schemas.Candle.start_time
+                >= datetime.fromtimestamp(start, timezone.utc),
+                schemas.Candle.start_time < datetime.fromtimestamp(end, timezone.utc),
+            )
+            .order_by(schemas.Candle.start_time.asc())
+        )
+        return [crud.candle_from_row(row) for row in result.scalars().all()]
+    except Exception as e:
+        logger.error(
+            "Error getting candles for %s (%s): %s",
+            ticker,
+            interval,
+            e,
+            exc_info=True,
+        )
+        raise
+
+
+async def get_candles(
+    db: DbSession, ticker: str, interval: str, start: int, end: int
+) -> List[Candle]:
+    """
+    Свечи с началом в [start, end). Свежая часть берётся из памяти,
+    в БД идёт запрос только за диапазон раньше самой ранней свечи в памяти.
+    """
+    recent, earliest = candles.get(ticker, interval, start, end)
+    if earliest is not None and earliest <= start:
+        return recent
+
+    history_end = end if earliest is None else min(end, earliest)
+    history = await get_candle_history(db, ticker, interval, start, history_end)
+    return history + recent
+
+
+async def get_orders(db: DbSession, user_id: UUID, **filters):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_orders, db, user_id, **filters)
+    try:
+        result = await db.execute(crud.orders_statement(user_id, **filters))
+        return result.scalars().all()
+    except Exception as e:
+        logger.error("Error getting orders for user %s: %s", user_id, e, exc_info=True)
+        raise
+
+
+async def get_order(db: DbSession, order_id: UUID):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_order, db, order_id)
+    try:
+        result = await db.execute(
+            select(schemas.Order).where(schemas.Order.id == order_id)
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error("Error getting order %s: %s", order_id, e, exc_info=True)
+        raise
+
+
+async def get_orders_by_ids(db: DbSession, order_ids: List[UUID]):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_orders_by_ids, db, order_ids)
+    try:
+        result = await db.execute(
+            select(schemas.Order).where(schemas.Order.id.in_(order_ids))
+        )
+        return result.scalars().all()
+    except Exception as e:
+        logger.error("Error getting orders by ids: %s", e, exc_info=True)
+        raise
+
+
+async def get_resting_tickers(
+    db: DbSession, user_id: UUID, direction: Optional[str] = None
+) -> List[str]:
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_resting_tickers, db, user_id, direction)
+    try:
+        query = select(schemas.Order.instrument_ticker).where(
+            schemas.Order.user_id == user_id,
+            schemas.Order.type == "LIMIT",
+            schemas.Order.status.in_(["NEW", "PARTIALLY_EXECUTED"]),
+        )
+        if direction is not None:
+            query = query.where(schemas.Order.direction == direction)
+        result = await db.execute(query.distinct())
+        return list(result.scalars().all())
+    except Exception as e:
+        logger.error(
+            "Error getting resting tickers for user %s: %s",
+            user_id,
+            e,
+            exc_info=True,
+        )
+        raise
+
+
+async def get_balance(db: DbSession, user_id: UUID, ticker: str):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_balance, db, user_id, ticker)
+    try:
+        result = await db.execute(
+            select(schemas.Balance).where(
+                schemas.Balance.user_id == user_id, schemas.Balance.ticker == ticker
+            )
+        )
+        return result.scalars().first()
+    except Exception as e:
+        logger.error(
+            "Error getting balance for user %s, ticker %s: %s",
+            user_id,
+            ticker,
+            e,
+            exc_info=True,
+        )
+        raise
+
+
+async def get_balances(db: DbSession, user_id: UUID):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.get_balances, db, user_id)
+    try:
+        result = await db.execute(
+            select(schemas.Balance).where(schemas.Balance.user_id == user_id)
+        )
+        return result.scalars().all()
+    except Exception as e:
+        logger.error(
+            "Error getting balances for user %s: %s", user_id, e, exc_info=True
+        )
+        raise
+
+
+async def update_balance(db: DbSession, user_id: UUID, ticker: str, amount: int):
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(crud.update_balance, db, user_id, ticker, amount)
+    try:
+        if await get_user(db, user_id) is None:
+            logger.error("User not found for balance update: %s", user_id)
+            raise HTTPException(status_code=404, detail=f"User {user_id} not found")
+
+        result = await db.execute(
+            select(schemas.Balance)
+            .where(schemas.Balance.user_id == user_id, schemas.Balance.ticker == ticker)
+            .with_for_update()
+        )
+        balance = result.scalars().first()
+
+        # Зарезервированное под заявки списать нельзя
+        if balance and (balance.amount + amount < balance.locked):
+            logger.error("Insufficient balance for user %s, ticker %s", user_id, ticker)
+            raise ValueError("Insufficient balance to deduct")
+
+        if balance:
+            balance.amount += amount
+        else:
+            balance = schemas.Balance(user_id=user_id, ticker=ticker, amount=amount)
+            db.add(balance)
+
+        await db.commit()
+        await db.refresh(balance)
+        return balance
+    except Exception as e:
+        logger.error(
+            "Error updating balance for user %s, ticker %s: %s",
+            user_id,
+            ticker,
+            e,
+            exc_info=True,
+        )
+        raise
@@ -1,28 +1,119 @@
 import logging
+import time
+from typing import Union
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
 
+import metrics
 from config import settings
 
-# Настройка логирования SQLAlchemy
-logging.basicConfig()
+# Настройка логирования SQLAlchemy; обработчики — в logging_setup
 logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
 
-# Используем пул соединений для production
-engine = create_engine(
-    settings.DATABASE_URL,
-    poolclass=QueuePool,
-    pool_size=50,
-    max_overflow=10,
-    pool_pre_ping=True,  # Проверка соединения
-    connect_args={"connect_timeout": 5},  # Таймаут подключения
-)
+
+class _TimedCheckout:
+    """Замер ожидания соединения из пула"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.POOL_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def _create_engine(url: str):
+    if not url.startswith("sqlite"):
+        # Используем пул соединений для production
+        return create_engine(
+            url,
+            poolclass=TimedQueuePool,
+            pool_size=50,
+            max_overflow=10,
+            pool_pre_ping=True,  # Проверка соединения
+            connect_args={"connect_timeout": 5},  # Таймаут подключения
+        )
+
+    # SQLite — для бенчмарков и локального запуска: соединения переходят
+    # между потоками очередей инструментов
+    sqlite_engine = create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=50,
+        max_overflow=10,
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+
+    @event.listens_for(sqlite_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        # Транзакциями управляет SQLAlchemy (BEGIN ниже): иначе pysqlite
+        # открывает их сам и ломает SAVEPOINT
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    @event.listens_for(sqlite_engine, "begin")
+    def _on_begin(conn):
+        # IMMEDIATE сразу берёт блокировку записи, как FOR UPDATE в PostgreSQL.
+        # Остальные транзакции читают снимок WAL и писателей не держат
+        if conn.get_execution_options().get("sqlite_immediate"):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            conn.exec_driver_sql("BEGIN")
+
+    return sqlite_engine
+
+
+engine = _create_engine(settings.DATABASE_URL)
+event.listen(engine, "before_cursor_execute", metrics.count_query)
+metrics.POOL_CHECKED_OUT.set_function(engine.pool.checkedout)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Сессии очередей инструментов и relay: каждая их транзакция пишет,
+# на SQLite она сразу берёт блокировку записи
+WriterSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=engine.execution_options(sqlite_immediate=True),
+)
+
+# Асинхронный движок нужен только при ASYNC_DB; синхронный остаётся для
+# очередей исполнения заявок, миграций и тестов
+async_engine = None
+AsyncSessionLocal = None
+if settings.ASYNC_DB:
+    async_engine = create_async_engine(
+        settings.async_db_url,
+        poolclass=TimedAsyncQueuePool,
+        pool_size=50,
+        max_overflow=10,
+        pool_pre_ping=True,
+        connect_args={"timeout": 5},
+    )
+    event.listen(async_engine.sync_engine, "before_cursor_execute", metrics.count_query)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+
+DbSession = Union[Session, AsyncSession]
+
 Base = declarative_base()
 
 
@@ -36,3 +127,20 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_session():
+    """
+    Сессия для асинхронных роутеров: AsyncSession при ASYNC_DB,
+    иначе обычная Session, с которой crud_async работает через пул потоков.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        await run_in_threadpool(db.close)
@@ -1,15 +1,16 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
-from sqlalchemy.orm import Session
 
-from crud import get_user_by_api_key
-from database import get_db
+from cache import AuthUser, auth_cache
+from crud_async import get_user_by_api_key
+from database import DbSession, get_session
 
 api_key_scheme = APIKeyHeader(name="Authorization")
 
 
-def get_current_user(
-    authorization: str = Depends(api_key_scheme), db: Session = Depends(get_db)
+async def get_current_user(
+    authorization: str = Depends(api_key_scheme),
+    db: DbSession = Depends(get_session),
 ):
     if not authorization.startswith("TOKEN "):
         raise HTTPException(
@@ -18,15 +19,28 @@ def get_current_user(
         )
 
     api_key = authorization[6:]
-    user = get_user_by_api_key(db, api_key)
-    if not user:
+    user = auth_cache.get(api_key)
+    if user is not None:
+        return user
+
+    db_user = await get_user_by_api_key(db, api_key)
+    if not db_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key"
         )
+
+    user = AuthUser(
+        id=db_user.id,
+        name=db_user.name,
+        role=db_user.role,
+        api_key=db_user.api_key,
+        is_active=db_user.is_active,
+    )
+    auth_cache.set(api_key, user)
     return user
 
 
-def get_admin_user(user=Depends(get_current_user)):
+async def get_admin_user(user=Depends(get_current_user)):
     if user.role != "ADMIN":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required"
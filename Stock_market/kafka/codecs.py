@@ -0,0 +1,306 @@
+"""
+Кодеки сообщений Kafka.
+
+Кодек выбирается по топику (Settings.KAFKA_TOPIC_CODECS, шаблоны fnmatch,
+иначе KAFKA_CODEC) и записывается в заголовок content-type, так что
+читатель декодирует сообщение без знания настроек писателя. Сообщения со
+схемой из kafka.schemas несут заголовок schema вида "TradeUpdatePayload/1".
+
+- json, orjson — одинаковый JSON на проводе, orjson быстрее (если установлен);
+- struct — компактная раскладка по полям схемы: UUID — 16 байт, время —
+  микросекунды эпохи, числа — 8 байт, строки — с двухбайтной длиной.
+  Сообщения без схемы этим кодеком пишутся как JSON.
+"""
+
+import json
+import math
+import struct
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+)
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from config import settings
+from kafka.schemas import (
+    CancelOrderPayload,
+    OrderStatusPayload,
+    PlaceOrderPayload,
+    TradeUpdatePayload,
+)
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него доступен обычный json
+    orjson = None
+
+Headers = List[Tuple[str, bytes]]
+
+# Версию схемы повышают при любом изменении состава или порядка полей:
+# от них зависит бинарная раскладка
+SCHEMAS: Dict[str, Tuple[int, Type[BaseModel]]] = {
+    "PlaceOrderPayload": (2, PlaceOrderPayload),
+    "CancelOrderPayload": (1, CancelOrderPayload),
+    "OrderStatusPayload": (1, OrderStatusPayload),
+    "TradeUpdatePayload": (1, TradeUpdatePayload),
+}
+
+JSON_CONTENT_TYPE = "application/json"
+STRUCT_CONTENT_TYPE = "application/x-struct"
+
+
+class JsonCodec:
+    name = "json"
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, payload: dict, schema: Optional[str] = None) -> bytes:
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes, schema: Optional[str] = None) -> dict:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def encode(self, payload: dict, schema: Optional[str] = None) -> bytes:
+        return orjson.dumps(payload)
+
+    def decode(self, data: bytes, schema: Optional[str] = None) -> dict:
+        return orjson.loads(data)
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+NIL_UUID = bytes(16)
+MICROSECOND = timedelta(microseconds=1)
+LENGTH = struct.Struct("<H")
+
+
+# UUID разбирается и собирается через hex: в несколько раз быстрее, чем
+# через конструктор uuid.UUID
+
+
+def _pack_uuid(value) -> bytes:
+    if value is None:
+        return NIL_UUID
+    if isinstance(value, UUID):
+        return value.bytes
+    return bytes.fromhex(value.replace("-", ""))
+
+
+def _unpack_uuid(value: bytes) -> Optional[str]:
+    if value == NIL_UUID:
+        return None
+    h = value.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+
+def _pack_datetime(value) -> int:
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - EPOCH) // MICROSECOND
+
+
+def _unpack_datetime(value: int) -> str:
+    return (EPOCH + value * MICROSECOND).isoformat()
+
+
+def _pack_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _unpack_float(value: float) -> Optional[float]:
+    return None if math.isnan(value) else value
+
+
+# вид поля -> (формат struct, упаковка, распаковка)
+FIELD_KINDS: Dict[str, Tuple[str, Callable, Callable]] = {
+    "uuid": ("16s", _pack_uuid, _unpack_uuid),
+    "datetime": ("q", _pack_datetime, _unpack_datetime),
+    "int": ("q", int, int),
+    "float": ("d", _pack_float, _unpack_float),
+}
+
+
+def _field_kind(annotation) -> str:
+    if get_origin(annotation) is Union:
+        annotation = next(a for a in get_args(annotation) if a is not type(None))
+    if annotation is UUID:
+        return "uuid"
+    if annotation is datetime:
+        return "datetime"
+    if annotation is int:
+        return "int"
+    if annotation is float:
+        return "float"
+    if annotation is str or issubclass(annotation, Enum):
+        return "str"
+    raise TypeError(f"Unsupported field type for struct codec: {annotation}")
+
+
+class StructLayout:
+    """
+    Раскладка схемы: поля фиксированной длины одним struct, затем строки.
+    None для UUID — нулевой UUID, для float — NaN; необязательные строки и
+    целые в схемах не встречаются.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.names = list(model.model_fields)
+        self.fixed: List[Tuple[str, Callable, Callable]] = []
+        self.strings: List[str] = []
+        formats = []
+        for name, field in model.model_fields.items():
+            kind = _field_kind(field.annotation)
+            if kind == "str":
+                self.strings.append(name)
+                continue
+            fmt, pack, unpack = FIELD_KINDS[kind]
+            formats.append(fmt)
+            self.fixed.append((name, pack, unpack))
+        self.struct = struct.Struct("<" + "".join(formats))
+
+    def pack(self, payload: dict) -> bytes:
+        parts = [self.struct.pack(*(pack(payload[n]) for n, pack, _ in self.fixed))]
+        for name in self.strings:
+            value = payload[name]
+            raw = (value.value if isinstance(value, Enum) else value).encode("utf-8")
+            parts.append(LENGTH.pack(len(raw)))
+            parts.append(raw)
+        return b"".join(parts)
+
+    def unpack(self, data: bytes) -> dict:
+        values = self.struct.unpack_from(data)
+        message = {
+            name: unpack(value) for (name, _, unpack), value in zip(self.fixed, values)
+        }
+        offset = self.struct.size
+        for name in self.strings:
+            (length,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            message[name] = data[offset : offset + length].decode("utf-8")
+            offset += length
+        return {name: message[name] for name in self.names}
+
+
+class StructCodec:
+    name = "struct"
+    content_type = STRUCT_CONTENT_TYPE
+
+    def __init__(self):
+        self.layouts = {
+            name: StructLayout(model) for name, (_, model) in SCHEMAS.items()
+        }
+
+    def encode(self, payload: dict, schema: Optional[str] = None) -> bytes:
+        return self.layouts[schema].pack(payload)
+
+    def decode(self, data: bytes, schema: Optional[str] = None) -> dict:
+        return self.layouts[schema].unpack(data)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), StructCodec())}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+
+
+def get_codec(name: str):
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown or unavailable Kafka codec: {name}")
+    return codec
+
+
+@lru_cache(maxsize=1024)
+def codec_for(topic: str):
+    """Кодек топика: первый подходящий шаблон KAFKA_TOPIC_CODECS или KAFKA_CODEC"""
+    for pattern, name in settings.KAFKA_TOPIC_CODECS.items():
+        if fnmatchcase(topic, pattern):
+            return get_codec(name)
+    return get_codec(settings.KAFKA_CODEC)
+
+
+def _json_codec():
+    return CODECS.get("orjson") or CODECS["json"]
+
+
+def encode_message(
+    topic: str, payload: dict, schema: Optional[str] = None
+) -> Tuple[bytes, Headers]:
+    """Значение и заголовки сообщения для producer.send"""
+    codec = codec_for(topic)
+    if schema is None and codec.content_type != JSON_CONTENT_TYPE:
+        codec = _json_codec()
+
+    headers = [("content-type", codec.content_type.encode())]
+    if schema is not None:
+        version, _ = SCHEMAS[schema]
+        headers.append(("schema", f"{schema}/{version}".encode()))
+    return codec.encode(payload, schema), headers
+
+
+def _header(headers: Optional[Sequence[Tuple[str, bytes]]], name: str):
+    for key, value in headers or ():
+        if key == name:
+            return value.decode()
+    return None
+
+
+def message_schema(headers: Optional[Sequence[Tuple[str, bytes]]]) -> Optional[str]:
+    """Имя схемы из заголовков. ValueError, если версия не совпадает с нашей"""
+    header = _header(headers, "schema")
+    if header is None:
+        return None
+    name, _, version = header.partition("/")
+    if name not in SCHEMAS or str(SCHEMAS[name][0]) != version:
+        raise ValueError(f"Unsupported message schema: {header}")
+    return name
+
+
+def decode_message(
+    data: bytes, headers: Optional[Sequence[Tuple[str, bytes]]] = None
+) -> dict:
+    """Сообщение как словарь. Без заголовков считается JSON (старые сообщения)"""
+    content_type = _header(headers, "content-type") or JSON_CONTENT_TYPE
+    schema = message_schema(headers)
+    if content_type == JSON_CONTENT_TYPE:
+        return _json_codec().decode(data)
+    if content_type == STRUCT_CONTENT_TYPE and schema is not None:
+        return CODECS["struct"].decode(data, schema)
+    raise ValueError(f"Unsupported message content type: {content_type}")
+
+
+def decode_model(
+    data: bytes, headers: Optional[Sequence[Tuple[str, bytes]]] = None
+) -> BaseModel:
+    """Сообщение как модель его схемы"""
+    schema = message_schema(headers)
+    if schema is None:
+        raise ValueError("Message has no schema header")
+    return SCHEMAS[schema][1].model_validate(decode_message(data, headers))
+
+
+def message_text(
+    data: bytes, headers: Optional[Sequence[Tuple[str, bytes]]] = None
+) -> str:
+    """JSON-текст сообщения для WebSocket: JSON передаётся как есть"""
+    content_type = _header(headers, "content-type") or JSON_CONTENT_TYPE
+    if content_type == JSON_CONTENT_TYPE:
+        return data.decode("utf-8")
+    return json.dumps(decode_message(data, headers))
@@ -1,80 +1,301 @@
 import asyncio
-import json
-from contextlib import asynccontextmanager
-from datetime import datetime, timezone
-from typing import Dict
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple, Union
 
-from aiokafka import AIOKafkaConsumer
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener
+from aiokafka.structs import ConsumerRecord, OffsetAndMetadata, TopicPartition
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
 
+import crud
+from cache import InstrumentInfo, instruments
 from config import settings
+from kafka.codecs import decode_message, decode_model
+from kafka.hub import INSTRUMENTS_TOPIC, ORDER_COMMANDS_TOPIC, hub
+from kafka.memory import MemoryConsumer, is_memory, partitioner
+from kafka.schemas import CancelOrderPayload, OrderType, PlaceOrderPayload
+from matching.book import books
+from matching.journal import journal
+from matching.sequencer import sequencer
+from models import Direction, LimitOrderBody, MarketOrderBody
 
-# Глобальный словарь для хранения активных consumers
-consumers: Dict[str, AIOKafkaConsumer] = {}
+logger = logging.getLogger(__name__)
 
 
 async def start_consumers():
     """Запускает все необходимые consumers для работы приложения"""
-    # Здесь может быть логика инициализации всех consumers
-    pass
+    # Общие consumers для WebSocket-клиентов
+    await hub.start()
+    await instrument_watcher.start()
+    if settings.ORDER_INGESTION == "kafka":
+        await ingestor.start()
 
 
-async def match_orders():
-    """Consumer для обработки новых ордеров"""
-    consumer = AIOKafkaConsumer(
-        "stockmarket.orders.place",
-        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
+async def stop_consumers():
+    await ingestor.stop()
+    await instrument_watcher.stop()
+    await hub.stop()
+
+
+def order_body(command: PlaceOrderPayload) -> Union[LimitOrderBody, MarketOrderBody]:
+    direction = Direction(command.direction.value.upper())
+    if command.type == OrderType.LIMIT:
+        return LimitOrderBody(
+            direction=direction,
+            ticker=command.instrument,
+            qty=command.quantity,
+            price=int(command.price),
+        )
+    return MarketOrderBody(
+        direction=direction, ticker=command.instrument, qty=command.quantity
     )
 
+
+def place_order_command(
+    db: Session,
+    command: PlaceOrderPayload,
+    order: Union[LimitOrderBody, MarketOrderBody],
+):
     try:
-        await consumer.start()
-        async for msg in consumer:
-            order = msg.value
-            # Здесь должна быть логика ордеров
-            print(
-                f"[{datetime.now(timezone.utc).isoformat()}] Processing order:", order
-            )
-    finally:
-        await consumer.stop()
-
-
-@asynccontextmanager
-async def get_consumer(user_id: str):
-    """Контекстный менеджер для безопасной работы с consumer"""
-    consumer = AIOKafkaConsumer(
-        f"stockmarket.orders.{user_id}.status",
-        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
-        auto_offset_reset="latest",
-    )
+        return crud.create_order(db, order, command.user_id, command.order_id)
+    except (HTTPException, ValueError) as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        logger.warning("Order %s rejected: %s", command.order_id, detail)
+        return crud.reject_order(db, order, command.user_id, command.order_id)
 
+
+def cancel_order_command(db: Session, command: CancelOrderPayload):
     try:
-        await consumer.start()
-        consumers[user_id] = consumer
-        yield consumer
-    finally:
-        await consumer.stop()
-        consumers.pop(user_id, None)
+        return crud.cancel_order(db, command.order_id, command.user_id)
+    except HTTPException as e:
+        # Заявка успела исполниться или уже отменена
+        logger.warning("Cancel of order %s skipped: %s", command.order_id, e.detail)
+        return False
+
+
+# Команда и тело заявки для размещения (None для отмены)
+Command = Tuple[
+    Union[PlaceOrderPayload, CancelOrderPayload],
+    Optional[Union[LimitOrderBody, MarketOrderBody]],
+]
 
 
-async def consume_order_updates(user_id: str):
-    """Consumer для получения обновлений по ордерам конкретного пользователя"""
-    from routers.ws import manager
+def decode_command(record: ConsumerRecord) -> Optional[Command]:
+    """None — битое или неизвестное сообщение, повтор не поможет"""
+    try:
+        command = decode_model(record.value, record.headers)
+        if isinstance(command, PlaceOrderPayload):
+            return command, order_body(command)
+    except (ValueError, TypeError, ValidationError) as e:
+        logger.error("Skipping malformed order command: %s", e)
+        return None
+    if isinstance(command, CancelOrderPayload):
+        return command, None
+    logger.error("Skipping unexpected command %s", type(command).__name__)
+    return None
+
 
-    async with get_consumer(user_id) as consumer:
+def execute_commands(db: Session, commands: List[Command]) -> int:
+    """
+    Команды одного инструмента по порядку, каждая в своей транзакции.
+    Останавливается на первой ошибке; возвращает число исполненных.
+    """
+    for done, (command, order) in enumerate(commands):
         try:
-            async for msg in consumer:
-                await manager.send_personal_message(
-                    json.dumps(
-                        {
-                            **msg.value,
-                            "timestamp": datetime.now(timezone.utc).isoformat(),
-                        }
-                    ),
-                    user_id,
-                )
-        except asyncio.CancelledError:
-            print(f"Consumer for user {user_id} was cancelled")
+            if order is not None:
+                place_order_command(db, command, order)
+            else:
+                cancel_order_command(db, command)
         except Exception as e:
-            print(f"Error in consumer for user {user_id}: {str(e)}")
-            raise
+            db.rollback()
+            logger.error(
+                "Order command %s failed: %s", command.order_id, e, exc_info=True
+            )
+            return done
+    return len(commands)
+
+
+class OrderIngestor(ConsumerRebalanceListener):
+    """
+    Исполнение заявок из топика команд (ORDER_INGESTION=kafka).
+    Consumer group делит партиции между узлами, ключ сообщения — тикер, так что
+    все команды инструмента читает один узел в порядке записи. Команды пачки
+    раздаются очередям инструментов (sequencer) без ожидания друг друга,
+    смещения фиксируются после исполнения всей пачки: доставка at-least-once,
+    повтор распознаётся по id заявки.
+    """
+
+    def __init__(self):
+        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        options = dict(
+            group_id=settings.KAFKA_ORDERS_GROUP,
+            enable_auto_commit=False,
+            auto_offset_reset="earliest",
+        )
+        if is_memory():
+            self._consumer = MemoryConsumer(**options)
+        else:
+            self._consumer = AIOKafkaConsumer(
+                bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS, **options
+            )
+        self._consumer.subscribe(topics=[ORDER_COMMANDS_TOPIC], listener=self)
+        await self._consumer.start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._consumer is not None:
+            await self._consumer.stop()
+            self._consumer = None
+
+    def owns(self, ticker: str) -> bool:
+        """Исполняет ли этот узел команды инструмента"""
+        if self._consumer is None:
+            return settings.ORDER_INGESTION != "kafka"
+        partitions = self._consumer.partitions_for_topic(ORDER_COMMANDS_TOPIC)
+        if not partitions:
+            return False
+        partition = partitioner(ticker.encode("utf-8"), sorted(partitions), [])
+        return TopicPartition(ORDER_COMMANDS_TOPIC, partition) in (
+            self._consumer.assignment()
+        )
+
+    async def on_partitions_revoked(self, revoked: Set[TopicPartition]):
+        pass
+
+    async def on_partitions_assigned(self, assigned: Set[TopicPartition]):
+        # Пока партиции были у другого узла, стаканы в памяти устарели
+        logger.info("Assigned %s order command partitions", len(assigned))
+        books.reset_all()
+        journal.reset_all()
+
+    async def _run(self):
+        while True:
+            try:
+                batches = await self._consumer.getmany(
+                    timeout_ms=1000, max_records=settings.INGESTION_BATCH_SIZE
+                )
+                if batches:
+                    await self._process(batches)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in order ingestion: %s", e, exc_info=True)
+                await asyncio.sleep(1)
+
+    async def _process(self, batches: Dict[TopicPartition, List[ConsumerRecord]]):
+        # Команды инструмента из пачки уходят в его очередь одной операцией
+        # и исполняются по порядку до первой ошибки; инструменты — параллельно
+        lanes: Dict[
+            Tuple[TopicPartition, str], List[Tuple[ConsumerRecord, Command]]
+        ] = defaultdict(list)
+        for tp, records in batches.items():
+            for record in records:
+                command = decode_command(record)
+                if command is not None:
+                    lanes[tp, record.key.decode("utf-8")].append((record, command))
+
+        keys = list(lanes)
+        results = await asyncio.gather(
+            *(
+                sequencer.submit(
+                    ticker, execute_commands, [c for _, c in lanes[tp, ticker]]
+                )
+                for tp, ticker in keys
+            ),
+            return_exceptions=True,
+        )
+
+        # Партиция с ошибкой перечитывается с самой ранней неисполненной
+        # команды. Команды инструмента после неё не исполнялись, поэтому
+        # порядок по инструменту сохраняется; уже исполненные команды других
+        # инструментов при повторе распознаются по id заявки
+        failed: Dict[TopicPartition, int] = {}
+        for (tp, ticker), done in zip(keys, results):
+            if isinstance(done, Exception):
+                logger.error("Order commands for %s failed: %s", ticker, done)
+                done = 0
+            records = lanes[tp, ticker]
+            if done < len(records):
+                offset = records[done][0].offset
+                failed[tp] = min(failed.get(tp, offset), offset)
+        for tp, offset in failed.items():
+            logger.error(
+                "Order commands of partition %s replay from %s", tp.partition, offset
+            )
+            self._consumer.seek(tp, offset)
+
+        offsets = {
+            tp: OffsetAndMetadata(records[-1].offset + 1, "")
+            for tp, records in batches.items()
+            if tp not in failed
+        }
+        if offsets:
+            await self._consumer.commit(offsets)
+        if failed:
+            await asyncio.sleep(1)
+
+
+class InstrumentWatcher:
+    """
+    Обновление реестра инструментов по событиям других процессов.
+    Без group_id: событие получает каждый процесс. Свои события применяются
+    повторно, это безвредно.
+    """
+
+    def __init__(self):
+        self._consumer: Optional[AIOKafkaConsumer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if is_memory():
+            self._consumer = MemoryConsumer(auto_offset_reset="latest")
+        else:
+            self._consumer = AIOKafkaConsumer(
+                bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                auto_offset_reset="latest",
+            )
+        self._consumer.subscribe(topics=[INSTRUMENTS_TOPIC])
+        await self._consumer.start()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._consumer is not None:
+            await self._consumer.stop()
+            self._consumer = None
+
+    async def _run(self):
+        while True:
+            try:
+                async for msg in self._consumer:
+                    self.apply(decode_message(msg.value, msg.headers))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in instrument watcher: %s", e, exc_info=True)
+                await asyncio.sleep(1)
+
+    def apply(self, event: dict):
+        ticker = event["ticker"]
+        if event["action"] == "deleted":
+            instruments.remove(ticker)
+            # Стакан удалённого инструмента больше не нужен
+            books.reset(ticker)
+        else:
+            instruments.put(InstrumentInfo(ticker=ticker, name=event["name"]))
+
+
+ingestor = OrderIngestor()
+instrument_watcher = InstrumentWatcher()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from aiokafka import AIOKafkaConsumer
+
+import metrics
+from config import settings
+from kafka.codecs import message_text
+from kafka.memory import MemoryConsumer, is_memory
+
+logger = logging.getLogger(__name__)
+
+TRADES_TOPIC = "stockmarket.trades"
+# Команды размещения и отмены заявок (ORDER_INGESTION=kafka), ключ — тикер
+ORDER_COMMANDS_TOPIC = "stockmarket.orders.commands"
+# Добавление и удаление инструментов: реестры других процессов, ключ — тикер
+INSTRUMENTS_TOPIC = "stockmarket.instruments"
+ORDER_STATUS_PATTERN = r"^stockmarket\.orders\..+\.status$"
+
+
+def order_status_topic(user_id) -> str:
+    return f"stockmarket.orders.{user_id}.status"
+
+
+class Subscriber:
+    """
+    Очередь сообщений одного сокета.
+    None в очереди означает, что клиент отключён как медленный.
+    """
+
+    __slots__ = ("queue", "dropped")
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = False
+
+    def push(self, message: str) -> bool:
+        if self.dropped:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: освобождаем очередь и отключаем его,
+            # чтобы не держать память и не тормозить остальных
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+
+class KafkaHub:
+    """
+    Один consumer на топик на весь процесс.
+    Сообщения раздаются подписчикам через ограниченные очереди в памяти;
+    канал подписки — имя топика. Через хаб же публикуются изменения стакана
+    (matching.feed), которые не идут через Kafka.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+        self._consumers: List[AIOKafkaConsumer] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def subscribe(self, channel: str) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel: str, subscriber: Subscriber):
+        subscribers = self._subscribers.get(channel)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._subscribers[channel]
+
+    def has_subscribers(self, channel: str) -> bool:
+        return channel in self._subscribers
+
+    def publish(self, channel: str, message: str):
+        subscribers = self._subscribers.get(channel)
+        if not subscribers:
+            return
+        for subscriber in list(subscribers):
+            if not subscriber.push(message):
+                logger.warning("Dropping slow subscriber on %s", channel)
+                metrics.WS_DROPPED.inc()
+                self.unsubscribe(channel, subscriber)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "channels": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+        }
+
+    def queue_depths(self) -> List[int]:
+        return [
+            subscriber.queue.qsize()
+            for subscribers in self._subscribers.values()
+            for subscriber in subscribers
+        ]
+
+    async def start(self):
+        trades = self._consumer()
+        trades.subscribe(topics=[TRADES_TOPIC])
+        statuses = self._consumer()
+        statuses.subscribe(pattern=ORDER_STATUS_PATTERN)
+
+        for consumer in (trades, statuses):
+            await consumer.start()
+            self._consumers.append(consumer)
+            self._tasks.append(asyncio.create_task(self._consume(consumer)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        for consumer in self._consumers:
+            await consumer.stop()
+        self._consumers.clear()
+
+    def _consumer(self) -> AIOKafkaConsumer:
+        if is_memory():
+            return MemoryConsumer(auto_offset_reset="latest")
+        # Без group_id: каждый процесс получает все сообщения для своих сокетов.
+        # Частое обновление метаданных — чтобы топики новых пользователей
+        # попадали под шаблон быстро
+        return AIOKafkaConsumer(
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            auto_offset_reset="latest",
+            metadata_max_age_ms=5000,
+        )
+
+    async def _consume(self, consumer: AIOKafkaConsumer):
+        while True:
+            try:
+                async for msg in consumer:
+                    # Сообщение декодируется один раз для всех подписчиков
+                    self.publish(msg.topic, message_text(msg.value, msg.headers))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in Kafka hub consumer: %s", e, exc_info=True)
+                await asyncio.sleep(1)
+
+
+hub = KafkaHub(queue_size=settings.WS_QUEUE_SIZE)
+
+# Считаются при опросе /metrics, который идёт в event loop
+metrics.WS_SUBSCRIBERS.set_function(lambda: hub.stats()["subscribers"])
+metrics.WS_QUEUE_DEPTH.set_function(lambda: sum(hub.queue_depths()))
+metrics.WS_QUEUE_MAX.set_function(lambda: max(hub.queue_depths(), default=0))
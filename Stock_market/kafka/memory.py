@@ -0,0 +1,222 @@
+"""
+Брокер в памяти процесса вместо Kafka: KAFKA_BOOTSTRAP_SERVERS=memory://.
+
+Повторяет то подмножество API aiokafka, которым пользуется приложение:
+партиция по ключу выбирается тем же murmur2, что и в Kafka, у групп
+сохраняются зафиксированные смещения, подписка по шаблону подхватывает новые
+топики. Одна группа — один участник, ему назначаются все партиции.
+Нужен для тестов и локального запуска без брокера.
+"""
+
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from aiokafka.partitioner import DefaultPartitioner
+from aiokafka.structs import (
+    ConsumerRecord,
+    OffsetAndMetadata,
+    RecordMetadata,
+    TopicPartition,
+)
+
+from config import settings
+
+MEMORY_URL = "memory://"
+
+partitioner = DefaultPartitioner()
+
+
+def is_memory() -> bool:
+    return settings.KAFKA_BOOTSTRAP_SERVERS.startswith(MEMORY_URL)
+
+
+class MemoryBroker:
+    def __init__(self, partitions: int):
+        self.partitions = partitions
+        self.topics: Dict[str, List[List[ConsumerRecord]]] = {}
+        # (группа, партиция) -> следующее смещение
+        self.committed: Dict[Tuple[str, TopicPartition], int] = {}
+        self._appended = asyncio.Event()
+
+    def reset(self):
+        """Пустой брокер, например между тестами со своими event loop"""
+        self.topics.clear()
+        self.committed.clear()
+        self._appended = asyncio.Event()
+
+    def append(
+        self,
+        topic: str,
+        key: Optional[bytes],
+        value: Optional[bytes],
+        headers: Sequence[Tuple[str, bytes]],
+    ) -> RecordMetadata:
+        log = self.topics.setdefault(topic, [[] for _ in range(self.partitions)])
+        partition = partitioner(key, list(range(self.partitions)), [])
+        offset = len(log[partition])
+        timestamp = int(time.time() * 1000)
+        log[partition].append(
+            ConsumerRecord(
+                topic=topic,
+                partition=partition,
+                offset=offset,
+                timestamp=timestamp,
+                timestamp_type=0,
+                key=key,
+                value=value,
+                checksum=None,
+                serialized_key_size=len(key) if key is not None else -1,
+                serialized_value_size=len(value) if value is not None else -1,
+                headers=tuple(headers or ()),
+            )
+        )
+        # Будим всех ожидающих и заводим событие для следующих
+        appended, self._appended = self._appended, asyncio.Event()
+        appended.set()
+        tp = TopicPartition(topic, partition)
+        return RecordMetadata(topic, partition, tp, offset, timestamp, 0, 0)
+
+    async def wait(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._appended.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+broker = MemoryBroker(partitions=8)
+
+
+class MemoryProducer:
+    def __init__(self, key_serializer=None, value_serializer=None, **config):
+        self._key_serializer = key_serializer
+        self._value_serializer = value_serializer
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def send(self, topic, value=None, key=None, headers=None, **kwargs):
+        if key is not None and self._key_serializer is not None:
+            key = self._key_serializer(key)
+        if value is not None and self._value_serializer is not None:
+            value = self._value_serializer(value)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(broker.append(topic, key, value, headers))
+        return future
+
+    async def send_and_wait(self, topic, value=None, key=None, headers=None, **kwargs):
+        return await (await self.send(topic, value, key, headers))
+
+
+class MemoryConsumer:
+    def __init__(
+        self,
+        *topics: str,
+        group_id: Optional[str] = None,
+        auto_offset_reset: str = "latest",
+        **config,
+    ):
+        self._group_id = group_id
+        self._auto_offset_reset = auto_offset_reset
+        self._topics: Set[str] = set(topics)
+        self._pattern: Optional[re.Pattern] = None
+        self._listener = None
+        self._positions: Dict[TopicPartition, int] = {}
+        self._buffer: List[ConsumerRecord] = []
+        self._started = False
+
+    def subscribe(self, topics=(), pattern=None, listener=None):
+        self._topics = set(topics)
+        self._pattern = re.compile(pattern) if pattern else None
+        self._listener = listener
+
+    async def start(self):
+        await self._refresh()
+        self._started = True
+
+    async def stop(self):
+        pass
+
+    def assignment(self) -> Set[TopicPartition]:
+        return set(self._positions)
+
+    def partitions_for_topic(self, topic: str) -> Optional[Set[int]]:
+        if topic not in broker.topics:
+            return None
+        return set(range(broker.partitions))
+
+    def seek(self, tp: TopicPartition, offset: int):
+        self._positions[tp] = offset
+
+    async def commit(self, offsets: Optional[Dict[TopicPartition, object]] = None):
+        if self._group_id is None:
+            raise RuntimeError("Commit requires group_id")
+        if offsets is None:
+            offsets = self._positions
+        for tp, offset in offsets.items():
+            if isinstance(offset, OffsetAndMetadata):
+                offset = offset.offset
+            broker.committed[(self._group_id, tp)] = offset
+
+    async def _refresh(self):
+        """Назначить партиции топиков, появившихся после подписки"""
+        assigned = set()
+        for topic, log in broker.topics.items():
+            if topic not in self._topics and not (
+                self._pattern and self._pattern.match(topic)
+            ):
+                continue
+            for partition, records in enumerate(log):
+                tp = TopicPartition(topic, partition)
+                if tp in self._positions:
+                    continue
+                committed = broker.committed.get((self._group_id, tp))
+                if committed is not None:
+                    self._positions[tp] = committed
+                elif self._started or self._auto_offset_reset == "earliest":
+                    # Топик создан после подписки: все его сообщения новые
+                    self._positions[tp] = 0
+                else:
+                    self._positions[tp] = len(records)
+                assigned.add(tp)
+        if assigned and self._listener is not None:
+            await self._listener.on_partitions_assigned(assigned)
+
+    def _fetch(self, max_records: Optional[int]) -> Dict[TopicPartition, List]:
+        batches = {}
+        for tp, position in self._positions.items():
+            records = broker.topics[tp.topic][tp.partition][position:]
+            if max_records is not None:
+                records = records[:max_records]
+                max_records -= len(records)
+            if records:
+                batches[tp] = records
+                self._positions[tp] = records[-1].offset + 1
+            if max_records == 0:
+                break
+        return batches
+
+    async def getmany(
+        self, *partitions, timeout_ms: int = 0, max_records: Optional[int] = None
+    ) -> Dict[TopicPartition, List[ConsumerRecord]]:
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            await self._refresh()
+            batches = self._fetch(max_records)
+            remaining = deadline - time.monotonic()
+            if batches or remaining <= 0:
+                return batches
+            await broker.wait(remaining)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> ConsumerRecord:
+        while not self._buffer:
+            for records in (await self.getmany(timeout_ms=1000)).values():
+                self._buffer.extend(records)
+        return self._buffer.pop(0)
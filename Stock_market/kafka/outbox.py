@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+import crud
+import metrics
+from config import settings
+from database import WriterSessionLocal
+from kafka import producer as kafka_producer
+from kafka.codecs import encode_message
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """
+    Переносит события из таблицы outbox в Kafka.
+    Пачка по порядку id закрепляется за ретранслятором короткой транзакцией,
+    отправляется целиком без открытой транзакции (producer сам собирает
+    сообщения в сжатые батчи за linger_ms) и удаляется второй короткой
+    транзакцией после подтверждения брокера. При сбое события остаются в
+    таблице и уходят повторно: доставка at-least-once, порядок внутри
+    инструмента сохраняется ключом-тикером.
+    """
+
+    def __init__(self, batch_size: int, poll_interval: float, claim_timeout: float):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def notify(self, ticker: Optional[str] = None):
+        """Разбудить ретранслятор, не дожидаясь очередного опроса"""
+        self._wakeup.set()
+
+    async def start(self):
+        # Событие привязывается к event loop, в котором его ждут
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        if self._task is None:
+            return
+        # Текущая пачка досылается: отмена посреди drain бросает сессию,
+        # которой ещё пользуется рабочий поток
+        self._stopping = True
+        self._wakeup.set()
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        if not done:
+            logger.warning("Outbox relay did not stop in time, cancelling")
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                sent = await self.drain()
+            except Exception as e:
+                logger.error("Outbox relay failed: %s", e, exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if sent < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def drain(self) -> int:
+        """Отправить одну пачку событий. Возвращает их число"""
+        producer = kafka_producer.producer
+        if producer is None:
+            raise RuntimeError("Kafka producer not initialized")
+
+        db = WriterSessionLocal()
+        try:
+            events = await run_in_threadpool(
+                crud.claim_outbox_batch, db, self.batch_size, self.claim_timeout
+            )
+            if not events:
+                return 0
+            event_ids = [event.id for event in events]
+
+            # send() лишь кладёт сообщение в буфер producer'а, ждём подтверждений
+            # всей пачкой
+            sending = time.perf_counter()
+            try:
+                deliveries = []
+                for event in events:
+                    value, headers = encode_message(
+                        event.topic, event.payload, event.payload_schema
+                    )
+                    deliveries.append(
+                        await producer.send(
+                            event.topic, value=value, key=event.key, headers=headers
+                        )
+                    )
+                await asyncio.gather(*deliveries)
+            except Exception:
+                # Повтор на следующем опросе, а не после истечения закрепления
+                await run_in_threadpool(crud.release_outbox_events, db, event_ids)
+                raise
+            metrics.KAFKA_PRODUCE.labels("outbox").observe(
+                time.perf_counter() - sending
+            )
+            metrics.KAFKA_MESSAGES.labels("outbox").inc(len(events))
+
+            await run_in_threadpool(crud.delete_outbox_events, db, event_ids)
+            return len(events)
+        finally:
+            await run_in_threadpool(db.close)
+
+
+relay = OutboxRelay(
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    poll_interval=settings.OUTBOX_POLL_INTERVAL,
+    claim_timeout=settings.OUTBOX_CLAIM_TIMEOUT,
+)
@@ -1,20 +1,53 @@
-import json
+import time
 import uuid
-from datetime import datetime, timezone
-from typing import Optional
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
 
 from aiokafka import AIOKafkaProducer
+from pydantic import BaseModel
 
+import metrics
 from config import settings
+from kafka.codecs import encode_message
+from kafka.hub import INSTRUMENTS_TOPIC, TRADES_TOPIC, order_status_topic
+from kafka.memory import MemoryProducer, is_memory
+from kafka.schemas import (
+    CancelOrderPayload,
+    OrderDirection,
+    OrderStatus,
+    OrderStatusPayload,
+    OrderType,
+    PlaceOrderPayload,
+    TradeUpdatePayload,
+)
+from schemas import utcnow
 
 producer: Optional[AIOKafkaProducer] = None
 
+# (топик, ключ, сообщение, схема из kafka.codecs.SCHEMAS или None)
+Event = Tuple[str, str, Dict, Optional[str]]
+
+
+def _serialize_key(key: Optional[str]) -> Optional[bytes]:
+    return key.encode("utf-8") if key is not None else None
+
 
 async def init_producer():
     global producer
+    if is_memory():
+        producer = MemoryProducer(key_serializer=_serialize_key)
+        await producer.start()
+        return
+
     producer = AIOKafkaProducer(
         bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-        value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        key_serializer=_serialize_key,
+        # Повторы не меняют порядок сообщений внутри партиции
+        enable_idempotence=True,
+        linger_ms=settings.KAFKA_LINGER_MS,
+        compression_type=settings.KAFKA_COMPRESSION,
+        max_batch_size=settings.KAFKA_MAX_BATCH_SIZE,
     )
     await producer.start()
 
@@ -24,10 +57,44 @@ async def close_producer():
         await producer.stop()
 
 
-async def produce_order_event(order, action: str):
+def place_command(order, user_id: UUID) -> PlaceOrderPayload:
+    """Команда размещения заявки из тела запроса; id заявки выдаётся здесь"""
+    price = getattr(order, "price", None)
+    return PlaceOrderPayload(
+        order_id=uuid.uuid4(),
+        user_id=user_id,
+        instrument=order.ticker,
+        type=OrderType.MARKET if price is None else OrderType.LIMIT,
+        direction=OrderDirection(order.direction.value.lower()),
+        price=price,
+        quantity=order.qty,
+        timestamp=utcnow(),
+    )
+
+
+def cancel_command(order_id: UUID, user_id: UUID) -> CancelOrderPayload:
+    return CancelOrderPayload(order_id=order_id, user_id=user_id, timestamp=utcnow())
+
+
+async def send_command(topic: str, key: str, command: BaseModel):
+    """
+    Отправить команду мимо outbox и дождаться подтверждения брокера:
+    у команды нет транзакции БД, источник истины — сам топик.
+    """
     if not producer:
         raise RuntimeError("Kafka producer not initialized")
 
+    schema = type(command).__name__
+    value, headers = encode_message(topic, command.model_dump(mode="json"), schema)
+    sending = time.perf_counter()
+    delivery = await producer.send(topic, value=value, key=key, headers=headers)
+    await delivery
+    metrics.KAFKA_PRODUCE.labels("command").observe(time.perf_counter() - sending)
+    metrics.KAFKA_MESSAGES.labels("command").inc()
+
+
+def order_event(order, action: str) -> Event:
+    """Событие статуса заявки. Ключ — тикер: порядок по инструменту сохраняется"""
     message = {
         "orderId": str(order.id),
         "userId": str(order.user_id),
@@ -38,26 +105,56 @@ async def produce_order_event(order, action: str):
         "status": action.lower(),
         "timestamp": order.created_at.isoformat(),
     }
+    return order_status_topic(order.user_id), order.instrument_ticker, message, None
 
-    await producer.send(f"stockmarket.orders.{order.user_id}.status", value=message)
 
-    if action == "EXECUTED":
-        await producer.send(
-            "stockmarket.trades",
-            value={
-                "tradeId": str(uuid.uuid4()),
-                "buyerId": str(order.user_id) if order.direction == "BUY" else None,
-                "sellerId": str(order.user_id) if order.direction == "SELL" else None,
-                "instrument": order.instrument_ticker,
-                "price": order.price,
-                "quantity": order.quantity,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            },
-        )
+def bulk_cancel_event(user_id: UUID, ticker: str, order_ids: List[UUID]) -> Event:
+    """Одно сообщение на массовую отмену вместо сообщения на каждую заявку"""
+    message = {
+        "orderIds": [str(order_id) for order_id in order_ids],
+        "userId": str(user_id),
+        "instrument": ticker,
+        "status": "cancelled",
+        "timestamp": utcnow().isoformat(),
+    }
+    return order_status_topic(user_id), ticker, message, None
 
 
-async def produce_trade_event(trade_data):
-    if not producer:
-        raise RuntimeError("Kafka producer not initialized")
+def trade_event(trade) -> Event:
+    """Сделка из match_order; id сделки появляется после flush"""
+    message = TradeUpdatePayload(
+        trade_id=trade.id,
+        buyer_id=trade.buyer_id,
+        seller_id=trade.seller_id,
+        instrument=trade.instrument_ticker,
+        price=trade.price,
+        quantity=trade.quantity,
+        timestamp=trade.created_at,
+    )
+    return (
+        TRADES_TOPIC,
+        trade.instrument_ticker,
+        message.model_dump(mode="json"),
+        "TradeUpdatePayload",
+    )
+
+
+def order_status_event(order, timestamp: datetime) -> Event:
+    """Смена статуса заявки при исполнении (частичном или полном)"""
+    message = OrderStatusPayload(
+        order_id=order.id,
+        status=OrderStatus(order.status.lower()),
+        timestamp=timestamp,
+    )
+    return (
+        order_status_topic(order.user_id),
+        order.instrument_ticker,
+        message.model_dump(mode="json"),
+        "OrderStatusPayload",
+    )
+
 
-    await producer.send("stockmarket.trades", value=trade_data)
+def instrument_event(ticker: str, name: str, action: str) -> Event:
+    """Инструмент добавлен (CREATED) или удалён (DELETED)"""
+    message = {"ticker": ticker, "name": name, "action": action.lower()}
+    return INSTRUMENTS_TOPIC, ticker, message, None
@@ -13,10 +13,18 @@ class OrderType(str, Enum):
     LIMIT = "limit"
 
 
+class OrderDirection(str, Enum):
+    """Направление заявки"""
+
+    BUY = "buy"
+    SELL = "sell"
+
+
 class OrderStatus(str, Enum):
     """Статус заказа"""
 
     PENDING = "pending"
+    PARTIALLY_EXECUTED = "partially_executed"
     EXECUTED = "executed"
     CANCELED = "canceled"
     REJECTED = "rejected"
@@ -29,6 +37,7 @@ class PlaceOrderPayload(BaseModel):
     user_id: UUID
     instrument: str
     type: OrderType
+    direction: OrderDirection
     price: Optional[float] = None  # Для рыночных ордеров может быть None
     quantity: int
     timestamp: datetime
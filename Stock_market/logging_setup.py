@@ -0,0 +1,145 @@
+"""
+Логирование через очередь: вызывающий поток только подставляет аргументы
+и кладёт запись в очередь, форматирование и запись в консоль и файл идут
+в потоке QueueListener.
+"""
+
+import atexit
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from config import settings
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Стандартные атрибуты записи; остальные пришли через extra=
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON; поля из extra= попадают в неё как есть"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживание INFO и ниже: из записей одного места вызова за секунду
+    первые burst проходят, дальше — каждая every-я. WARNING и выше
+    проходят всегда.
+    """
+
+    def __init__(self, burst: int, every: int):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self._windows: Dict[Tuple[str, int], List[int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or self.every <= 1:
+            return True
+        # Шаблон %-строки постоянен, поэтому мест вызова конечное число
+        key = (record.pathname, record.lineno)
+        second = int(record.created)
+        window = self._windows.get(key)
+        if window is None or window[0] != second:
+            window = self._windows[key] = [second, 0]
+        window[1] += 1
+        excess = window[1] - self.burst
+        return excess <= 0 or excess % self.every == 0
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Запись в очередь без форматирования. Переполненная очередь не
+    блокирует вызывающего: запись отбрасывается и учитывается в метриках.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы подставляются сразу: объекты в args могут измениться,
+        # пока запись ждёт в очереди
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+
+_exception_formatter = logging.Formatter()
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging():
+    """Корневой логгер пишет в очередь; вызывается один раз при старте"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if settings.LOG_FILE:
+        Path(settings.LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+        # Ротация: до 5 файлов по 10 МБ
+        handlers.append(
+            RotatingFileHandler(
+                settings.LOG_FILE,
+                maxBytes=10 * 1024 * 1024,
+                backupCount=5,
+                encoding="utf-8",
+            )
+        )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue)
+    queue_handler.addFilter(
+        SamplingFilter(settings.LOG_SAMPLE_BURST, settings.LOG_SAMPLE_EVERY)
+    )
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Дописать оставшееся в очереди при выходе
+    atexit.register(_listener.stop)
@@ -1,38 +1,17 @@
 import logging
 import time
-from logging.handlers import RotatingFileHandler
-from pathlib import Path
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+import metrics
+from logging_setup import setup_logging
 from routers import admin, balance, order, public, ws
 
-# Создание папки для логов
-Path("logs").mkdir(exist_ok=True)
-
-# Настройка логгера
+# Консоль и logs/app.log через очередь и фоновый поток (logging_setup)
+setup_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-
-# Формат логов
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
-
-# Консольный вывод
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(formatter)
-
-# Файловый вывод с ротацией (макс. 5 файлов по 10 МБ каждый)
-file_handler = RotatingFileHandler(
-    "logs/app.log", maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8"
-)
-file_handler.setFormatter(formatter)
-
-# Обработчики
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
 
 tags_metadata = [
     {"name": "root", "description": "Root"},
@@ -61,20 +40,29 @@ app = FastAPI(
 # Middleware для логирования запросов
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
+    queries = metrics.start_request()
 
-    logger.info(f"Request: {request.method} {request.url.path}")
-    logger.debug(f"Headers: {request.headers}")
-    logger.debug(f"Query params: {request.query_params}")
+    logger.info("Request: %s %s", request.method, request.url.path)
+    logger.debug("Headers: %s", request.headers)
+    logger.debug("Query params: %s", request.query_params)
 
     try:
         response = await call_next(request)
     except Exception as e:
-        logger.error(f"Request failed: {str(e)}", exc_info=True)
+        logger.error("Request failed: %s", e, exc_info=True)
         raise
 
-    process_time = (time.time() - start_time) * 1000
-    logger.info(f"Response: {response.status_code} ({process_time:.2f}ms)")
+    elapsed = time.perf_counter() - start_time
+    # Шаблон пути, а не сам путь: id в URL не плодят серии
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics.REQUEST_LATENCY.labels(request.method, path, response.status_code).observe(
+        elapsed
+    )
+    metrics.REQUEST_QUERIES.labels(request.method, path).observe(queries[0])
+
+    logger.info("Response: %s (%.2fms)", response.status_code, elapsed * 1000)
 
     return response
 
@@ -82,7 +70,7 @@ async def log_requests(request: Request, call_next):
 # Обработчик исключений
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {str(exc)}", exc_info=True)
+    logger.error("Unhandled exception: %s", exc, exc_info=True)
     return JSONResponse(status_code=500, content={"message": "Internal server error"})
 
 
@@ -97,6 +85,12 @@ async def root():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Метрики в текстовом формате Prometheus; в event loop, как и хаб"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 # Include routers
 app.include_router(public.router, prefix="/api/v1/public", tags=["public"])
 app.include_router(order.router, prefix="/api/v1", tags=["order"])
@@ -110,30 +104,113 @@ async def startup_event():
     """Запуск Kafka"""
     logger.info("Starting application...")
 
+    from starlette.concurrency import run_in_threadpool
+
+    import crud
+    from database import SessionLocal
+    from matching.candles import candles
+    from matching.feed import publish_book_changes
+    from matching.journal import journal
+    from matching.sequencer import sequencer
+
+    def restore_open_candles():
+        db = SessionLocal()
+        try:
+            candles.restore(crud.get_open_candles(db))
+        finally:
+            db.close()
+
+    # Свечи, открытые до перезапуска, продолжаются с сохранённых значений;
+    # до первой сделки, иначе она начнёт свечу заново
+    await run_in_threadpool(restore_open_candles)
+
+    journal.open()
+    sequencer.add_listener(publish_book_changes)
+    await sequencer.start()
+    logger.info("Matching sequencer started")
+
     try:
+        from kafka.outbox import relay
         from kafka.producer import init_producer
 
         await init_producer()
         logger.info("Kafka producer initialized")
 
+        sequencer.add_listener(relay.notify)
+        await relay.start()
+        logger.info("Outbox relay started")
+
         from kafka.consumer import start_consumers
 
         await start_consumers()
         logger.info("Kafka consumers started")
     except Exception as e:
-        logger.critical(f"Failed to start Kafka: {str(e)}", exc_info=True)
+        logger.critical("Failed to start Kafka: %s", e, exc_info=True)
         raise
 
+    def load_instruments():
+        db = SessionLocal()
+        try:
+            crud.load_instruments(db)
+        finally:
+            db.close()
+
+    # После подписки на события инструментов: изменение между загрузкой
+    # и подпиской не потеряется
+    await run_in_threadpool(load_instruments)
+
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Выключение Kafka"""
     logger.info("Shutting down application...")
 
+    from matching.sequencer import sequencer
+
+    await sequencer.stop()
+    logger.info("Matching sequencer stopped")
+
+    try:
+        from matching.journal import journal
+
+        journal.close()
+    except Exception as e:
+        logger.error("Error while closing journal: %s", e, exc_info=True)
+
     try:
+        from starlette.concurrency import run_in_threadpool
+
+        import crud
+        from database import SessionLocal
+        from matching.candles import candles
+
+        def save_open_candles():
+            db = SessionLocal()
+            try:
+                crud.save_candles(db, candles.open_candles())
+            finally:
+                db.close()
+
+        # Не в цикле событий: запись в БД блокирующая
+        await run_in_threadpool(save_open_candles)
+        logger.info("Open candles saved")
+    except Exception as e:
+        logger.error("Error while saving candles: %s", e, exc_info=True)
+
+    try:
+        from kafka.consumer import stop_consumers
+
+        await stop_consumers()
+        logger.info("Kafka consumers stopped")
+
+        from kafka.outbox import relay
+
+        await relay.stop()
+        logger.info("Outbox relay stopped")
+
         from kafka.producer import close_producer
 
         await close_producer()
         logger.info("Kafka producer closed")
     except Exception as e:
-        logger.error(f"Error while shutting down Kafka: {str(e)}", exc_info=True)
+        logger.error("Error while shutting down Kafka: %s", e, exc_info=True)
@@ -0,0 +1,364 @@
+import threading
+import uuid
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from uuid import UUID
+
+
+@dataclass
+class BookOrder:
+    """Остаток лимитной заявки, стоящий в стакане"""
+
+    id: UUID
+    user_id: UUID
+    direction: str
+    price: int
+    remaining: int
+
+
+@dataclass
+class Fill:
+    """Исполнение встречной (стоящей в стакане) заявки"""
+
+    maker_id: UUID
+    maker_user_id: UUID
+    price: int
+    qty: int
+
+
+@dataclass(frozen=True)
+class BookSnapshot:
+    """Агрегированный L2-срез стакана: списки (цена, суммарный остаток)"""
+
+    epoch: str
+    version: int
+    bids: List[Tuple[int, int]]
+    asks: List[Tuple[int, int]]
+
+
+@dataclass(frozen=True)
+class BookDelta:
+    """
+    Изменившиеся уровни между версиями prev_version и version: списки
+    (цена, новый суммарный остаток), 0 — уровень исчез.
+    prev_version=None — стакан новый, подписчикам нужен полный срез.
+    """
+
+    epoch: str
+    prev_version: Optional[int]
+    version: int
+    bids: List[Tuple[int, int]]
+    asks: List[Tuple[int, int]]
+
+
+def spend_from(available: int) -> Callable[[BookOrder, int, int], bool]:
+    """
+    accept для match: встречные заявки принимаются, пока на них хватает
+    available (рубли рыночной покупки). Отклонённая остаётся в стакане.
+    """
+
+    def accept(order: BookOrder, qty: int, price: int) -> bool:
+        nonlocal available
+        if available < qty * price:
+            return False
+        available -= qty * price
+        return True
+
+    return accept
+
+
+class PriceLevel:
+    """Ценовой уровень: FIFO-очередь заявок и суммарный остаток"""
+
+    __slots__ = ("price", "orders", "total")
+
+    def __init__(self, price: int):
+        self.price = price
+        self.orders: "OrderedDict[UUID, BookOrder]" = OrderedDict()
+        self.total = 0
+
+
+class BookSide:
+    """
+    Одна сторона стакана.
+    Ключи цен хранятся в отсортированном списке так, что лучшая цена всегда
+    последняя: поиск места вставки O(log P), лучшая цена и удаление
+    исчерпанного лучшего уровня за O(1).
+    """
+
+    def __init__(self, direction: str):
+        self.direction = direction
+        self._sign = 1 if direction == "BUY" else -1
+        self._keys: List[int] = []
+        self.levels: Dict[int, PriceLevel] = {}
+        # Цены уровней, изменившихся с последней публикации
+        self.changed: Set[int] = set()
+
+    def best(self) -> Optional[PriceLevel]:
+        if not self._keys:
+            return None
+        return self.levels[self._keys[-1] * self._sign]
+
+    def iter_levels(self) -> Iterator[PriceLevel]:
+        """Уровни от лучшей цены к худшей"""
+        for key in reversed(self._keys):
+            yield self.levels[key * self._sign]
+
+    def top(self, limit: Optional[int]) -> List[Tuple[int, int]]:
+        return [
+            (level.price, level.total) for level in islice(self.iter_levels(), limit)
+        ]
+
+    def add(self, order: BookOrder):
+        level = self.levels.get(order.price)
+        if level is None:
+            level = PriceLevel(order.price)
+            self.levels[order.price] = level
+            insort(self._keys, order.price * self._sign)
+        level.orders[order.id] = order
+        level.total += order.remaining
+        self.changed.add(order.price)
+
+    def remove(self, order: BookOrder):
+        level = self.levels[order.price]
+        del level.orders[order.id]
+        level.total -= order.remaining
+        self.changed.add(order.price)
+        if not level.orders:
+            self._drop_level(level.price)
+
+    def reduce(self, order: BookOrder, remaining: int):
+        """Уменьшить остаток заявки, сохранив её место в очереди уровня"""
+        self.levels[order.price].total -= order.remaining - remaining
+        order.remaining = remaining
+        self.changed.add(order.price)
+
+    def _drop_level(self, price: int):
+        del self.levels[price]
+        key = price * self._sign
+        if self._keys[-1] == key:
+            self._keys.pop()
+        else:
+            del self._keys[bisect_left(self._keys, key)]
+
+    def take_changes(self) -> List[Tuple[int, int]]:
+        changes = []
+        for price in sorted(self.changed):
+            level = self.levels.get(price)
+            changes.append((price, level.total if level is not None else 0))
+        self.changed.clear()
+        return changes
+
+
+class OrderBook:
+    """
+    Стакан одного инструмента с приоритетом цена-время.
+    Изменяет стакан только очередь инструмента; version растёт при каждом
+    изменении уровней, а L2-срезы кэшируются до следующего изменения.
+    """
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.bids = BookSide("BUY")
+        self.asks = BookSide("SELL")
+        self.orders: Dict[UUID, BookOrder] = {}
+        # epoch отличает стакан, перечитанный из БД, от предыдущего экземпляра
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._published: Optional[int] = None
+        self._lock = threading.Lock()
+        self._snapshots: Dict[Optional[int], BookSnapshot] = {}
+
+    def side(self, direction: str) -> BookSide:
+        return self.bids if direction == "BUY" else self.asks
+
+    def resting(self) -> Iterator[BookOrder]:
+        """Заявки в порядке приоритета: покупки, затем продажи"""
+        for side in (self.bids, self.asks):
+            for level in side.iter_levels():
+                yield from level.orders.values()
+
+    def snapshot(self, limit: Optional[int]) -> BookSnapshot:
+        """Лучшие limit уровней каждой стороны за O(limit); None — все уровни"""
+        cached = self._snapshots.get(limit)
+        if cached is not None and cached.version == self.version:
+            return cached
+
+        with self._lock:
+            snapshot = BookSnapshot(
+                epoch=self.epoch,
+                version=self.version,
+                bids=self.bids.top(limit),
+                asks=self.asks.top(limit),
+            )
+        self._snapshots[limit] = snapshot
+        return snapshot
+
+    def changes(self) -> Optional[BookDelta]:
+        """
+        Уровни, изменившиеся с прошлого вызова. None, если стакан не менялся.
+        Вызывается после каждой операции очереди инструмента.
+        """
+        with self._lock:
+            if self._published == self.version:
+                return None
+            delta = BookDelta(
+                epoch=self.epoch,
+                prev_version=self._published,
+                version=self.version,
+                bids=self.bids.take_changes(),
+                asks=self.asks.take_changes(),
+            )
+            self._published = self.version
+        return delta
+
+    def add(self, order: BookOrder):
+        """Поставить остаток лимитной заявки в конец очереди своего уровня"""
+        with self._lock:
+            self.side(order.direction).add(order)
+            self.orders[order.id] = order
+            self.version += 1
+
+    def cancel(self, order_id: UUID) -> Optional[BookOrder]:
+        """Снять заявку из стакана за O(1). None, если её там нет"""
+        with self._lock:
+            order = self.orders.pop(order_id, None)
+            if order is not None:
+                self.side(order.direction).remove(order)
+                self.version += 1
+        return order
+
+    def cancel_many(self, order_ids: Iterable[UUID]) -> int:
+        """Снять несколько заявок за один проход. Возвращает число снятых"""
+        removed = 0
+        with self._lock:
+            for order_id in order_ids:
+                order = self.orders.pop(order_id, None)
+                if order is not None:
+                    self.side(order.direction).remove(order)
+                    removed += 1
+            if removed:
+                self.version += 1
+        return removed
+
+    def reduce(self, order_id: UUID, remaining: int) -> Optional[BookOrder]:
+        """Уменьшить остаток заявки без потери приоритета. None, если её нет"""
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is not None:
+                self.side(order.direction).reduce(order, remaining)
+                self.version += 1
+        return order
+
+    def match(
+        self,
+        direction: str,
+        qty: int,
+        limit_price: Optional[int] = None,
+        accept: Optional[Callable[[BookOrder, int, int], bool]] = None,
+    ) -> List[Fill]:
+        """
+        Исполняет входящую заявку против противоположной стороны.
+        Обходятся только пересекающиеся уровни; limit_price=None — рыночная заявка.
+        accept(order, qty, price) может отклонить конкретную встречную заявку,
+        тогда она остаётся в стакане на своём месте.
+        """
+        with self._lock:
+            fills = self._match(direction, qty, limit_price, accept)
+            if fills:
+                self.version += 1
+        return fills
+
+    def _match(self, direction, qty, limit_price, accept) -> List[Fill]:
+        side = self.asks if direction == "BUY" else self.bids
+        keys = side._keys
+        fills: List[Fill] = []
+
+        i = len(keys) - 1
+        while qty > 0 and i >= 0:
+            level = side.levels[keys[i] * side._sign]
+            if limit_price is not None and (
+                level.price > limit_price
+                if direction == "BUY"
+                else level.price < limit_price
+            ):
+                break
+
+            executed = []
+            for order in level.orders.values():
+                if qty <= 0:
+                    break
+                trade_qty = min(qty, order.remaining)
+                if accept is not None and not accept(order, trade_qty, level.price):
+                    continue
+
+                order.remaining -= trade_qty
+                level.total -= trade_qty
+                side.changed.add(level.price)
+                qty -= trade_qty
+                fills.append(
+                    Fill(
+                        maker_id=order.id,
+                        maker_user_id=order.user_id,
+                        price=level.price,
+                        qty=trade_qty,
+                    )
+                )
+                if order.remaining == 0:
+                    executed.append(order.id)
+
+            for order_id in executed:
+                del level.orders[order_id]
+                del self.orders[order_id]
+            if not level.orders:
+                del side.levels[level.price]
+                del keys[i]
+            i -= 1
+
+        return fills
+
+
+class BookRegistry:
+    """Стаканы всех инструментов процесса"""
+
+    def __init__(self):
+        self._books: Dict[str, OrderBook] = {}
+        self._lock = threading.Lock()
+
+    def get(self, ticker: str) -> Optional[OrderBook]:
+        return self._books.get(ticker)
+
+    def get_or_load(self, ticker: str, loader: Callable[[], OrderBook]) -> OrderBook:
+        """
+        Загрузка идёт под блокировкой реестра, поэтому очередь инструмента не
+        изменит стакан, пока его параллельно читают из БД.
+        """
+        book = self._books.get(ticker)
+        if book is not None:
+            return book
+        with self._lock:
+            book = self._books.get(ticker)
+            if book is None:
+                book = loader()
+                self._books[ticker] = book
+            return book
+
+    def reset(self, ticker: str):
+        """Сбросить стакан: при следующем обращении он будет перечитан из БД"""
+        with self._lock:
+            self._books.pop(ticker, None)
+
+    def reset_all(self):
+        with self._lock:
+            self._books.clear()
+
+    def tickers(self) -> List[str]:
+        """Инструменты с загруженными стаканами"""
+        with self._lock:
+            return list(self._books)
+
+
+books = BookRegistry()
@@ -0,0 +1,152 @@
+import threading
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import settings
+
+# Интервал -> длительность в секундах
+INTERVALS: Dict[str, int] = {
+    "1s": 1,
+    "1m": 60,
+    "5m": 300,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+
+@dataclass
+class Candle:
+    ticker: str
+    interval: str
+    start: int  # unix-время начала свечи, секунды
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+    # Часть объёма, уже записанная в БД до перезапуска
+    saved_volume: int = 0
+
+    @property
+    def end(self) -> int:
+        return self.start + INTERVALS[self.interval]
+
+    def add(self, price: int, qty: int):
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.close = price
+        self.volume += qty
+
+
+class _Series:
+    """Закрытые свечи одного (тикер, интервал) по возрастанию start и текущая"""
+
+    __slots__ = ("starts", "closed", "current")
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.closed: List[Candle] = []
+        self.current: Optional[Candle] = None
+
+
+class CandleBuilder:
+    """
+    Потоковое построение OHLCV-свечей по сделкам для всех интервалов сразу.
+    В памяти хранится не больше history закрытых свечей на серию, более
+    ранние читаются из таблицы candles.
+    Открытые свечи сохраняются при остановке приложения и при старте
+    восстанавливаются из БД (restore), так что текущая свеча в памяти
+    полная; при сохранении в БД добавляется только объём сверх saved_volume.
+    """
+
+    def __init__(self, history: int):
+        self.history = history
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._lock = threading.Lock()
+
+    def on_trade(self, ticker: str, price: int, qty: int, ts: datetime) -> List[Candle]:
+        """Учесть сделку. Возвращает свечи, закрытые этой сделкой"""
+        ts = to_epoch(ts)
+        closed = []
+        with self._lock:
+            for interval, seconds in INTERVALS.items():
+                series = self._series.get((ticker, interval))
+                if series is None:
+                    series = _Series()
+                    self._series[(ticker, interval)] = series
+
+                start = ts - ts % seconds
+                current = series.current
+                if current is not None and current.start == start:
+                    current.add(price, qty)
+                    continue
+                if current is not None and current.start > start:
+                    # Сделка из уже закрытого интервала: свечи не переоткрываем
+                    continue
+
+                if current is not None:
+                    self._close(series, current)
+                    closed.append(current)
+                series.current = Candle(
+                    ticker, interval, start, price, price, price, price, qty
+                )
+        return closed
+
+    def restore(self, open_candles: Iterable[Candle]):
+        """Продолжить свечи, сохранённые открытыми; вызывается до первой сделки"""
+        with self._lock:
+            for candle in open_candles:
+                key = (candle.ticker, candle.interval)
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = _Series()
+                if series.current is None or series.current.start < candle.start:
+                    series.current = candle
+
+    def open_candles(self) -> List[Candle]:
+        with self._lock:
+            return [s.current for s in self._series.values() if s.current]
+
+    def get(
+        self, ticker: str, interval: str, start: int, end: int
+    ) -> Tuple[List[Candle], Optional[int]]:
+        """
+        Свечи серии с началом в [start, end) из памяти.
+        Второе значение — самое раннее начало свечи, которое есть в памяти:
+        всё, что раньше, нужно брать из БД.
+        """
+        with self._lock:
+            series = self._series.get((ticker, interval))
+            if series is None:
+                return [], None
+
+            lo = bisect_left(series.starts, start)
+            hi = bisect_right(series.starts, end - 1)
+            result = series.closed[lo:hi]
+            current = series.current
+            if current is not None and start <= current.start < end:
+                result.append(current)
+
+            if series.starts:
+                earliest = series.starts[0]
+            else:
+                earliest = current.start if current is not None else None
+            return result, earliest
+
+    def _close(self, series: _Series, candle: Candle):
+        series.starts.append(candle.start)
+        series.closed.append(candle)
+        if len(series.closed) > 2 * self.history:
+            del series.starts[: -self.history]
+            del series.closed[: -self.history]
+
+
+def to_epoch(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp())
+
+
+candles = CandleBuilder(history=settings.CANDLE_HISTORY)
@@ -0,0 +1,55 @@
+import json
+
+from kafka.hub import hub
+from matching.book import BookDelta, BookSnapshot, books
+
+
+def orderbook_channel(ticker: str) -> str:
+    return f"orderbook.{ticker}"
+
+
+def snapshot_message(ticker: str, snapshot: BookSnapshot) -> str:
+    return json.dumps(
+        {
+            "type": "snapshot",
+            "ticker": ticker,
+            "epoch": snapshot.epoch,
+            "seq": snapshot.version,
+            "bids": snapshot.bids,
+            "asks": snapshot.asks,
+        }
+    )
+
+
+def delta_message(ticker: str, delta: BookDelta) -> str:
+    return json.dumps(
+        {
+            "type": "delta",
+            "ticker": ticker,
+            "epoch": delta.epoch,
+            "prev_seq": delta.prev_version,
+            "seq": delta.version,
+            "bids": delta.bids,
+            "asks": delta.asks,
+        }
+    )
+
+
+def publish_book_changes(ticker: str):
+    """
+    Слушатель очереди инструмента: рассылает изменения стакана после каждой
+    операции. Для нового (перечитанного из БД) стакана рассылается полный срез.
+    """
+    book = books.get(ticker)
+    if book is None:
+        return
+    # Изменения забираются всегда, чтобы цепочка версий не прерывалась
+    delta = book.changes()
+    channel = orderbook_channel(ticker)
+    if delta is None or not hub.has_subscribers(channel):
+        return
+
+    if delta.prev_version is None:
+        hub.publish(channel, snapshot_message(ticker, book.snapshot(None)))
+    else:
+        hub.publish(channel, delta_message(ticker, delta))
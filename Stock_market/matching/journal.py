@@ -0,0 +1,727 @@
+"""
+Журнал стаканов: восстановление стаканов в памяти после рестарта.
+
+Очереди инструментов пишут в журнал каждую заявку, прошедшую в стакан,
+отмену, уменьшение остатка и исполнения. Записи транзакции сессии
+дописываются в журнал и сбрасываются на диск до коммита в БД — одним fsync
+на все очереди, закоммитившие в пределах JOURNAL_FSYNC_INTERVAL_MS. После
+коммита дописывается отметка COMMIT, после отката — ABORT. Журнал поэтому
+содержит всё, что закоммичено в БД; транзакция без отметки значит, что
+процесс упал посередине коммита.
+
+Снимок стакана пишется раз в JOURNAL_SNAPSHOT_EVERY записей инструмента,
+после загрузки стакана из БД и при остановке. При старте стакан собирается
+из последнего снимка и хвоста журнала. Если в хвосте есть транзакция без
+отметки или сброс (RESET), стакан инструмента читается из БД, как без
+журнала.
+
+Файлы: сегменты journal.<seq>.log из кадров (длина, crc32, seq, транзакция,
+вид, тикер, поля вида) и снимки <тикер>.<seq>.snap.
+
+Исполнение воспроизводимо без приложения: рыночная покупка несёт в записи
+доступные ей рубли, остальное следует из стакана.
+
+    python -m matching.journal /var/lib/stockmarket/journal --verify
+"""
+
+import argparse
+import fcntl
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from matching.book import BookOrder, Fill, OrderBook, books, spend_from
+
+logger = logging.getLogger(__name__)
+
+ORDER, FILL, CANCEL, REDUCE, COMMIT, ABORT, RESET = range(1, 8)
+
+# Кадр: длина и crc32 тела, затем тело — seq, транзакция, вид, тикер, поля
+HEADER = struct.Struct("<II")
+FRAME = struct.Struct("<QQBB")
+FIELDS = {
+    # id, пользователь, сторона, лимитная, цена, количество, бюджет
+    ORDER: struct.Struct("<16s16sBBqqq"),
+    # встречная заявка, цена, количество
+    FILL: struct.Struct("<16sqq"),
+    CANCEL: struct.Struct("<16s"),
+    REDUCE: struct.Struct("<16sq"),
+}
+SIDES = ("BUY", "SELL")
+NO_BUDGET = -1
+
+SNAPSHOT_MAGIC = b"SNP1"
+SNAPSHOT_HEADER = struct.Struct("<4sQI")
+SNAPSHOT_ORDER = struct.Struct("<16s16sBqq")
+CRC = struct.Struct("<I")
+
+# Запись, ожидающая коммита сессии: (вид, тикер, поля)
+Pending = Tuple[int, str, bytes]
+
+
+@dataclass
+class Record:
+    seq: int
+    txn: int
+    kind: int
+    ticker: str
+    fields: tuple
+
+
+def encode_frame(seq: int, txn: int, kind: int, ticker: str, payload: bytes) -> bytes:
+    name = ticker.encode("utf-8")
+    body = FRAME.pack(seq, txn, kind, len(name)) + name + payload
+    return HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def read_frames(path: str) -> Iterator[Record]:
+    """Кадры сегмента; чтение обрывается на недописанном или битом кадре"""
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, offset)
+        body = data[offset + HEADER.size : offset + HEADER.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            logger.warning("Journal %s is torn at offset %s", path, offset)
+            return
+        seq, txn, kind, name_length = FRAME.unpack_from(body)
+        start = FRAME.size + name_length
+        ticker = body[FRAME.size : start].decode("utf-8")
+        values = FIELDS[kind].unpack_from(body, start) if kind in FIELDS else ()
+        yield Record(seq, txn, kind, ticker, values)
+        offset += HEADER.size + length
+
+
+def _files(directory: str, suffix: str) -> List[Tuple[str, int, str]]:
+    """(имя, seq, путь) файлов вида <имя>.<seq><suffix> по возрастанию seq"""
+    found = []
+    for filename in os.listdir(directory):
+        if not filename.endswith(suffix):
+            continue
+        name, _, seq = filename[: -len(suffix)].rpartition(".")
+        if seq.isdigit():
+            found.append((name, int(seq), os.path.join(directory, filename)))
+    return sorted(found, key=lambda item: item[1])
+
+
+def list_segments(directory: str) -> List[Tuple[int, str]]:
+    return [(seq, path) for _, seq, path in _files(directory, ".log")]
+
+
+def list_snapshots(directory: str) -> Dict[str, List[Tuple[int, str]]]:
+    snapshots: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+    for ticker, seq, path in _files(directory, ".snap"):
+        snapshots[ticker].append((seq, path))
+    return dict(snapshots)
+
+
+def _fsync_directory(directory: str):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(directory: str, book: OrderBook, seq: int, keep: int = 2):
+    """Снимок стакана на позиции журнала seq; старше keep последних удаляются"""
+    orders = list(book.resting())
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, seq, len(orders))]
+    for o in orders:
+        parts.append(
+            SNAPSHOT_ORDER.pack(
+                o.id.bytes,
+                o.user_id.bytes,
+                SIDES.index(o.direction),
+                o.price,
+                o.remaining,
+            )
+        )
+    data = b"".join(parts)
+    data += CRC.pack(zlib.crc32(data))
+
+    path = os.path.join(directory, f"{book.ticker}.{seq:020d}.snap")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_directory(directory)
+
+    for _, old in list_snapshots(directory).get(book.ticker, [])[:-keep]:
+        os.remove(old)
+
+
+def prune_segments(directory: str) -> int:
+    """
+    Удалить сегменты, целиком покрытые самыми ранними оставшимися снимками
+    всех инструментов: replay, и с earliest, их уже не читает. Последний
+    сегмент (текущий) не трогается. Возвращает число удалённых.
+    """
+    snapshots = list_snapshots(directory)
+    if not snapshots:
+        return 0
+    floor = min(snaps[0][0] for snaps in snapshots.values())
+    segments = list_segments(directory)
+    removed = 0
+    # Записи сегмента заканчиваются перед первой записью следующего
+    for (_, path), (next_seq, _) in zip(segments, segments[1:]):
+        if next_seq - 1 > floor:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Параллельный снимок другой очереди успел раньше
+            continue
+        removed += 1
+    if removed:
+        _fsync_directory(directory)
+    return removed
+
+
+def load_snapshot(path: str, ticker: str) -> OrderBook:
+    with open(path, "rb") as f:
+        data = f.read()
+    (crc,) = CRC.unpack_from(data, len(data) - CRC.size)
+    if zlib.crc32(data[: -CRC.size]) != crc:
+        raise ValueError(f"Snapshot {path} is corrupted")
+    magic, _, count = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"Unknown snapshot format in {path}")
+
+    book = OrderBook(ticker)
+    for i in range(count):
+        order_id, user_id, side, price, remaining = SNAPSHOT_ORDER.unpack_from(
+            data, SNAPSHOT_HEADER.size + i * SNAPSHOT_ORDER.size
+        )
+        book.add(
+            BookOrder(
+                id=UUID(bytes=order_id),
+                user_id=UUID(bytes=user_id),
+                direction=SIDES[side],
+                price=price,
+                remaining=remaining,
+            )
+        )
+    return book
+
+
+def apply_order(book: OrderBook, record: Record) -> List[Fill]:
+    """Исполнить записанную заявку так же, как crud.match_order"""
+    order_id, user_id, side, limit, price, qty, budget = record.fields
+    direction = SIDES[side]
+    accept = spend_from(budget) if budget != NO_BUDGET else None
+    fills = book.match(direction, qty, price if limit else None, accept)
+    remaining = qty - sum(f.qty for f in fills)
+    if limit and remaining > 0:
+        book.add(
+            BookOrder(
+                id=UUID(bytes=order_id),
+                user_id=UUID(bytes=user_id),
+                direction=direction,
+                price=price,
+                remaining=remaining,
+            )
+        )
+    return fills
+
+
+def _book_state(book: OrderBook) -> List[Tuple[UUID, int, int]]:
+    return [(o.id, o.price, o.remaining) for o in book.resting()]
+
+
+@dataclass
+class ReplayResult:
+    books: Dict[str, OrderBook] = field(default_factory=dict)
+    # Инструменты, стакан которых нужно читать из БД
+    failed: Set[str] = field(default_factory=set)
+    last_seq: int = 0
+    applied: int = 0
+    mismatches: List[str] = field(default_factory=list)
+
+
+class Replayer:
+    """
+    Применяет закоммиченные транзакции журнала к стаканам из снимков.
+    Более поздние снимки инструмента — контрольные точки: после сброса с
+    них стакан продолжается, при verify с ними сверяется.
+    """
+
+    def __init__(
+        self,
+        snapshots: Dict[str, List[Tuple[int, str]]],
+        earliest: bool,
+        verify: bool,
+    ):
+        self.result = ReplayResult()
+        self.verify = verify
+        self.base: Dict[str, int] = {}
+        self.checkpoints: Dict[str, List[Tuple[int, str]]] = {}
+        self.open: Dict[int, List[Record]] = {}
+        self.failed_at: Dict[str, int] = {}
+        for ticker, snaps in snapshots.items():
+            seq, path = snaps[0] if earliest else snaps[-1]
+            self.result.books[ticker] = load_snapshot(path, ticker)
+            self.base[ticker] = seq
+            self.checkpoints[ticker] = [s for s in snaps if s[0] > seq]
+            self.result.last_seq = max(self.result.last_seq, snaps[-1][0])
+
+    def feed(self, records: Iterable[Record]):
+        for record in records:
+            self.result.last_seq = max(self.result.last_seq, record.seq)
+            if record.kind in (COMMIT, ABORT):
+                txn = self.open.pop(record.txn, None)
+                if txn and record.kind == COMMIT:
+                    self._commit(txn, record.seq)
+            elif self._relevant(record):
+                self.open.setdefault(record.txn, []).append(record)
+
+    def finish(self) -> ReplayResult:
+        # Транзакции без отметки: неизвестно, закоммичены ли они в БД
+        for txn in self.open.values():
+            for record in txn:
+                for ticker in self._tickers(record.ticker):
+                    self._fail(ticker, record.seq)
+        self.open.clear()
+        for ticker in list(self.checkpoints):
+            self._advance(ticker, None)
+        return self.result
+
+    def _relevant(self, record: Record) -> bool:
+        if record.ticker == "":
+            return True
+        base = self.base.get(record.ticker)
+        return base is not None and record.seq > base
+
+    def _tickers(self, ticker: str) -> List[str]:
+        return list(self.base) if ticker == "" else [ticker]
+
+    def _commit(self, txn: List[Record], commit_seq: int):
+        tickers = {t for r in txn for t in self._tickers(r.ticker)}
+        # Более ранняя транзакция того же инструмента без отметки: очередь
+        # пошла дальше, значит процесс упал посередине её коммита
+        for other in [t for t in self.open if t < txn[0].txn]:
+            stale = self.open[other]
+            if {t for r in stale for t in self._tickers(r.ticker)} & tickers:
+                for record in stale:
+                    for ticker in self._tickers(record.ticker):
+                        self._fail(ticker, record.seq)
+                del self.open[other]
+        for ticker in tickers:
+            self._advance(ticker, commit_seq)
+
+        i = 0
+        while i < len(txn):
+            record = txn[i]
+            i += 1
+            if record.kind == RESET:
+                for ticker in self._tickers(record.ticker):
+                    self._fail(ticker, record.seq)
+                continue
+            book = self.result.books.get(record.ticker)
+            if book is None:
+                continue
+            self.result.applied += 1
+            if record.kind == ORDER:
+                fills = apply_order(book, record)
+                expected = []
+                while i < len(txn) and txn[i].kind == FILL:
+                    expected.append(txn[i].fields)
+                    i += 1
+                replayed = [(f.maker_id.bytes, f.price, f.qty) for f in fills]
+                if self.verify and replayed != expected:
+                    self.result.mismatches.append(
+                        f"{record.ticker} seq {record.seq}: order "
+                        f"{UUID(bytes=record.fields[0])} filled {replayed}, "
+                        f"journal has {expected}"
+                    )
+            elif record.kind == CANCEL:
+                book.cancel(UUID(bytes=record.fields[0]))
+            elif record.kind == REDUCE:
+                order_id, remaining = record.fields
+                book.reduce(UUID(bytes=order_id), remaining)
+
+    def _advance(self, ticker: str, seq: Optional[int]):
+        """Пройти снимки инструмента, сделанные до seq (None — все)"""
+        checkpoints = self.checkpoints.get(ticker, [])
+        while checkpoints and (seq is None or checkpoints[0][0] < seq):
+            snap_seq, path = checkpoints.pop(0)
+            snapshot = load_snapshot(path, ticker)
+            book = self.result.books.get(ticker)
+            if book is None:
+                # Снимок после сброса — стакан продолжается с него
+                if snap_seq > self.failed_at.get(ticker, 0):
+                    self.result.books[ticker] = snapshot
+                    self.result.failed.discard(ticker)
+                    self.base[ticker] = snap_seq
+            elif self.verify and _book_state(book) != _book_state(snapshot):
+                self.result.mismatches.append(
+                    f"{ticker} seq {snap_seq}: replayed book differs from snapshot"
+                )
+
+    def _fail(self, ticker: str, seq: int):
+        if ticker not in self.base:
+            return
+        self.result.books.pop(ticker, None)
+        self.result.failed.add(ticker)
+        self.failed_at[ticker] = max(self.failed_at.get(ticker, 0), seq)
+
+
+def replay(
+    directory: str,
+    tickers: Optional[Set[str]] = None,
+    earliest: bool = False,
+    verify: bool = False,
+) -> ReplayResult:
+    """
+    Собрать стаканы из снимков и журнала. earliest — начинать с самых
+    ранних снимков (для проверки), иначе с последних (для восстановления).
+    """
+    snapshots = list_snapshots(directory)
+    if tickers is not None:
+        snapshots = {t: s for t, s in snapshots.items() if t in tickers}
+    replayer = Replayer(snapshots, earliest, verify)
+
+    segments = list_segments(directory)
+    start = min(replayer.base.values(), default=None)
+    # Без снимков нужен только номер последней записи — последний сегмент
+    first = len(segments) - 1
+    if start is not None:
+        while first > 0 and segments[first][0] > start + 1:
+            first -= 1
+    for _, path in segments[max(first, 0) :]:
+        replayer.feed(read_frames(path))
+    return replayer.finish()
+
+
+class Journal:
+    """
+    Запись журнала для очередей инструментов. Выключен, пока не вызван open
+    с непустым JOURNAL_DIR; тогда все методы записи — no-op.
+    """
+
+    def __init__(self):
+        self.directory: Optional[str] = None
+        self._cond = threading.Condition()
+        self._buffer: List[bytes] = []
+        self._seq = 0
+        self._durable = 0
+        self._error: Optional[Exception] = None
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._fd: Optional[int] = None
+        self._segment_size = 0
+        self._lock_fd: Optional[int] = None
+        self._recovered: Dict[str, OrderBook] = {}
+        self._since_snapshot: Dict[str, int] = defaultdict(int)
+        self._target = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def open(self):
+        """Восстановить стаканы и начать новый сегмент журнала"""
+        from config import settings
+        from database import WriterSessionLocal
+
+        if not settings.JOURNAL_DIR:
+            return
+        directory = settings.JOURNAL_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        # Стаканы в памяти одного процесса — и журнал у него свой
+        lock_fd = os.open(os.path.join(directory, "LOCK"), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            raise RuntimeError(f"Journal {directory} is used by another process")
+        self._lock_fd = lock_fd
+
+        self._fsync_interval = settings.JOURNAL_FSYNC_INTERVAL_MS / 1000
+        self._segment_bytes = settings.JOURNAL_SEGMENT_BYTES
+        self._snapshot_every = settings.JOURNAL_SNAPSHOT_EVERY
+
+        started = time.monotonic()
+        result = replay(directory)
+        self._recovered = result.books
+        self._seq = self._durable = result.last_seq
+        # Следующий старт начнёт с этих снимков, а не с хвоста журнала
+        for book in self._recovered.values():
+            write_snapshot(directory, book, self._seq)
+        logger.info(
+            "Journal recovered %s books (%s operations, %s to reload "
+            "from database) in %.2fs",
+            len(result.books),
+            result.applied,
+            len(result.failed),
+            time.monotonic() - started,
+        )
+
+        self.directory = directory
+        self._open_segment(self._seq + 1)
+        prune_segments(directory)
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="journal", daemon=True
+        )
+        self._thread.start()
+
+        # Стаканы меняются только в сессиях очередей инструментов
+        self._target = WriterSessionLocal
+        event.listen(self._target, "before_commit", self._before_commit)
+        event.listen(self._target, "after_commit", self._after_commit)
+        event.listen(self._target, "after_rollback", self._after_rollback)
+
+    def close(self):
+        """Снимки всех стаканов и остановка записи; очереди уже остановлены"""
+        if not self.enabled:
+            return
+        event.remove(self._target, "before_commit", self._before_commit)
+        event.remove(self._target, "after_commit", self._after_commit)
+        event.remove(self._target, "after_rollback", self._after_rollback)
+
+        for ticker in books.tickers():
+            self.snapshot(ticker)
+
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join()
+        os.close(self._fd)
+        os.close(self._lock_fd)
+        self.directory = None
+        self._recovered.clear()
+
+    def recovered(self, ticker: str) -> Optional[OrderBook]:
+        """Стакан, восстановленный при старте; отдаётся один раз"""
+        return self._recovered.pop(ticker, None)
+
+    # Записи копятся в сессии и попадают в журнал при её коммите
+
+    def _pending(self, db: Session) -> List[Pending]:
+        return db.info.setdefault("journal", [])
+
+    def order(self, db: Session, order, qty: int, budget: Optional[int] = None):
+        """Заявка поступает на исполнение остатком qty"""
+        if not self.enabled:
+            return
+        payload = FIELDS[ORDER].pack(
+            order.id.bytes,
+            order.user_id.bytes,
+            SIDES.index(order.direction),
+            order.type == "LIMIT",
+            order.price or 0,
+            qty,
+            NO_BUDGET if budget is None else budget,
+        )
+        self._pending(db).append((ORDER, order.instrument_ticker, payload))
+
+    def fills(self, db: Session, ticker: str, fills: List[Fill]):
+        if not self.enabled:
+            return
+        self._pending(db).extend(
+            (FILL, ticker, FIELDS[FILL].pack(f.maker_id.bytes, f.price, f.qty))
+            for f in fills
+        )
+
+    def cancel(self, db: Session, ticker: str, order_ids: Iterable[UUID]):
+        if not self.enabled:
+            return
+        self._pending(db).extend(
+            (CANCEL, ticker, FIELDS[CANCEL].pack(order_id.bytes))
+            for order_id in order_ids
+        )
+
+    def reduce(self, db: Session, ticker: str, order_id: UUID, remaining: int):
+        if not self.enabled:
+            return
+        payload = FIELDS[REDUCE].pack(order_id.bytes, remaining)
+        self._pending(db).append((REDUCE, ticker, payload))
+
+    def reset(self, db: Session, ticker: str):
+        """Стакан изменён в обход журнала: восстанавливать его из БД"""
+        if not self.enabled:
+            return
+        self._pending(db).append((RESET, ticker, b""))
+
+    def reset_all(self):
+        """Все стаканы устарели (партиции команд сменили владельца)"""
+        if not self.enabled:
+            return
+        self._recovered.clear()
+        txn, _ = self._append([(RESET, "", b"")])
+        self._append([(COMMIT, "", b"")], txn)
+
+    def loaded(self, db: Session, ticker: str):
+        """Стакан прочитан из БД: снимок после коммита сессии"""
+        if not self.enabled:
+            return
+        db.info.setdefault("journal_due", set()).add(ticker)
+
+    def mark(self, db: Session) -> int:
+        return len(self._pending(db)) if self.enabled else 0
+
+    def discard(self, db: Session, mark: int):
+        """Отбросить записи после mark (откат точки сохранения)"""
+        if self.enabled:
+            del self._pending(db)[mark:]
+
+    def snapshot(self, ticker: str):
+        book = books.get(ticker)
+        if book is None:
+            return
+        with self._cond:
+            seq = self._seq
+        try:
+            write_snapshot(self.directory, book, seq)
+            self._since_snapshot[ticker] = 0
+            prune_segments(self.directory)
+        except OSError as e:
+            logger.error("Error writing snapshot of %s: %s", ticker, e)
+
+    # Точки сохранения (begin_nested) тоже вызывают эти события. Записи
+    # копятся до коммита корневой транзакции, откат точки сохранения
+    # отбрасывает свои через mark/discard
+
+    def _before_commit(self, session: Session):
+        if session.in_nested_transaction():
+            return
+        records = session.info.pop("journal", None)
+        if not records:
+            return
+        txn, seq = self._append(records)
+        tickers = {ticker for _, ticker, _ in records}
+        session.info.setdefault("journal_txns", []).append((txn, tickers, len(records)))
+        self._wait(seq)
+
+    def _after_commit(self, session: Session):
+        if session.in_nested_transaction():
+            return
+        due = session.info.pop("journal_due", set())
+        for txn, tickers, count in session.info.pop("journal_txns", []):
+            self._append([(COMMIT, "", b"")], txn)
+            for ticker in tickers:
+                self._since_snapshot[ticker] += count
+                if self._since_snapshot[ticker] >= self._snapshot_every:
+                    due.add(ticker)
+        for ticker in due:
+            self.snapshot(ticker)
+
+    def _after_rollback(self, session: Session):
+        if session.in_nested_transaction():
+            return
+        session.info.pop("journal", None)
+        session.info.pop("journal_due", None)
+        for txn, _, _ in session.info.pop("journal_txns", []):
+            self._append([(ABORT, "", b"")], txn)
+
+    def _append(
+        self, records: Sequence[Pending], txn: Optional[int] = None
+    ) -> Tuple[int, int]:
+        """Дописать записи в буфер. Возвращает (транзакция, seq последней)"""
+        with self._cond:
+            txn = txn or self._seq + 1
+            for kind, ticker, payload in records:
+                self._seq += 1
+                self._buffer.append(encode_frame(self._seq, txn, kind, ticker, payload))
+            self._cond.notify_all()
+            return txn, self._seq
+
+    def _wait(self, seq: int):
+        """Дождаться fsync записей до seq включительно"""
+        with self._cond:
+            while self._durable < seq:
+                if self._error is not None:
+                    raise RuntimeError(f"Journal is not writable: {self._error}")
+                self._cond.wait()
+
+    def _open_segment(self, first_seq: int):
+        path = os.path.join(self.directory, f"journal.{first_seq:020d}.log")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = 0
+        _fsync_directory(self.directory)
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._stopping:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+            # Короткая пауза собирает записи остальных очередей в тот же fsync
+            if self._fsync_interval:
+                time.sleep(self._fsync_interval)
+            with self._cond:
+                frames, self._buffer = self._buffer, []
+                seq = self._seq
+
+            try:
+                data = memoryview(b"".join(frames))
+                while data:
+                    data = data[os.write(self._fd, data) :]
+                os.fdatasync(self._fd)
+                self._segment_size += sum(len(f) for f in frames)
+                if self._segment_size >= self._segment_bytes:
+                    os.close(self._fd)
+                    self._open_segment(seq + 1)
+            except OSError as e:
+                logger.critical("Journal write failed: %s", e, exc_info=True)
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._durable = seq
+                self._cond.notify_all()
+
+
+journal = Journal()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m matching.journal",
+        description="Воспроизведение журнала стаканов с самых ранних снимков",
+    )
+    parser.add_argument("directory", help="каталог журнала (JOURNAL_DIR)")
+    parser.add_argument("--ticker", action="append", help="только эти инструменты")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="сверить сделки с записанными и стаканы с поздними снимками",
+    )
+    args = parser.parse_args(argv)
+
+    tickers = set(args.ticker) if args.ticker else None
+    result = replay(args.directory, tickers, earliest=True, verify=args.verify)
+    for ticker, book in sorted(result.books.items()):
+        top = book.snapshot(1)
+        bid = top.bids[0][0] if top.bids else "-"
+        ask = top.asks[0][0] if top.asks else "-"
+        print(f"{ticker}: {len(book.orders)} orders, bid {bid}, ask {ask}")
+    for ticker in sorted(result.failed):
+        print(f"{ticker}: reset in journal, book must be loaded from database")
+    print(f"{result.applied} operations replayed up to seq {result.last_seq}")
+    for mismatch in result.mismatches:
+        print(f"MISMATCH {mismatch}")
+    return 1 if result.mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
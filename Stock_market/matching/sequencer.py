@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from config import settings
+from database import WriterSessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class Sequencer:
+    """
+    Единственный писатель для каждого инструмента.
+    Операции по тикеру ставятся в его asyncio-очередь и выполняются строго по
+    порядку поступления одной задачей, которая уносит синхронный crud-вызов в
+    пул потоков. Разные тикеры исполняются параллельно, event loop не блокируется.
+    Очередь и задача тикера живут, пока в очереди есть операции.
+    """
+
+    def __init__(self, max_workers: int):
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._intake: Optional[asyncio.Queue] = None
+        self._supervisor: Optional[asyncio.Task] = None
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, fn: Callable[[str], None]):
+        """fn(ticker) вызывается в event loop после каждой операции по тикеру"""
+        if fn not in self._listeners:
+            self._listeners.append(fn)
+
+    async def start(self):
+        """
+        Запускается при старте приложения: задачи очередей должны жить вне
+        области отмены конкретного HTTP-запроса.
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._max_workers, thread_name_prefix="matching"
+        )
+        self._intake = asyncio.Queue()
+        self._supervisor = asyncio.create_task(self._dispatch())
+
+    async def submit(self, ticker: str, fn: Callable[..., Any], *args) -> Any:
+        """
+        Выполнить fn(db, *args) в очереди инструмента и вернуть результат.
+        Сессия БД создаётся внутри рабочего потока, в контексте вызывающего
+        (счётчик запросов к БД из metrics).
+        """
+        if self._intake is None:
+            raise RuntimeError("Matching sequencer not started")
+
+        future = asyncio.get_running_loop().create_future()
+        call = (contextvars.copy_context(), time.perf_counter(), fn, args)
+        self._intake.put_nowait((ticker, call, future))
+        return await future
+
+    async def _dispatch(self):
+        while True:
+            ticker, call, future = await self._intake.get()
+            queue = self._queues.get(ticker)
+            if queue is None:
+                queue = asyncio.Queue()
+                self._queues[ticker] = queue
+                self._tasks[ticker] = asyncio.create_task(self._run(ticker, queue))
+            queue.put_nowait((call, future))
+
+    async def _run(self, ticker: str, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            call, future = await queue.get()
+            if future.done():
+                # Клиент ушёл раньше, чем подошла очередь
+                continue
+            context, queued, fn, args = call
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, context.run, _execute, queued, fn, args
+                )
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            self._notify(ticker)
+            if queue.empty():
+                # Опустевшая очередь закрывается: тикеров может быть сколько
+                # угодно (в том числе удалённых), следующая операция создаст
+                # очередь заново. Между проверкой и удалением нет await,
+                # поэтому _dispatch не положит в неё новую операцию
+                del self._queues[ticker]
+                del self._tasks[ticker]
+                return
+
+    def _notify(self, ticker: str):
+        for fn in self._listeners:
+            try:
+                fn(ticker)
+            except Exception as e:
+                logger.error("Sequencer listener failed for %s: %s", ticker, e)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        if self._supervisor is not None:
+            tasks.append(self._supervisor)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        self._supervisor = None
+        self._intake = None
+        self._tasks.clear()
+        self._queues.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def _execute(queued: float, fn: Callable[..., Any], args: tuple) -> Any:
+    metrics.LOCK_WAIT.observe(time.perf_counter() - queued)
+    db = WriterSessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+sequencer = Sequencer(max_workers=settings.MATCHING_THREADS)
@@ -0,0 +1,27 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+from uuid import UUID
+
+
+class Settlement:
+    """
+    Чистые изменения балансов по всем сделкам одной входящей заявки.
+    Применяются одной записью в конце транзакции исполнения.
+    locked — освобождаемые резервы исполненных лимитных заявок.
+    """
+
+    def __init__(self):
+        self.deltas: Dict[Tuple[UUID, str], int] = defaultdict(int)
+        self.locked: Dict[Tuple[UUID, str], int] = defaultdict(int)
+
+    def trade(self, buyer_id: UUID, seller_id: UUID, ticker: str, qty: int, price: int):
+        self.deltas[(buyer_id, ticker)] += qty
+        self.deltas[(buyer_id, "RUB")] -= qty * price
+        self.deltas[(seller_id, "RUB")] += qty * price
+        self.deltas[(seller_id, ticker)] -= qty
+
+    def release(self, user_id: UUID, ticker: str, amount: int):
+        self.locked[(user_id, ticker)] -= amount
+
+    def __bool__(self):
+        return any(self.deltas.values()) or any(self.locked.values())
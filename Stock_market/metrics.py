@@ -0,0 +1,111 @@
+"""
+Метрики Prometheus, отдаются на GET /metrics.
+
+На пути заявки только observe() гистограмм и счётчиков; глубина очередей
+WebSocket и занятость пула считаются в момент опроса /metrics.
+"""
+
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Границы задержек (с): от 100 мкс до 10 с
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries",
+    "Запросов к БД на HTTP-запрос, включая очередь инструмента",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+
+# Этапы исполнения заявки: lock_wait — ожидание в очереди инструмента (она
+# и есть блокировка стакана), scan — проход по стакану, settlement — сделки,
+# балансы и события outbox, commit — коммит транзакции
+MATCHING_STAGE = Histogram(
+    "matching_stage_duration_seconds",
+    "Время этапа исполнения заявки",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LOCK_WAIT = MATCHING_STAGE.labels("lock_wait")
+SCAN = MATCHING_STAGE.labels("scan")
+SETTLEMENT = MATCHING_STAGE.labels("settlement")
+COMMIT = MATCHING_STAGE.labels("commit")
+
+# outbox — пачка relay от первой отправки до всех подтверждений,
+# command — команда заявки при ORDER_INGESTION=kafka
+KAFKA_PRODUCE = Histogram(
+    "kafka_produce_duration_seconds",
+    "Ожидание подтверждения брокера",
+    ["source"],
+    buckets=LATENCY_BUCKETS,
+)
+KAFKA_MESSAGES = Counter(
+    "kafka_produced_messages_total", "Отправлено сообщений в Kafka", ["source"]
+)
+
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Ожидание соединения из пула, включая открытие нового",
+    buckets=LATENCY_BUCKETS,
+)
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Выданные соединения пула")
+
+WS_SUBSCRIBERS = Gauge("ws_subscribers", "Подписчики WebSocket")
+WS_QUEUE_DEPTH = Gauge(
+    "ws_fanout_queue_depth", "Сообщения в очередях подписчиков WebSocket"
+)
+WS_QUEUE_MAX = Gauge(
+    "ws_fanout_queue_max", "Самая длинная очередь подписчика WebSocket"
+)
+WS_DROPPED = Counter(
+    "ws_dropped_subscribers_total", "Подписчики, отключённые как медленные"
+)
+
+LOG_DROPPED = Counter(
+    "log_records_dropped_total", "Записи лога, не поместившиеся в очередь"
+)
+
+# Счётчик запросов к БД текущего HTTP-запроса; очередь инструмента
+# получает его вместе с копией контекста (matching.sequencer)
+_request_queries: ContextVar[Optional[list]] = ContextVar(
+    "request_queries", default=None
+)
+
+
+def start_request() -> list:
+    counter = [0]
+    _request_queries.set(counter)
+    return counter
+
+
+def count_query(*args):
+    """before_cursor_execute движков БД"""
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
@@ -0,0 +1,112 @@
+"""Исходная схема
+
+Таблицы, которые до появления миграций создавались вручную.
+На уже развёрнутой БД существующие таблицы пропускаются, так что ревизию
+можно применить поверх рабочей базы без alembic stamp.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-05-01 00:00:00
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_context().as_sql:
+        existing = set()
+    else:
+        existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.UUID(), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("role", sa.Enum("USER", "ADMIN", name="user_role")),
+            sa.Column("api_key", sa.String(), nullable=False, unique=True),
+            sa.Column("is_active", sa.Boolean()),
+            sa.Column("created_at", TIMESTAMP(timezone=True)),
+        )
+
+    if "instruments" not in existing:
+        op.create_table(
+            "instruments",
+            sa.Column("ticker", sa.String(10), primary_key=True),
+            sa.Column("name", sa.String(), nullable=False),
+            sa.Column("is_active", sa.Boolean()),
+            sa.Column("created_at", TIMESTAMP(timezone=True)),
+        )
+
+    if "orders" not in existing:
+        op.create_table(
+            "orders",
+            sa.Column("id", sa.UUID(), primary_key=True),
+            sa.Column(
+                "user_id", sa.UUID(), sa.ForeignKey("users.id", ondelete="CASCADE")
+            ),
+            sa.Column(
+                "instrument_ticker",
+                sa.String(),
+                sa.ForeignKey("instruments.ticker", ondelete="CASCADE"),
+            ),
+            sa.Column("direction", sa.Enum("BUY", "SELL", name="order_direction")),
+            sa.Column("type", sa.Enum("MARKET", "LIMIT", name="order_type")),
+            sa.Column("price", sa.Integer(), nullable=True),
+            sa.Column("quantity", sa.Integer(), nullable=False),
+            sa.Column("filled", sa.Integer()),
+            sa.Column(
+                "status",
+                sa.Enum(
+                    "NEW",
+                    "EXECUTED",
+                    "PARTIALLY_EXECUTED",
+                    "CANCELLED",
+                    name="order_status",
+                ),
+            ),
+            sa.Column("created_at", TIMESTAMP(timezone=True)),
+            sa.Column("updated_at", TIMESTAMP(timezone=True)),
+        )
+
+    if "balances" not in existing:
+        op.create_table(
+            "balances",
+            sa.Column(
+                "user_id",
+                sa.UUID(),
+                sa.ForeignKey("users.id", ondelete="CASCADE"),
+                primary_key=True,
+            ),
+            sa.Column("ticker", sa.String(), primary_key=True),
+            sa.Column("amount", sa.Integer()),
+        )
+
+    if "transactions" not in existing:
+        op.create_table(
+            "transactions",
+            sa.Column("id", sa.UUID(), primary_key=True),
+            sa.Column("buyer_id", sa.UUID()),
+            sa.Column("seller_id", sa.UUID()),
+            sa.Column("instrument_ticker", sa.String()),
+            sa.Column("price", sa.Integer()),
+            sa.Column("quantity", sa.Integer()),
+            sa.Column("created_at", TIMESTAMP(timezone=True)),
+        )
+
+
+def downgrade():
+    op.drop_table("transactions")
+    op.drop_table("balances")
+    op.drop_table("orders")
+    op.drop_table("instruments")
+    op.drop_table("users")
+    for enum_name in ("order_status", "order_type", "order_direction", "user_role"):
+        sa.Enum(name=enum_name).drop(op.get_bind(), checkfirst=True)
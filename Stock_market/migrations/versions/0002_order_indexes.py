@@ -0,0 +1,56 @@
+"""Индексы под горячие запросы
+
+- ix_orders_resting: частичный индекс только по стоящим лимитным заявкам
+  (status NEW / PARTIALLY_EXECUTED). Загрузка стакана и выборка стороны
+  стакана идут по нему, не касаясь исполненной и отменённой истории.
+- ix_orders_user_created: список заявок пользователя.
+- ix_transactions_ticker_created: последние сделки по инструменту
+  (ORDER BY created_at DESC читается обратным проходом по индексу).
+
+users.api_key уже проиндексирован ограничением UNIQUE.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-05-01 00:00:01
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+RESTING = sa.text("type = 'LIMIT' AND status IN ('NEW', 'PARTIALLY_EXECUTED')")
+
+
+def upgrade():
+    # CONCURRENTLY не блокирует запись в рабочие таблицы на время построения
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_orders_resting",
+            "orders",
+            ["instrument_ticker", "direction", "price", "created_at"],
+            postgresql_where=RESTING,
+            sqlite_where=RESTING,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_orders_user_created",
+            "orders",
+            ["user_id", "created_at"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_transactions_ticker_created",
+            "transactions",
+            ["instrument_ticker", "created_at"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    op.drop_index("ix_transactions_ticker_created", table_name="transactions")
+    op.drop_index("ix_orders_user_created", table_name="orders")
+    op.drop_index("ix_orders_resting", table_name="orders")
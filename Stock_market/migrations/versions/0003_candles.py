@@ -0,0 +1,33 @@
+"""Таблица закрытых OHLCV-свечей
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-05-01 00:00:02
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "candles",
+        sa.Column("ticker", sa.String(), primary_key=True),
+        sa.Column("interval", sa.String(3), primary_key=True),
+        sa.Column("start_time", TIMESTAMP(timezone=True), primary_key=True),
+        sa.Column("open", sa.Integer(), nullable=False),
+        sa.Column("high", sa.Integer(), nullable=False),
+        sa.Column("low", sa.Integer(), nullable=False),
+        sa.Column("close", sa.Integer(), nullable=False),
+        sa.Column("volume", sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("candles")
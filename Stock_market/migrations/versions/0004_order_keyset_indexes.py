@@ -0,0 +1,64 @@
+"""Индексы под keyset-пагинацию списка заявок
+
+- ix_orders_user_created_id заменяет ix_orders_user_created: с id в конце
+  индекс покрывает и сортировку (created_at, id), и условие курсора.
+- ix_orders_user_active: частичный индекс по активным заявкам, запрос
+  active=true читает только их, а не всю историю пользователя.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-05-01 00:00:03
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+ACTIVE = sa.text("status IN ('NEW', 'PARTIALLY_EXECUTED')")
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_orders_user_created_id",
+            "orders",
+            ["user_id", "created_at", "id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_orders_user_active",
+            "orders",
+            ["user_id", "created_at", "id"],
+            postgresql_where=ACTIVE,
+            sqlite_where=ACTIVE,
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_orders_user_created",
+            table_name="orders",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_orders_user_created",
+            "orders",
+            ["user_id", "created_at"],
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_orders_user_active",
+            table_name="orders",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_orders_user_created_id",
+            table_name="orders",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,47 @@
+"""Индекс под keyset-пагинацию и выгрузку истории сделок
+
+ix_transactions_ticker_created_id заменяет ix_transactions_ticker_created:
+с id в конце индекс покрывает сортировку (created_at, id) и условие курсора,
+а выгрузка читает сделки инструмента по индексу без сортировки.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-05-01 00:00:04
+"""
+
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_transactions_ticker_created_id",
+            "transactions",
+            ["instrument_ticker", "created_at", "id"],
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_transactions_ticker_created",
+            table_name="transactions",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_transactions_ticker_created",
+            "transactions",
+            ["instrument_ticker", "created_at"],
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_transactions_ticker_created_id",
+            table_name="transactions",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,34 @@
+"""Таблица outbox для событий Kafka
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-05-01 00:00:05
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "outbox",
+        sa.Column(
+            "id",
+            sa.BigInteger().with_variant(sa.Integer(), "sqlite"),
+            primary_key=True,
+        ),
+        sa.Column("topic", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=True),
+        sa.Column("payload", sa.JSON(), nullable=False),
+        sa.Column("created_at", TIMESTAMP(timezone=True)),
+    )
+
+
+def downgrade():
+    op.drop_table("outbox")
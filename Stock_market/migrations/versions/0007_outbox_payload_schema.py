@@ -0,0 +1,22 @@
+"""Схема сообщения в outbox для кодеков Kafka
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-05-01 00:00:06
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("outbox", sa.Column("payload_schema", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("outbox", "payload_schema")
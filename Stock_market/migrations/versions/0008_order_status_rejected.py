@@ -0,0 +1,27 @@
+"""Статус REJECTED для заявок, отклонённых при исполнении из топика команд
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-05-01 00:00:07
+"""
+
+from alembic import op
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # В SQLite Enum — обычная строка без ограничения
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    # ALTER TYPE ... ADD VALUE нельзя выполнять в транзакции до PostgreSQL 12
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE order_status ADD VALUE IF NOT EXISTS 'REJECTED'")
+
+
+def downgrade():
+    # PostgreSQL не умеет удалять значения из enum; лишнее значение безвредно
+    pass
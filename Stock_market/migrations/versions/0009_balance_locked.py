@@ -0,0 +1,48 @@
+"""Резерв средств под активные заявки: balances.locked
+
+Резерв заполняется по уже стоящим лимитным заявкам: бумаги неисполненного
+остатка для продажи, остаток по цене заявки в рублях для покупки.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-05-01 00:00:08
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+BACKFILL = sa.text("""
+    UPDATE balances SET locked = COALESCE((
+        SELECT SUM(
+            CASE WHEN o.direction = 'SELL'
+                THEN o.quantity - o.filled
+                ELSE (o.quantity - o.filled) * o.price
+            END
+        )
+        FROM orders o
+        WHERE o.user_id = balances.user_id
+          AND o.type = 'LIMIT'
+          AND o.status IN ('NEW', 'PARTIALLY_EXECUTED')
+          AND (
+            (o.direction = 'SELL' AND o.instrument_ticker = balances.ticker)
+            OR (o.direction = 'BUY' AND balances.ticker = 'RUB')
+          )
+    ), 0)
+    """)
+
+
+def upgrade():
+    op.add_column(
+        "balances",
+        sa.Column("locked", sa.Integer(), nullable=False, server_default="0"),
+    )
+    op.execute(BACKFILL)
+
+
+def downgrade():
+    op.drop_column("balances", "locked")
@@ -0,0 +1,28 @@
+"""Закрепление пачки outbox за ретранслятором: outbox.claimed_until
+
+Ретранслятор коммитит закрепление до отправки в Kafka и не держит
+транзакцию, пока ждёт подтверждений брокера.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2025-05-01 00:00:09
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects.postgresql import TIMESTAMP
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "outbox", sa.Column("claimed_until", TIMESTAMP(timezone=True), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("outbox", "claimed_until")
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import List, Literal
+from typing import List, Literal, Optional, Union
 from uuid import UUID, uuid4
 
 from pydantic import BaseModel, Field
@@ -16,6 +16,7 @@ class OrderStatus(str, Enum):
     EXECUTED = "EXECUTED"
     PARTIALLY_EXECUTED = "PARTIALLY_EXECUTED"
     CANCELLED = "CANCELLED"
+    REJECTED = "REJECTED"
 
 
 class UserRole(str, Enum):
@@ -80,6 +81,13 @@ class MarketOrderBody(BaseModel):
     qty: int = Field(..., gt=0)
 
 
+class AmendOrderBody(BaseModel):
+    """Новые цена и/или общее количество лимитной заявки"""
+
+    price: Optional[int] = Field(None, gt=0)
+    qty: Optional[int] = Field(None, gt=0)
+
+
 class LimitOrder(BaseModel):
     id: UUID = Field(default_factory=uuid4)
     status: OrderStatus
@@ -102,6 +110,30 @@ class CreateOrderResponse(BaseModel):
     order_id: UUID
 
 
+class BatchOrderRequest(BaseModel):
+    orders: List[Union[LimitOrderBody, MarketOrderBody]] = Field(
+        default_factory=list, max_length=100
+    )
+    cancels: List[UUID] = Field(default_factory=list, max_length=100)
+
+
+class BatchItemResult(BaseModel):
+    success: bool
+    order_id: Optional[UUID] = None
+    status: Optional[OrderStatus] = None
+    error: Optional[str] = None
+
+
+class BatchOrderResponse(BaseModel):
+    orders: List[BatchItemResult]
+    cancels: List[BatchItemResult]
+
+
+class CancelAllResponse(BaseModel):
+    success: bool = True
+    cancelled: List[UUID]
+
+
 class Ok(BaseModel):
     success: Literal[True] = True
 
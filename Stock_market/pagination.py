@@ -0,0 +1,60 @@
+"""
+Keyset-пагинация по (created_at, id).
+
+Курсор — непрозрачная строка с created_at и id последней строки страницы.
+Следующая страница читается условием по индексу, без OFFSET, поэтому
+стоимость запроса не растёт с глубиной истории.
+"""
+
+import base64
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import tuple_
+
+Cursor = Tuple[datetime, UUID]
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """ValueError, если курсор повреждён"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.split("|")
+        ts = datetime.fromisoformat(created_at)
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return ts, UUID(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def before(model, cursor: Cursor):
+    """Строки старше курсора (для выдачи от новых к старым)"""
+    return tuple_(model.created_at, model.id) < tuple_(*cursor)
+
+
+def after(model, cursor: Cursor):
+    """Строки новее курсора"""
+    return tuple_(model.created_at, model.id) > tuple_(*cursor)
+
+
+def next_cursor(rows: Sequence, limit: Optional[int]) -> Optional[str]:
+    """Курсор следующей страницы; None, если страница неполная"""
+    if limit is None or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last.created_at, last.id)
+
+
+def newest_first(model) -> List:
+    return [model.created_at.desc(), model.id.desc()]
+
+
+def oldest_first(model) -> List:
+    return [model.created_at.asc(), model.id.asc()]
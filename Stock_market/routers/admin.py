@@ -1,10 +1,12 @@
-from typing import Annotated
+from typing import Annotated, Union
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from crud import (
+from cache import auth_cache
+from crud_async import (
     create_instrument,
     delete_instrument,
     delete_user,
@@ -12,13 +14,13 @@ from crud import (
     get_user,
     update_balance,
 )
-from database import get_db
+from database import get_session
 from dependencies import get_admin_user
 from models import DepositRequest, Instrument, Ok, User, WithdrawRequest
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
-DbSession = Annotated[Session, Depends(get_db)]
+DbSession = Annotated[Union[Session, AsyncSession], Depends(get_session)]
 AdminUser = Annotated[User, Depends(get_admin_user)]
 
 
@@ -33,14 +35,14 @@ AdminUser = Annotated[User, Depends(get_admin_user)]
         "Если пользователь не найден, возвращается ошибка 404."
     ),
 )
-def remove_user(user_id: UUID, admin: AdminUser, db: DbSession):
+async def remove_user(user_id: UUID, admin: AdminUser, db: DbSession):
     if user_id == admin.id:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admins cannot delete themselves.",
         )
 
-    user = get_user(db, user_id)
+    user = await get_user(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
@@ -53,7 +55,7 @@ def remove_user(user_id: UUID, admin: AdminUser, db: DbSession):
             detail="Admins cannot delete other admins.",
         )
 
-    delete_user(db, user_id)
+    await delete_user(db, user_id)
     return user
 
 
@@ -67,9 +69,9 @@ def remove_user(user_id: UUID, admin: AdminUser, db: DbSession):
         "Этот метод позволяет администратору добавить новый финансовый инструмент на платформу, например, криптовалюту или токен."
     ),
 )
-def add_instrument(instrument: Instrument, admin: AdminUser, db: DbSession):
+async def add_instrument(instrument: Instrument, admin: AdminUser, db: DbSession):
 
-    create_instrument(db, instrument)
+    await create_instrument(db, instrument)
     return Ok()
 
 
@@ -84,13 +86,13 @@ def add_instrument(instrument: Instrument, admin: AdminUser, db: DbSession):
         "В случае если инструмент не найден, возвращается ошибка 404."
     ),
 )
-def remove_instrument(ticker: str, admin: AdminUser, db: DbSession):
+async def remove_instrument(ticker: str, admin: AdminUser, db: DbSession):
 
     # Логирование запроса на удаление
     print(f"Trying to delete instrument with ticker: {ticker}")
 
     # Пытаемся удалить инструмент
-    if not delete_instrument(db, ticker):
+    if not await delete_instrument(db, ticker):
         print(
             f"Instrument with ticker {ticker} not found"
         )  # Логирование, если инструмент не найден
@@ -104,6 +106,18 @@ def remove_instrument(ticker: str, admin: AdminUser, db: DbSession):
     return Ok()
 
 
+@router.get(
+    "/cache/stats",
+    summary="Cache Stats",
+    description=(
+        "Счётчики попаданий и промахов кэша авторизации по api_key. "
+        "Используется для мониторинга."
+    ),
+)
+async def cache_stats(admin: AdminUser):
+    return {"auth": auth_cache.stats()}
+
+
 @router.post(
     "/balance/deposit",
     response_model=Ok,
@@ -114,9 +128,9 @@ def remove_instrument(ticker: str, admin: AdminUser, db: DbSession):
         "Этот метод позволяет администратору пополнить баланс пользователя в определённой валюте."
     ),
 )
-def deposit_funds(request: DepositRequest, admin: AdminUser, db: DbSession):
+async def deposit_funds(request: DepositRequest, admin: AdminUser, db: DbSession):
 
-    update_balance(db, request.user_id, request.ticker, request.amount)
+    await update_balance(db, request.user_id, request.ticker, request.amount)
     return Ok()
 
 
@@ -130,21 +144,21 @@ def deposit_funds(request: DepositRequest, admin: AdminUser, db: DbSession):
         "Этот метод позволяет администратору списать средства с баланса пользователя в указанной валюте."
     ),
 )
-def withdraw_funds(request: WithdrawRequest, admin: AdminUser, db: DbSession):
+async def withdraw_funds(request: WithdrawRequest, admin: AdminUser, db: DbSession):
     if request.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
 
     if request.amount != int(request.amount):
         raise HTTPException(status_code=400, detail="Only whole numbers are allowed")
 
-    balance = get_balance(db, request.user_id, request.ticker)
+    balance = await get_balance(db, request.user_id, request.ticker)
     if balance is None:
         raise HTTPException(
             status_code=404, detail="User has no such currency on balance"
         )
 
-    if request.amount > balance.amount:
+    if request.amount > balance.amount - balance.locked:
         raise HTTPException(status_code=400, detail="Insufficient funds")
 
-    update_balance(db, request.user_id, request.ticker, -request.amount)
+    await update_balance(db, request.user_id, request.ticker, -request.amount)
     return Ok()
@@ -1,10 +1,9 @@
 from typing import Dict
 
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
 
-from crud import get_balances
-from database import get_db
+from crud_async import get_balances
+from database import DbSession, get_session
 from dependencies import get_current_user
 
 router = APIRouter()
@@ -25,9 +24,9 @@ router = APIRouter()
         }
     },
 )
-def get_balances_endpoint(
-    user=Depends(get_current_user), db: Session = Depends(get_db)
+async def get_balances_endpoint(
+    user=Depends(get_current_user), db: DbSession = Depends(get_session)
 ):
 
-    balances = get_balances(db, user.id)
+    balances = await get_balances(db, user.id)
     return {b.ticker: b.amount for b in balances}
@@ -1,21 +1,47 @@
+import asyncio
 import logging
-from typing import List, Union
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 
-from crud import cancel_order, create_order, get_instrument, get_order, get_orders
-from database import get_db
+from config import settings
+from crud import (
+    amend_order,
+    cancel_all_orders,
+    cancel_order,
+    create_order,
+    execute_batch,
+)
+from crud_async import (
+    get_instrument,
+    get_order,
+    get_orders,
+    get_orders_by_ids,
+    get_resting_tickers,
+)
+from database import DbSession, get_session
 from dependencies import get_current_user
-from kafka.producer import produce_order_event
+from kafka.hub import ORDER_COMMANDS_TOPIC
+from kafka.producer import cancel_command, place_command, send_command
+from matching.sequencer import sequencer
 from models import (
+    AmendOrderBody,
+    BatchItemResult,
+    BatchOrderRequest,
+    BatchOrderResponse,
+    CancelAllResponse,
     CreateOrderResponse,
+    Direction,
     LimitOrder,
     LimitOrderBody,
     MarketOrder,
     MarketOrderBody,
+    OrderStatus,
 )
+from pagination import decode_cursor, next_cursor
 
 logger = logging.getLogger(__name__)
 
@@ -26,16 +52,50 @@ router = APIRouter(tags=["order"])
     "/order",
     response_model=List[Union[LimitOrder, MarketOrder]],
     summary="List Orders",
+    description=(
+        "Заявки пользователя от новых к старым. "
+        "Если страница полная, заголовок X-Next-Cursor содержит курсор "
+        "следующей страницы для параметра cursor."
+    ),
 )
-def list_orders(user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def list_orders(
+    response: Response,
+    active: bool = Query(False, description="Только NEW и PARTIALLY_EXECUTED"),
+    ticker: Optional[str] = None,
+    status: Optional[OrderStatus] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    user=Depends(get_current_user),
+    db: DbSession = Depends(get_session),
+):
+    try:
+        position = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
     try:
-        logger.info(f"Listing orders for user {user.id}")
-        db_orders = get_orders(db, user.id)
+        logger.info("Listing orders for user %s", user.id)
+        db_orders = await get_orders(
+            db,
+            user.id,
+            active=active,
+            ticker=ticker,
+            order_status=status.value if status else None,
+            since=since,
+            until=until,
+            cursor=position,
+            limit=limit,
+        )
+        page_cursor = next_cursor(db_orders, limit)
+        if page_cursor is not None:
+            response.headers["X-Next-Cursor"] = page_cursor
         result = []
 
         for o in db_orders:
             if not o.instrument_ticker:
-                logger.warning(f"Order {o.id} has no instrument ticker, skipping")
+                logger.warning("Order %s has no instrument ticker, skipping", o.id)
                 continue
 
             if o.type == "LIMIT":
@@ -69,82 +129,189 @@ def list_orders(user=Depends(get_current_user), db: Session = Depends(get_db)):
                     )
                 )
 
-        logger.info(f"Returning {len(result)} orders for user {user.id}")
+        logger.info("Returning %s orders for user %s", len(result), user.id)
         return result
 
     except Exception as e:
-        logger.error(
-            f"Error listing orders for user {user.id}: {str(e)}", exc_info=True
-        )
+        logger.error("Error listing orders for user %s: %s", user.id, e, exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+def require_sync_ingestion():
+    """
+    Изменение, пакет и массовая отмена исполняются в очереди инструмента
+    этого узла; при приёме через Kafka стаканом владеет узел-consumer.
+    """
+    if settings.ORDER_INGESTION == "kafka":
+        raise HTTPException(
+            status_code=409, detail="Not available with Kafka order ingestion"
+        )
+
+
 @router.post(
     "/order",
     response_model=CreateOrderResponse,
     summary="Create Order",
+    description=(
+        "При ORDER_INGESTION=kafka заявка ставится в очередь исполнения: "
+        "ответ 202 с id заявки, статус — через GET /order/{order_id}."
+    ),
+    responses={202: {"model": CreateOrderResponse}},
 )
 async def create_order_endpoint(
     order: Union[LimitOrderBody, MarketOrderBody],
+    response: Response,
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: DbSession = Depends(get_session),
 ):
     logger.info(
-        f"Creating new order for user {user.id}, ticker: {order.ticker}, "
-        f"type: {'LIMIT' if isinstance(order, LimitOrderBody) else 'MARKET'}"
+        "Creating new order for user %s, ticker: %s, type: %s",
+        user.id,
+        order.ticker,
+        "LIMIT" if isinstance(order, LimitOrderBody) else "MARKET",
     )
 
-    instrument = get_instrument(db, order.ticker)
+    instrument = await get_instrument(db, order.ticker)
     if not instrument:
-        logger.error(f"Invalid ticker: {order.ticker}")
+        logger.error("Invalid ticker: %s", order.ticker)
         raise HTTPException(status_code=422, detail=f"Invalid ticker: {order.ticker}")
 
     if isinstance(order, LimitOrderBody):
         if order.price <= 0:
-            logger.error(f"Invalid price {order.price} for limit order")
+            logger.error("Invalid price %s for limit order", order.price)
             raise HTTPException(
                 status_code=422, detail="Price must be greater than zero."
             )
         if order.price != int(order.price):
-            logger.error(f"Non-integer price {order.price} for limit order")
+            logger.error("Non-integer price %s for limit order", order.price)
             raise HTTPException(status_code=422, detail="Price must be an integer.")
 
+    if settings.ORDER_INGESTION == "kafka":
+        command = place_command(order, user.id)
+        try:
+            await send_command(ORDER_COMMANDS_TOPIC, order.ticker, command)
+        except Exception as e:
+            logger.error("Failed to queue order: %s", e, exc_info=True)
+            raise HTTPException(status_code=503, detail="Order queue unavailable")
+        logger.info("Order %s queued", command.order_id)
+        response.status_code = 202
+        return CreateOrderResponse(order_id=command.order_id)
+
     try:
-        db_order = create_order(db, order, user.id)
-        db.refresh(db_order)
-        logger.info(f"Order created successfully: {db_order.id}")
+        db_order = await sequencer.submit(order.ticker, create_order, order, user.id)
+        logger.info("Order created successfully: %s", db_order.id)
     except HTTPException as e:
         raise e
     except ValueError as e:
-        logger.error(f"Order creation failed: {str(e)}")
+        logger.error("Order creation failed: %s", e)
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
-        logger.error(f"Unexpected error creating order: {str(e)}", exc_info=True)
+        logger.error("Unexpected error creating order: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
 
-    try:
-        await produce_order_event(db_order, "PLACED")
-        logger.debug(f"Order event produced for order {db_order.id}")
-    except Exception as e:
-        logger.error(f"Failed to produce order event: {str(e)}", exc_info=True)
-
     return CreateOrderResponse(order_id=db_order.id)
 
 
+@router.post(
+    "/orders/batch",
+    response_model=BatchOrderResponse,
+    summary="Batch Orders",
+    description=(
+        "Пакетная отмена и выставление заявок. "
+        "Операции по одному инструменту выполняются в одной транзакции: "
+        "сначала отмены, затем заявки в порядке запроса. "
+        "Результаты возвращаются в порядке запроса, "
+        "ошибка одной операции не отменяет остальные."
+    ),
+)
+async def batch_orders_endpoint(
+    batch: BatchOrderRequest,
+    user=Depends(get_current_user),
+    db: DbSession = Depends(get_session),
+):
+    require_sync_ingestion()
+    logger.info(
+        "Batch for user %s: %s orders, %s cancels",
+        user.id,
+        len(batch.orders),
+        len(batch.cancels),
+    )
+
+    # Очередь создаётся на каждый тикер: неизвестные отсекаются до отправки
+    for ticker in sorted({order.ticker for order in batch.orders}):
+        if not await get_instrument(db, ticker):
+            logger.error("Invalid ticker in batch: %s", ticker)
+            raise HTTPException(
+                status_code=404, detail=f"Instrument '{ticker}' not found."
+            )
+
+    order_results: List[Optional[BatchItemResult]] = [None] * len(batch.orders)
+    cancel_results: List[Optional[BatchItemResult]] = [None] * len(batch.cancels)
+    # ticker -> (индексы отмен, индексы заявок)
+    groups: Dict[str, Tuple[List[int], List[int]]] = defaultdict(lambda: ([], []))
+
+    if batch.cancels:
+        tickers = {
+            o.id: o.instrument_ticker
+            for o in await get_orders_by_ids(db, batch.cancels)
+            if o.user_id == user.id
+        }
+        for i, order_id in enumerate(batch.cancels):
+            if order_id in tickers:
+                groups[tickers[order_id]][0].append(i)
+            else:
+                cancel_results[i] = BatchItemResult(
+                    success=False, error="Order not found"
+                )
+    for i, order in enumerate(batch.orders):
+        groups[order.ticker][1].append(i)
+
+    async def run(ticker: str, cancel_idx: List[int], order_idx: List[int]):
+        try:
+            cancelled, placed = await sequencer.submit(
+                ticker,
+                execute_batch,
+                ticker,
+                user.id,
+                [batch.orders[i] for i in order_idx],
+                [batch.cancels[i] for i in cancel_idx],
+            )
+        except Exception as e:
+            logger.error("Batch for %s failed: %s", ticker, e, exc_info=True)
+            failed = (None, "Internal server error")
+            cancelled, placed = [failed] * len(cancel_idx), [failed] * len(order_idx)
+
+        for results, idx, items in [
+            (cancel_results, cancel_idx, cancelled),
+            (order_results, order_idx, placed),
+        ]:
+            for i, (db_order, error) in zip(idx, items):
+                if db_order is None:
+                    results[i] = BatchItemResult(success=False, error=error)
+                    continue
+                results[i] = BatchItemResult(
+                    success=True, order_id=db_order.id, status=db_order.status
+                )
+
+    await asyncio.gather(*(run(ticker, *idx) for ticker, idx in groups.items()))
+
+    return BatchOrderResponse(orders=order_results, cancels=cancel_results)
+
+
 @router.get(
     "/order/{order_id}",
     response_model=Union[LimitOrder, MarketOrder],
     summary="Get Order",
 )
-def get_order_endpoint(
-    order_id: UUID, user=Depends(get_current_user), db: Session = Depends(get_db)
+async def get_order_endpoint(
+    order_id: UUID, user=Depends(get_current_user), db: DbSession = Depends(get_session)
 ):
-    logger.info(f"Fetching order {order_id} for user {user.id}")
+    logger.info("Fetching order %s for user %s", order_id, user.id)
 
-    db_order = get_order(db, order_id)
+    db_order = await get_order(db, order_id)
     if not db_order or (db_order.user_id != user.id and user.role != "ADMIN"):
         logger.warning(
-            f"Order {order_id} not found or access denied for user {user.id}"
+            "Order %s not found or access denied for user %s", order_id, user.id
         )
         raise HTTPException(status_code=404, detail="Order not found")
 
@@ -176,54 +343,159 @@ def get_order_endpoint(
                 ),
             )
     except Exception as e:
-        logger.error(f"Error processing order {order_id}: {str(e)}", exc_info=True)
+        logger.error("Error processing order %s: %s", order_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-@router.delete("/order/{order_id}", response_model=dict, summary="Cancel Order")
+@router.patch(
+    "/order/{order_id}",
+    response_model=LimitOrder,
+    summary="Amend Order",
+    description=(
+        "Изменение цены и/или количества (общего, включая исполненное) "
+        "лимитной заявки. Уменьшение количества без смены цены сохраняет "
+        "приоритет заявки; иначе она ставится в конец очереди новой цены."
+    ),
+)
+async def amend_order_endpoint(
+    order_id: UUID,
+    amend: AmendOrderBody,
+    user=Depends(get_current_user),
+    db: DbSession = Depends(get_session),
+):
+    require_sync_ingestion()
+    logger.info("Amending order %s for user %s", order_id, user.id)
+
+    db_order = await get_order(db, order_id)
+    if not db_order or db_order.user_id != user.id:
+        logger.warning(
+            "Order %s not found or access denied for user %s", order_id, user.id
+        )
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    try:
+        db_order = await sequencer.submit(
+            db_order.instrument_ticker, amend_order, order_id, user.id, amend
+        )
+        logger.info("Order %s amended", order_id)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        logger.error("Order amend failed: %s", e)
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logger.error("Unexpected error amending order: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    return LimitOrder(
+        id=db_order.id,
+        status=db_order.status,
+        user_id=db_order.user_id,
+        timestamp=db_order.created_at,
+        body=LimitOrderBody(
+            direction=db_order.direction,
+            ticker=db_order.instrument_ticker,
+            qty=db_order.quantity,
+            price=db_order.price,
+        ),
+        filled=db_order.filled,
+    )
+
+
+@router.delete(
+    "/order",
+    response_model=CancelAllResponse,
+    summary="Cancel All Orders",
+    description=(
+        "Отмена всех стоящих в стакане заявок пользователя, "
+        "по всем инструментам или по одному, с фильтром по направлению"
+    ),
+)
+async def cancel_all_orders_endpoint(
+    ticker: Optional[str] = None,
+    direction: Optional[Direction] = None,
+    user=Depends(get_current_user),
+    db: DbSession = Depends(get_session),
+):
+    require_sync_ingestion()
+    side = direction.value if direction else None
+    logger.info("Cancelling all orders for user %s, ticker: %s", user.id, ticker)
+
+    if ticker and not await get_instrument(db, ticker):
+        logger.error("Invalid ticker for cancel all: %s", ticker)
+        raise HTTPException(status_code=404, detail=f"Instrument '{ticker}' not found.")
+
+    tickers = [ticker] if ticker else await get_resting_tickers(db, user.id, side)
+    try:
+        results = await asyncio.gather(
+            *(sequencer.submit(t, cancel_all_orders, t, user.id, side) for t in tickers)
+        )
+    except Exception as e:
+        logger.error("Error cancelling all orders: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    cancelled = [order_id for order_ids in results for order_id in order_ids]
+    return CancelAllResponse(cancelled=cancelled)
+
+
+@router.delete(
+    "/order/{order_id}",
+    response_model=dict,
+    summary="Cancel Order",
+    description="При ORDER_INGESTION=kafka отмена ставится в очередь: ответ 202.",
+)
 async def cancel_order_endpoint(
-    order_id: UUID, user=Depends(get_current_user), db: Session = Depends(get_db)
+    order_id: UUID,
+    response: Response,
+    user=Depends(get_current_user),
+    db: DbSession = Depends(get_session),
 ):
-    logger.info(f"Cancelling order {order_id} for user {user.id}")
+    logger.info("Cancelling order %s for user %s", order_id, user.id)
 
-    db_order = get_order(db, order_id)
+    db_order = await get_order(db, order_id)
 
     if not db_order or db_order.user_id != user.id:
         logger.warning(
-            f"Order {order_id} not found or access denied for user {user.id}"
+            "Order %s not found or access denied for user %s", order_id, user.id
         )
         raise HTTPException(status_code=404, detail="Order not found")
 
     if db_order.status == "CANCELLED":
-        logger.warning(f"Order {order_id} already cancelled")
+        logger.warning("Order %s already cancelled", order_id)
         raise HTTPException(status_code=422, detail="Order already cancelled")
 
+    if settings.ORDER_INGESTION == "kafka":
+        try:
+            await send_command(
+                ORDER_COMMANDS_TOPIC,
+                db_order.instrument_ticker,
+                cancel_command(order_id, user.id),
+            )
+        except Exception as e:
+            logger.error("Failed to queue cancellation: %s", e, exc_info=True)
+            raise HTTPException(status_code=503, detail="Order queue unavailable")
+        logger.info("Cancellation of order %s queued", order_id)
+        response.status_code = 202
+        return {"success": True}
+
     try:
-        success = cancel_order(db, order_id)
+        success = await sequencer.submit(
+            db_order.instrument_ticker, cancel_order, order_id
+        )
         if not success:
-            logger.error(f"Order {order_id} cannot be cancelled in current state")
+            logger.error("Order %s cannot be cancelled in current state", order_id)
             raise HTTPException(
                 status_code=400, detail="Order cannot be cancelled in its current state"
             )
 
-        db.refresh(db_order)
-        logger.info(f"Order {order_id} cancelled successfully")
-
-        try:
-            await produce_order_event(db_order, "CANCELLED")
-            logger.debug(f"Order cancellation event produced for order {order_id}")
-        except Exception as e:
-            logger.error(
-                f"Failed to produce cancellation event: {str(e)}", exc_info=True
-            )
-            # Не прерываем выполнение, так как ордер уже отменен
+        logger.info("Order %s cancelled successfully", order_id)
 
         return {"success": True}
 
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error cancelling order {order_id}: {str(e)}", exc_info=True)
+        logger.error("Error cancelling order %s: %s", order_id, e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error while processing order cancellation",
@@ -1,73 +1,131 @@
 import asyncio
-import json
-from typing import Dict
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Set
 
-from aiokafka import AIOKafkaConsumer
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
 
-from config import settings
+import crud
+from cache import instruments
+from kafka.consumer import ingestor
+from kafka.hub import TRADES_TOPIC, hub, order_status_topic
+from matching.book import books
+from matching.feed import orderbook_channel, snapshot_message
+from matching.sequencer import sequencer
 
 router = APIRouter()
 
 
 class ConnectionManager:
+    """Активные сокеты; у одного пользователя их может быть несколько"""
+
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        self.active_connections: Dict[str, Set[WebSocket]] = defaultdict(set)
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
-        self.active_connections[user_id] = websocket
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
+        self.active_connections[user_id].add(websocket)
+
+    def disconnect(self, websocket: WebSocket, user_id: str):
+        sockets = self.active_connections.get(user_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
             del self.active_connections[user_id]
 
     async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+        for websocket in list(self.active_connections.get(user_id, ())):
+            await websocket.send_text(message)
 
 
 manager = ConnectionManager()
 
 
+async def stream(
+    websocket: WebSocket, channel: str, initial: Optional[Callable[[], str]] = None
+):
+    """
+    Пересылает сообщения канала хаба в сокет, пока клиент не отключится.
+    initial() строит первое сообщение сразу после подписки, так что между ним
+    и потоком сообщений ничего не теряется.
+    Медленный клиент, переполнивший очередь, закрывается с кодом 1013.
+    """
+    subscriber = hub.subscribe(channel)
+    if initial is not None:
+        subscriber.push(initial())
+
+    async def send():
+        while True:
+            message = await subscriber.queue.get()
+            if message is None:
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                return
+            await websocket.send_text(message)
+
+    async def receive():
+        # Входящие сообщения не нужны, читаем только чтобы заметить отключение
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    tasks = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        hub.unsubscribe(channel, subscriber)
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+
+
 @router.websocket("/orders/{user_id}")
 async def websocket_order_updates(websocket: WebSocket, user_id: str):
     await manager.connect(websocket, user_id)
-
-    consumer = AIOKafkaConsumer(
-        f"stockmarket.orders.{user_id}.status",
-        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
-    )
-
-    await consumer.start()
-
     try:
-        while True:
-            async for message in consumer:
-                await manager.send_personal_message(json.dumps(message.value), user_id)
-            await asyncio.sleep(0.1)
-    except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        await consumer.stop()
+        await stream(websocket, order_status_topic(user_id))
+    finally:
+        manager.disconnect(websocket, user_id)
 
 
 @router.websocket("/trades")
 async def websocket_trade_updates(websocket: WebSocket):
     await websocket.accept()
+    await stream(websocket, TRADES_TOPIC)
+
+
+@router.websocket("/orderbook/{ticker}")
+async def websocket_orderbook(websocket: WebSocket, ticker: str):
+    """
+    Поток стакана: сначала полный L2-срез {"type": "snapshot", "seq", ...},
+    затем изменения уровней {"type": "delta", "prev_seq", "seq", "bids", "asks"}
+    с новым суммарным остатком (0 — уровень исчез).
+    Дельта применима, если prev_seq <= seq клиента < seq дельты; иначе пропуск
+    и клиенту нужно переподключиться. Смена epoch тоже означает новый срез.
+    """
+    # Неизвестный тикер отсекается до очереди инструмента: она создаётся
+    # на любую строку
+    if instruments.get(ticker) is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    # Изменения стакана публикует только узел, который его ведёт: здесь
+    # поток был бы устаревшим
+    if not ingestor.owns(ticker):
+        await websocket.close(
+            code=status.WS_1013_TRY_AGAIN_LATER,
+            reason="Order book is served by another node",
+        )
+        return
+
+    book = books.get(ticker)
+    if book is None:
+        book = await sequencer.submit(ticker, crud.get_book, ticker)
+
+    def initial() -> str:
+        # Стакан мог быть перечитан из БД, пока сокет подключался
+        current = books.get(ticker) or book
+        return snapshot_message(ticker, current.snapshot(None))
 
-    consumer = AIOKafkaConsumer(
-        "stockmarket.trades",
-        bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
-        value_deserializer=lambda v: json.loads(v.decode("utf-8")),
-    )
-
-    await consumer.start()
-
-    try:
-        while True:
-            async for message in consumer:
-                await websocket.send_text(json.dumps(message.value))
-            await asyncio.sleep(0.1)
-    except WebSocketDisconnect:
-        await consumer.stop()
+    await websocket.accept()
+    await stream(websocket, orderbook_channel(ticker), initial)
@@ -3,8 +3,19 @@ from datetime import datetime
 from zoneinfo import ZoneInfo
 
 from pydantic import BaseModel
-from sqlalchemy import UUID as SQLUUID
-from sqlalchemy import Boolean, Column, Enum, ForeignKey, Integer, String
+from sqlalchemy import (
+    JSON,
+    UUID as SQLUUID,
+    BigInteger,
+    Boolean,
+    Column,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    text,
+)
 from sqlalchemy.dialects.postgresql import TIMESTAMP
 from sqlalchemy.orm import relationship
 
@@ -40,8 +51,35 @@ class Instrument(Base):
     orders = relationship("Order", back_populates="instrument", passive_deletes=True)
 
 
+# Стоящие в стакане заявки — для частичного индекса
+RESTING_ORDER = text("type = 'LIMIT' AND status IN ('NEW', 'PARTIALLY_EXECUTED')")
+# Активные заявки. Запросы используют то же выражение литералом, иначе
+# планировщик не сможет доказать, что частичный индекс подходит
+ACTIVE_ORDER = text("status IN ('NEW', 'PARTIALLY_EXECUTED')")
+
+
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index(
+            "ix_orders_resting",
+            "instrument_ticker",
+            "direction",
+            "price",
+            "created_at",
+            postgresql_where=RESTING_ORDER,
+            sqlite_where=RESTING_ORDER,
+        ),
+        Index("ix_orders_user_created_id", "user_id", "created_at", "id"),
+        Index(
+            "ix_orders_user_active",
+            "user_id",
+            "created_at",
+            "id",
+            postgresql_where=ACTIVE_ORDER,
+            sqlite_where=ACTIVE_ORDER,
+        ),
+    )
 
     id = Column(SQLUUID, primary_key=True, default=uuid.uuid4)
     user_id = Column(SQLUUID, ForeignKey("users.id", ondelete="CASCADE"))
@@ -54,7 +92,14 @@ class Order(Base):
     quantity = Column(Integer, nullable=False)
     filled = Column(Integer, default=0)
     status = Column(
-        Enum("NEW", "EXECUTED", "PARTIALLY_EXECUTED", "CANCELLED", name="order_status"),
+        Enum(
+            "NEW",
+            "EXECUTED",
+            "PARTIALLY_EXECUTED",
+            "CANCELLED",
+            "REJECTED",
+            name="order_status",
+        ),
         default="NEW",
     )
     created_at = Column(TIMESTAMP(timezone=True), default=utcnow)
@@ -74,12 +119,19 @@ class Balance(Base):
     )
     ticker = Column(String, primary_key=True)
     amount = Column(Integer, default=0)
+    # Зарезервировано под активные заявки; доступно amount - locked
+    locked = Column(Integer, nullable=False, default=0, server_default="0")
 
     user = relationship("User", back_populates="balances", passive_deletes=True)
 
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index(
+            "ix_transactions_ticker_created_id", "instrument_ticker", "created_at", "id"
+        ),
+    )
 
     id = Column(SQLUUID, primary_key=True, default=uuid.uuid4)
     buyer_id = Column(SQLUUID)
@@ -88,3 +140,37 @@ class Transaction(Base):
     price = Column(Integer)
     quantity = Column(Integer)
     created_at = Column(TIMESTAMP(timezone=True), default=utcnow)
+
+
+class Candle(Base):
+    __tablename__ = "candles"
+
+    ticker = Column(String, primary_key=True)
+    interval = Column(String(3), primary_key=True)
+    start_time = Column(TIMESTAMP(timezone=True), primary_key=True)
+    open = Column(Integer, nullable=False)
+    high = Column(Integer, nullable=False)
+    low = Column(Integer, nullable=False)
+    close = Column(Integer, nullable=False)
+    volume = Column(Integer, nullable=False)
+
+
+class OutboxEvent(Base):
+    """
+    Событие для Kafka, записанное в той же транзакции, что и изменение.
+    Ретранслятор закрепляет пачку за собой, отправляет события по
+    возрастанию id и удаляет отправленные.
+    """
+
+    __tablename__ = "outbox"
+
+    # В SQLite автоинкремент есть только у INTEGER PRIMARY KEY
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    topic = Column(String, nullable=False)
+    key = Column(String)
+    payload = Column(JSON, nullable=False)
+    # Схема сообщения для кодека (kafka.codecs.SCHEMAS)
+    payload_schema = Column(String)
+    created_at = Column(TIMESTAMP(timezone=True), default=utcnow)
+    # До этого момента пачку отправляет ретранслятор, забравший её
+    claimed_until = Column(TIMESTAMP(timezone=True))
@@ -0,0 +1,50 @@
+import os
+import tempfile
+
+# Настройки читаются при импорте приложения: отдельная SQLite и без Kafka
+_directory = tempfile.mkdtemp(prefix="stock-market-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_directory}/test.sqlite")
+os.environ.setdefault("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
+os.environ.setdefault("JOURNAL_DIR", "")
+
+import pytest  # noqa: E402
+
+import crud  # noqa: E402
+import models  # noqa: E402
+from cache import instruments  # noqa: E402
+from database import Base, WriterSessionLocal, engine  # noqa: E402
+from matching.book import books  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    """Сессия очереди инструмента над пустой схемой"""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    instruments.replace([])
+    books.reset_all()
+    session = WriterSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        books.reset_all()
+
+
+@pytest.fixture
+def ticker(db):
+    crud.create_instrument(db, models.Instrument(name="Meme", ticker="MEME"))
+    return "MEME"
+
+
+@pytest.fixture
+def make_user(db):
+    """Пользователь с балансами {тикер: сумма}"""
+
+    def make(name: str, **balances: int):
+        user = crud.create_user(db, models.NewUser(name=name))
+        for balance_ticker, amount in balances.items():
+            crud.update_balance(db, user.id, balance_ticker, amount)
+        return user
+
+    return make
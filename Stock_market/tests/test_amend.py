@@ -0,0 +1,109 @@
+import pytest
+from fastapi import HTTPException
+
+import crud
+import models
+
+
+def limit(direction: str, qty: int, price: int) -> models.LimitOrderBody:
+    return models.LimitOrderBody(
+        direction=direction, ticker="MEME", qty=qty, price=price
+    )
+
+
+def balance(db, user, ticker):
+    row = crud.get_balance(db, user.id, ticker)
+    db.refresh(row)
+    return row.amount, row.locked
+
+
+def test_reducing_quantity_keeps_queue_position(db, ticker, make_user):
+    first = make_user("first", MEME=10)
+    second = make_user("second", MEME=10)
+    buyer = make_user("buyer", RUB=1000)
+    order = crud.create_order(db, limit("SELL", 5, 10), first.id)
+    crud.create_order(db, limit("SELL", 3, 10), second.id)
+
+    crud.amend_order(db, order.id, first.id, models.AmendOrderBody(qty=3))
+
+    assert balance(db, first, "MEME") == (10, 3)
+    assert crud.get_book(db, ticker).asks.top(None) == [(10, 6)]
+
+    crud.create_order(db, limit("BUY", 2, 10), buyer.id)
+
+    # Первая заявка осталась первой в очереди
+    assert balance(db, first, "MEME") == (8, 1)
+    assert balance(db, second, "MEME") == (10, 3)
+
+
+def test_raising_quantity_moves_to_back_of_queue(db, ticker, make_user):
+    first = make_user("first", MEME=10)
+    second = make_user("second", MEME=10)
+    buyer = make_user("buyer", RUB=1000)
+    order = crud.create_order(db, limit("SELL", 3, 10), first.id)
+    crud.create_order(db, limit("SELL", 3, 10), second.id)
+
+    crud.amend_order(db, order.id, first.id, models.AmendOrderBody(qty=4))
+    crud.create_order(db, limit("BUY", 2, 10), buyer.id)
+
+    assert balance(db, first, "MEME") == (10, 4)
+    assert balance(db, second, "MEME") == (8, 1)
+
+
+def test_price_change_requeues_and_can_execute(db, ticker, make_user):
+    seller = make_user("seller", MEME=10)
+    buyer = make_user("buyer", RUB=1000)
+    crud.create_order(db, limit("BUY", 4, 9), buyer.id)
+    order = crud.create_order(db, limit("SELL", 4, 11), seller.id)
+
+    amended = crud.amend_order(db, order.id, seller.id, models.AmendOrderBody(price=9))
+
+    assert (amended.id, amended.price, amended.status) == (order.id, 9, "EXECUTED")
+    assert balance(db, seller, "MEME") == (6, 0)
+    assert balance(db, seller, "RUB") == (36, 0)
+    assert balance(db, buyer, "RUB") == (964, 0)
+    assert crud.get_book(db, ticker).asks.top(None) == []
+    assert crud.get_book(db, ticker).bids.top(None) == []
+
+
+def test_buy_hold_follows_price_and_quantity(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=10)
+    order = crud.create_order(db, limit("BUY", 5, 10), buyer.id)
+    crud.create_order(db, limit("SELL", 1, 10), seller.id)
+    assert balance(db, buyer, "RUB") == (90, 40)
+
+    # Остаток 4 по новой цене 12
+    crud.amend_order(db, order.id, buyer.id, models.AmendOrderBody(price=12))
+    assert balance(db, buyer, "RUB") == (90, 48)
+
+    # Остаток 2: лишний резерв освобождается
+    crud.amend_order(db, order.id, buyer.id, models.AmendOrderBody(qty=3))
+    assert balance(db, buyer, "RUB") == (90, 24)
+    assert crud.get_book(db, ticker).bids.top(None) == [(12, 2)]
+
+
+def test_unaffordable_amend_changes_nothing(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    order = crud.create_order(db, limit("BUY", 5, 10), buyer.id)
+
+    with pytest.raises(HTTPException) as error:
+        crud.amend_order(db, order.id, buyer.id, models.AmendOrderBody(price=30))
+
+    assert error.value.status_code == 422
+    assert balance(db, buyer, "RUB") == (100, 50)
+    assert crud.get_order(db, order.id).price == 10
+    assert crud.get_book(db, ticker).bids.top(None) == [(10, 5)]
+
+
+def test_quantity_cannot_drop_to_filled(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=10)
+    order = crud.create_order(db, limit("BUY", 5, 10), buyer.id)
+    crud.create_order(db, limit("SELL", 2, 10), seller.id)
+
+    with pytest.raises(HTTPException) as error:
+        crud.amend_order(db, order.id, buyer.id, models.AmendOrderBody(qty=2))
+
+    assert error.value.status_code == 400
+    assert crud.get_book(db, ticker).bids.top(None) == [(10, 3)]
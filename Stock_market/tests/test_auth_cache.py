@@ -0,0 +1,85 @@
+from uuid import uuid4
+
+import pytest
+
+import cache
+import crud
+import models
+from cache import AuthCache, AuthUser, TTLCache, auth_cache
+
+
+def auth_user(user_id=None, api_key="key") -> AuthUser:
+    return AuthUser(
+        id=user_id or uuid4(),
+        name="trader",
+        role="USER",
+        api_key=api_key,
+        is_active=True,
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое время для проверки ttl"""
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_entry_is_evicted():
+    lru = TTLCache(maxsize=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+
+    lru.set("c", 3)
+
+    assert (lru.get("a"), lru.get("b"), lru.get("c")) == (1, None, 3)
+    assert lru.stats() == {"size": 2, "hits": 3, "misses": 1}
+
+
+def test_entry_expires_after_ttl(clock):
+    lru = TTLCache(maxsize=10, ttl=30)
+    lru.set("a", 1)
+
+    clock[0] += 29
+    assert lru.get("a") == 1
+    clock[0] += 2
+    assert lru.get("a") is None
+    assert lru.stats()["size"] == 0
+
+
+def test_invalidate_user_drops_their_key():
+    users = AuthCache(maxsize=10, ttl=60)
+    kept, dropped = auth_user(api_key="kept"), auth_user(api_key="dropped")
+    users.set("kept", kept)
+    users.set("dropped", dropped)
+
+    users.invalidate_user(dropped.id)
+    users.invalidate_user(uuid4())
+
+    assert users.get("dropped") is None
+    assert users.get("kept") == kept
+
+
+def test_eviction_forgets_user_key():
+    users = AuthCache(maxsize=1, ttl=60)
+    first = auth_user(api_key="first")
+    users.set("first", first)
+    users.set("second", auth_user(api_key="second"))
+
+    # Вытесненная запись не оставляет ссылок на себя
+    assert first.id not in users._keys_by_user
+    users.invalidate_user(first.id)
+    assert users.stats()["size"] == 1
+
+
+def test_deleted_user_is_not_served_from_cache(db):
+    user = crud.create_user(db, models.NewUser(name="trader"))
+    auth_cache.clear()
+    auth_cache.set(user.api_key, auth_user(user.id, user.api_key))
+
+    assert crud.delete_user(db, user.id)
+
+    assert auth_cache.get(user.api_key) is None
+    assert crud.get_user_by_api_key(db, user.api_key) is None
@@ -0,0 +1,82 @@
+from uuid import uuid4
+
+import crud
+import models
+
+
+def limit(direction: str, qty: int, price: int) -> models.LimitOrderBody:
+    return models.LimitOrderBody(
+        direction=direction, ticker="MEME", qty=qty, price=price
+    )
+
+
+def balance(db, user, ticker):
+    row = crud.get_balance(db, user.id, ticker)
+    db.refresh(row)
+    return row.amount, row.locked
+
+
+def test_batch_cancels_first_then_places_in_order(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=10)
+    resting = crud.create_order(db, limit("BUY", 8, 8), buyer.id)
+    crud.create_order(db, limit("SELL", 2, 9), seller.id)
+
+    # Без отмены резерва на новую заявку не хватило бы
+    cancelled, placed = crud.execute_batch(
+        db,
+        ticker,
+        buyer.id,
+        [limit("BUY", 2, 9), limit("BUY", 5, 8)],
+        [resting.id],
+    )
+
+    assert [(o.id, o.status, e) for o, e in cancelled] == [
+        (resting.id, "CANCELLED", None)
+    ]
+    assert [(o.status, o.filled, e) for o, e in placed] == [
+        ("EXECUTED", 2, None),
+        ("NEW", 0, None),
+    ]
+    assert balance(db, buyer, "RUB") == (82, 40)
+    assert balance(db, buyer, "MEME") == (2, 0)
+    assert crud.get_book(db, ticker).bids.top(None) == [(8, 5)]
+    assert crud.get_book(db, ticker).asks.top(None) == []
+
+
+def test_failed_item_does_not_undo_the_rest(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=10)
+    crud.create_order(db, limit("SELL", 3, 10), seller.id)
+    unknown = uuid4()
+
+    cancelled, placed = crud.execute_batch(
+        db,
+        ticker,
+        buyer.id,
+        [limit("BUY", 1, 10), limit("BUY", 50, 10), limit("BUY", 2, 9)],
+        [unknown],
+    )
+
+    assert cancelled == [(None, "Order not found")]
+    assert [o.status if o else e for o, e in placed] == [
+        "EXECUTED",
+        "Insufficient balance",
+        "NEW",
+    ]
+    assert balance(db, buyer, "RUB") == (90, 18)
+    # Стакан в памяти совпадает с перечитанным из базы
+    for book in (crud.get_book(db, ticker), crud.load_book(db, ticker)):
+        assert book.asks.top(None) == [(10, 2)]
+        assert book.bids.top(None) == [(9, 2)]
+
+
+def test_unknown_ticker_fails_every_item(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    order = models.LimitOrderBody(direction="BUY", ticker="NOPE", qty=1, price=1)
+
+    cancelled, placed = crud.execute_batch(db, "NOPE", buyer.id, [order], [uuid4()])
+
+    assert cancelled == [(None, "Invalid ticker")]
+    assert placed == [(None, "Invalid ticker")]
+    assert balance(db, buyer, "RUB") == (100, 0)
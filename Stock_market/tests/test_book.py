@@ -0,0 +1,106 @@
+from uuid import uuid4
+
+from matching.book import BookOrder, OrderBook, spend_from
+
+
+def rest(book: OrderBook, direction: str, price: int, qty: int) -> BookOrder:
+    order = BookOrder(
+        id=uuid4(), user_id=uuid4(), direction=direction, price=price, remaining=qty
+    )
+    book.add(order)
+    return order
+
+
+def test_match_takes_best_price_then_time():
+    book = OrderBook("MEME")
+    first = rest(book, "SELL", 10, 3)
+    second = rest(book, "SELL", 10, 5)
+    far = rest(book, "SELL", 11, 4)
+
+    fills = book.match("BUY", 6, 10)
+
+    assert [(f.maker_id, f.price, f.qty) for f in fills] == [
+        (first.id, 10, 3),
+        (second.id, 10, 3),
+    ]
+    assert book.asks.top(None) == [(10, 2), (11, 4)]
+    assert first.id not in book.orders
+    assert book.orders[second.id].remaining == 2
+    assert book.orders[far.id].remaining == 4
+
+
+def test_limit_price_stops_matching():
+    book = OrderBook("MEME")
+    rest(book, "BUY", 12, 2)
+    rest(book, "BUY", 11, 2)
+    rest(book, "BUY", 9, 2)
+
+    fills = book.match("SELL", 10, 11)
+
+    assert [(f.price, f.qty) for f in fills] == [(12, 2), (11, 2)]
+    assert book.bids.top(None) == [(9, 2)]
+
+
+def test_market_order_sweeps_levels_and_drops_empty_ones():
+    book = OrderBook("MEME")
+    rest(book, "SELL", 10, 1)
+    rest(book, "SELL", 12, 1)
+    rest(book, "SELL", 15, 5)
+
+    fills = book.match("BUY", 4)
+
+    assert [(f.price, f.qty) for f in fills] == [(10, 1), (12, 1), (15, 2)]
+    assert book.asks.top(None) == [(15, 3)]
+    assert list(book.asks.levels) == [15]
+
+
+def test_rejected_counter_order_keeps_its_place():
+    book = OrderBook("MEME")
+    big = rest(book, "SELL", 10, 5)
+    small = rest(book, "SELL", 10, 1)
+
+    # Бюджета хватает только на одну бумагу: большая заявка пропускается
+    fills = book.match("BUY", 5, None, spend_from(10))
+
+    assert [(f.maker_id, f.qty) for f in fills] == [(small.id, 1)]
+    assert list(book.asks.levels[10].orders) == [big.id]
+    assert book.asks.top(None) == [(10, 5)]
+
+
+def test_reduce_keeps_time_priority():
+    book = OrderBook("MEME")
+    first = rest(book, "SELL", 10, 5)
+    second = rest(book, "SELL", 10, 5)
+
+    assert book.reduce(first.id, 1) is first
+    assert book.asks.top(None) == [(10, 6)]
+
+    fills = book.match("BUY", 2, 10)
+
+    assert [(f.maker_id, f.qty) for f in fills] == [(first.id, 1), (second.id, 1)]
+    assert book.asks.top(None) == [(10, 4)]
+
+
+def test_reduce_unknown_order():
+    book = OrderBook("MEME")
+    version = book.version
+
+    assert book.reduce(uuid4(), 1) is None
+    assert book.version == version
+
+
+def test_cancel_many_removes_known_orders_in_one_version():
+    book = OrderBook("MEME")
+    a = rest(book, "BUY", 9, 1)
+    b = rest(book, "BUY", 9, 2)
+    c = rest(book, "SELL", 11, 3)
+    version = book.version
+
+    assert book.cancel_many([a.id, c.id, uuid4()]) == 2
+    assert book.version == version + 1
+    assert book.bids.top(None) == [(9, 2)]
+    assert book.asks.top(None) == []
+    assert set(book.orders) == {b.id}
+
+    assert book.cancel_many([uuid4()]) == 0
+    assert book.version == version + 1
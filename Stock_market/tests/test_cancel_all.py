@@ -0,0 +1,69 @@
+import crud
+import models
+import schemas
+
+
+def limit(direction: str, ticker: str, qty: int, price: int) -> models.LimitOrderBody:
+    return models.LimitOrderBody(
+        direction=direction, ticker=ticker, qty=qty, price=price
+    )
+
+
+def balance(db, user, ticker):
+    row = crud.get_balance(db, user.id, ticker)
+    db.refresh(row)
+    return row.amount, row.locked
+
+
+def test_cancel_all_is_limited_to_ticker_and_side(db, ticker, make_user):
+    crud.create_instrument(db, models.Instrument(name="Coin", ticker="COIN"))
+    trader = make_user("trader", RUB=1000, MEME=10, COIN=10)
+    buys = [
+        crud.create_order(db, limit("BUY", ticker, 2, 5), trader.id),
+        crud.create_order(db, limit("BUY", ticker, 3, 6), trader.id),
+    ]
+    crud.create_order(db, limit("SELL", ticker, 4, 20), trader.id)
+    crud.create_order(db, limit("BUY", "COIN", 1, 7), trader.id)
+    assert balance(db, trader, "RUB") == (1000, 35)
+
+    cancelled = crud.cancel_all_orders(db, ticker, trader.id, "BUY")
+
+    assert sorted(cancelled) == sorted(order.id for order in buys)
+    assert balance(db, trader, "RUB") == (1000, 7)
+    assert balance(db, trader, "MEME") == (10, 4)
+    assert crud.get_book(db, ticker).bids.top(None) == []
+    assert crud.get_book(db, ticker).asks.top(None) == [(20, 4)]
+    assert crud.get_book(db, "COIN").bids.top(None) == [(7, 1)]
+    assert crud.get_resting_tickers(db, trader.id, "BUY") == ["COIN"]
+
+
+def test_cancel_all_releases_remainder_of_partial_fill(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=10)
+    order = crud.create_order(db, limit("BUY", ticker, 5, 10), buyer.id)
+    crud.create_order(db, limit("SELL", ticker, 2, 10), seller.id)
+
+    assert crud.cancel_all_orders(db, ticker, buyer.id) == [order.id]
+
+    assert crud.get_order(db, order.id).status == "CANCELLED"
+    assert balance(db, buyer, "RUB") == (80, 0)
+    assert balance(db, buyer, "MEME") == (2, 0)
+    assert crud.load_book(db, ticker).bids.top(None) == []
+
+
+def test_cancel_all_emits_one_event(db, ticker, make_user):
+    trader = make_user("trader", RUB=100)
+    for price in (1, 2, 3):
+        crud.create_order(db, limit("BUY", ticker, 1, price), trader.id)
+    db.query(schemas.OutboxEvent).delete()
+    db.commit()
+
+    cancelled = crud.cancel_all_orders(db, ticker, trader.id)
+
+    (event,) = db.query(schemas.OutboxEvent).all()
+    assert event.key == ticker
+    assert event.payload["status"] == "cancelled"
+    assert sorted(event.payload["orderIds"]) == sorted(str(i) for i in cancelled)
+    # Повтор ничего не находит и событий не пишет
+    assert crud.cancel_all_orders(db, ticker, trader.id) == []
+    assert db.query(schemas.OutboxEvent).count() == 1
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+
+import crud
+from matching.candles import Candle, CandleBuilder
+
+T0 = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+START = int(T0.timestamp())
+
+
+def at(seconds: float) -> datetime:
+    return T0 + timedelta(seconds=seconds)
+
+
+def ohlcv(candle: Candle):
+    return candle.open, candle.high, candle.low, candle.close, candle.volume
+
+
+def test_trades_build_candles_of_every_interval():
+    builder = CandleBuilder(history=10)
+    builder.on_trade("MEME", 10, 1, at(5))
+    builder.on_trade("MEME", 12, 2, at(20))
+    builder.on_trade("MEME", 9, 3, at(40))
+
+    closed = builder.on_trade("MEME", 11, 4, at(65))
+
+    # Сделка следующей минуты закрывает минутную и секундную свечи
+    assert sorted(c.interval for c in closed) == ["1m", "1s"]
+    (minute,) = [c for c in closed if c.interval == "1m"]
+    assert (minute.start, ohlcv(minute)) == (START, (10, 12, 9, 9, 6))
+    candles, earliest = builder.get("MEME", "1m", START, START + 120)
+    assert [ohlcv(c) for c in candles] == [(10, 12, 9, 9, 6), (11, 11, 11, 11, 4)]
+    assert earliest == START
+    (hour,), _ = builder.get("MEME", "1h", START, START + 3600)
+    assert ohlcv(hour) == (10, 12, 9, 11, 10)
+
+
+def test_late_trade_does_not_reopen_closed_candle():
+    builder = CandleBuilder(history=10)
+    builder.on_trade("MEME", 10, 1, at(5))
+    builder.on_trade("MEME", 11, 1, at(65))
+
+    assert builder.on_trade("MEME", 50, 1, at(30)) == []
+
+    candles, _ = builder.get("MEME", "1m", START, START + 120)
+    assert [ohlcv(c) for c in candles] == [(10, 10, 10, 10, 1), (11, 11, 11, 11, 1)]
+
+
+def test_memory_keeps_limited_history():
+    builder = CandleBuilder(history=2)
+    for minute in range(6):
+        builder.on_trade("MEME", 10 + minute, 1, at(60 * minute))
+
+    candles, earliest = builder.get("MEME", "1m", START, START + 600)
+
+    # Пятая закрытая свеча превысила 2 * history: остались две последние,
+    # более ранние читаются из БД
+    assert earliest == START + 180
+    assert [c.open for c in candles] == [13, 14, 15]
+
+
+def test_open_candle_survives_restart(db):
+    now = datetime.now(timezone.utc)
+    before = CandleBuilder(history=10)
+    before.on_trade("MEME", 10, 2, now)
+    before.on_trade("MEME", 14, 3, now)
+    crud.save_candles(db, before.open_candles())
+
+    after = CandleBuilder(history=10)
+    after.restore(crud.get_open_candles(db))
+    after.on_trade("MEME", 8, 1, now)
+    crud.save_candles(db, after.open_candles())
+
+    (day,) = [c for c in after.open_candles() if c.interval == "1d"]
+    assert ohlcv(day) == (10, 14, 8, 8, 6)
+    # Объём до перезапуска не задваивается
+    (saved,) = crud.get_candle_history(db, "MEME", "1d", day.start, day.end)
+    assert ohlcv(saved) == (10, 14, 8, 8, 6)
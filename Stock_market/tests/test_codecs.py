@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+from config import settings
+from kafka.codecs import (
+    codec_for,
+    decode_message,
+    decode_model,
+    encode_message,
+    get_codec,
+    message_text,
+)
+from kafka.schemas import (
+    CancelOrderPayload,
+    OrderDirection,
+    OrderStatus,
+    OrderStatusPayload,
+    OrderType,
+    PlaceOrderPayload,
+    TradeUpdatePayload,
+)
+
+NOW = datetime(2025, 3, 4, 5, 6, 7, 891011, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def struct_topics(monkeypatch):
+    """struct для топиков binary.*, остальные — JSON"""
+    monkeypatch.setattr(settings, "KAFKA_TOPIC_CODECS", {"binary.*": "struct"})
+    codec_for.cache_clear()
+    yield
+    codec_for.cache_clear()
+
+
+MESSAGES = [
+    PlaceOrderPayload(
+        order_id=uuid4(),
+        user_id=uuid4(),
+        instrument="MEME",
+        type=OrderType.LIMIT,
+        direction=OrderDirection.BUY,
+        price=12.5,
+        quantity=3,
+        timestamp=NOW,
+    ),
+    PlaceOrderPayload(
+        order_id=uuid4(),
+        user_id=uuid4(),
+        instrument="MEME",
+        type=OrderType.MARKET,
+        direction=OrderDirection.SELL,
+        quantity=1,
+        timestamp=NOW,
+    ),
+    CancelOrderPayload(order_id=uuid4(), user_id=uuid4(), timestamp=NOW),
+    OrderStatusPayload(order_id=uuid4(), status=OrderStatus.EXECUTED, timestamp=NOW),
+    TradeUpdatePayload(
+        trade_id=uuid4(),
+        seller_id=uuid4(),
+        instrument="Мем",
+        price=10,
+        quantity=7,
+        timestamp=NOW,
+    ),
+]
+
+
+@pytest.mark.parametrize("topic", ["binary.orders", "text.orders"])
+@pytest.mark.parametrize("message", MESSAGES, ids=lambda m: type(m).__name__)
+def test_schema_messages_round_trip(topic, message):
+    value, headers = encode_message(
+        topic, message.model_dump(mode="json"), type(message).__name__
+    )
+
+    assert decode_model(value, headers) == message
+    # Текст для WebSocket — JSON в любом кодеке
+    assert type(message).model_validate_json(message_text(value, headers)) == message
+
+
+def test_struct_is_smaller_than_json():
+    payload = MESSAGES[0].model_dump(mode="json")
+
+    binary, headers = encode_message("binary.orders", payload, "PlaceOrderPayload")
+    text, _ = encode_message("text.orders", payload, "PlaceOrderPayload")
+
+    assert dict(headers) == {
+        "content-type": b"application/x-struct",
+        "schema": b"PlaceOrderPayload/2",
+    }
+    assert len(binary) < len(text) / 2
+
+
+def test_message_without_schema_stays_json():
+    payload = {"ticker": "MEME", "action": "created"}
+
+    value, headers = encode_message("binary.instruments", payload)
+
+    assert dict(headers) == {"content-type": b"application/json"}
+    assert decode_message(value, headers) == payload
+    # Сообщения без заголовков (старые) читаются как JSON
+    assert decode_message(value) == payload
+
+
+def test_unknown_schema_version_is_rejected():
+    value, _ = encode_message("binary.status", MESSAGES[3].model_dump(mode="json"))
+    headers = [
+        ("content-type", b"application/json"),
+        ("schema", b"OrderStatusPayload/99"),
+    ]
+
+    with pytest.raises(ValueError):
+        decode_message(value, headers)
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        get_codec("avro")
@@ -0,0 +1,106 @@
+import pytest
+from fastapi import HTTPException
+
+import crud
+import models
+
+
+def limit(direction: str, qty: int, price: int) -> models.LimitOrderBody:
+    return models.LimitOrderBody(
+        direction=direction, ticker="MEME", qty=qty, price=price
+    )
+
+
+def balance(db, user, ticker):
+    row = crud.get_balance(db, user.id, ticker)
+    db.refresh(row)
+    return row.amount, row.locked
+
+
+def test_limit_order_holds_funds_until_filled(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=10)
+
+    crud.create_order(db, limit("BUY", 5, 12), buyer.id)
+
+    assert balance(db, buyer, "RUB") == (1000, 60)
+    assert crud.get_book(db, ticker).bids.top(None) == [(12, 5)]
+
+    crud.create_order(db, limit("SELL", 5, 12), seller.id)
+
+    assert balance(db, buyer, "RUB") == (940, 0)
+    assert balance(db, buyer, "MEME") == (5, 0)
+    assert balance(db, seller, "RUB") == (60, 0)
+    assert balance(db, seller, "MEME") == (5, 0)
+    assert crud.get_book(db, ticker).bids.top(None) == []
+
+
+def test_price_improvement_releases_whole_hold(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=10)
+
+    crud.create_order(db, limit("SELL", 3, 10), seller.id)
+    assert balance(db, seller, "MEME") == (10, 3)
+
+    # Покупка по 12 исполняется по цене стакана 10; остаток 2 ждёт по 12
+    order = crud.create_order(db, limit("BUY", 5, 12), buyer.id)
+
+    assert order.status == "PARTIALLY_EXECUTED"
+    assert balance(db, buyer, "RUB") == (970, 24)
+    assert balance(db, buyer, "MEME") == (3, 0)
+    assert balance(db, seller, "RUB") == (30, 0)
+    assert balance(db, seller, "MEME") == (7, 0)
+    assert crud.get_book(db, ticker).asks.top(None) == []
+    assert crud.get_book(db, ticker).bids.top(None) == [(12, 2)]
+
+
+def test_cancel_releases_remaining_hold(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=10)
+
+    order = crud.create_order(db, limit("BUY", 5, 12), buyer.id)
+    crud.create_order(db, limit("SELL", 2, 12), seller.id)
+    assert balance(db, buyer, "RUB") == (976, 36)
+
+    crud.cancel_order(db, order.id, buyer.id)
+
+    assert balance(db, buyer, "RUB") == (976, 0)
+    assert crud.get_book(db, ticker).bids.top(None) == []
+
+
+def test_held_funds_cannot_back_another_order(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+
+    crud.create_order(db, limit("BUY", 8, 10), buyer.id)
+
+    with pytest.raises(HTTPException) as error:
+        crud.create_order(db, limit("BUY", 3, 10), buyer.id)
+
+    assert error.value.status_code == 422
+    assert balance(db, buyer, "RUB") == (100, 80)
+    assert crud.get_book(db, ticker).bids.top(None) == [(10, 8)]
+
+
+def test_market_buy_is_limited_by_free_funds(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=10)
+
+    crud.create_order(db, limit("BUY", 5, 10), buyer.id)
+    crud.create_order(db, limit("SELL", 3, 11), seller.id)
+    crud.create_order(db, limit("SELL", 5, 12), seller.id)
+
+    # Свободно 50 рублей: 3 бумаги по 11, на следующую заявку не хватает,
+    # резерв под покупку по 10 не тратится
+    order = crud.create_order(
+        db,
+        models.MarketOrderBody(direction="BUY", ticker="MEME", qty=5),
+        buyer.id,
+    )
+
+    assert order.filled == 3
+    assert balance(db, buyer, "RUB") == (67, 50)
+    assert balance(db, buyer, "MEME") == (3, 0)
+    assert balance(db, seller, "RUB") == (33, 0)
+    assert balance(db, seller, "MEME") == (7, 5)
+    assert crud.get_book(db, ticker).asks.top(None) == [(12, 5)]
+    assert crud.get_book(db, ticker).bids.top(None) == [(10, 5)]
@@ -0,0 +1,192 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import crud
+import kafka.consumer
+import main
+import models
+from config import settings
+from database import SessionLocal
+from kafka.codecs import decode_message
+from kafka.hub import ORDER_COMMANDS_TOPIC, TRADES_TOPIC, order_status_topic
+from kafka.memory import broker
+
+
+@pytest.fixture
+def db(db):
+    """
+    Сессия с отложенным BEGIN: сессия очереди держала бы блокировку записи
+    после первого же чтения, пока работает приложение
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def coin(db):
+    crud.create_instrument(db, models.Instrument(name="Coin", ticker="COIN"))
+    return "COIN"
+
+
+@pytest.fixture
+def client(db, ticker, monkeypatch):
+    """
+    Приложение с приёмом заявок через брокер в памяти.
+    Идёт последним в аргументах теста: данные заводятся до старта
+    """
+    monkeypatch.setattr(settings, "KAFKA_BOOTSTRAP_SERVERS", "memory://")
+    monkeypatch.setattr(settings, "ORDER_INGESTION", "kafka")
+    broker.reset()
+    with TestClient(main.app) as client:
+        yield client
+    broker.reset()
+
+
+@pytest.fixture
+def seller(make_user, ticker):
+    return make_user("seller", **{ticker: 100})
+
+
+@pytest.fixture
+def buyer(make_user):
+    return make_user("buyer", RUB=1000)
+
+
+@pytest.fixture
+def coin_seller(make_user, coin):
+    return make_user("coin", **{coin: 5})
+
+
+def auth(user) -> dict:
+    return {"Authorization": f"TOKEN {user.api_key}"}
+
+
+def place(client, user, direction, ticker, qty, price=None) -> str:
+    body = {"direction": direction, "ticker": ticker, "qty": qty}
+    if price is not None:
+        body["price"] = price
+    response = client.post("/api/v1/order", json=body, headers=auth(user))
+    assert response.status_code == 202
+    return response.json()["order_id"]
+
+
+def wait_status(client, user, order_id, *statuses, timeout=10.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        response = client.get(f"/api/v1/order/{order_id}", headers=auth(user))
+        if response.status_code == 200 and response.json()["status"] in statuses:
+            return response.json()
+        assert time.monotonic() < deadline, response.json()
+        time.sleep(0.05)
+
+
+def messages(topic):
+    return [
+        decode_message(record.value, record.headers)
+        for partition in broker.topics.get(topic, [])
+        for record in partition
+    ]
+
+
+def wait_messages(topic, count, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while len(messages(topic)) < count:
+        assert time.monotonic() < deadline, messages(topic)
+        time.sleep(0.05)
+    return messages(topic)
+
+
+def test_order_is_accepted_and_reported_on_status_topic(seller, ticker, client):
+    order_id = place(client, seller, "SELL", ticker, 10, 10)
+
+    # Ответ не ждёт исполнения: команда только записана в топик
+    assert len(messages(ORDER_COMMANDS_TOPIC)) == 1
+    assert wait_status(client, seller, order_id, "NEW")["body"]["qty"] == 10
+
+    (placed,) = wait_messages(order_status_topic(seller.id), 1)
+    assert placed["orderId"] == order_id
+    assert placed["status"] == "placed"
+
+
+def test_commands_of_instrument_run_in_order(seller, buyer, ticker, client):
+    sell_id = place(client, seller, "SELL", ticker, 10, 10)
+    buy_id = place(client, buyer, "BUY", ticker, 10, 12)
+
+    wait_status(client, buyer, buy_id, "EXECUTED")
+    wait_status(client, seller, sell_id, "EXECUTED")
+    (trade,) = wait_messages(TRADES_TOPIC, 1)
+    # Покупка пришла второй и взяла цену продавца
+    assert (trade["price"], trade["quantity"]) == (10, 10)
+    statuses = wait_messages(order_status_topic(buyer.id), 2)
+    assert [m["status"] for m in statuses] == ["placed", "executed"]
+
+
+def test_failed_command_is_retried_before_later_ones(
+    seller, buyer, coin_seller, coin, ticker, monkeypatch, client
+):
+    sell_id = place(client, seller, "SELL", ticker, 10, 10)
+    wait_status(client, seller, sell_id, "NEW")
+
+    cancel = kafka.consumer.cancel_order_command
+    calls = []
+
+    def flaky_cancel(session, command):
+        calls.append(str(command.order_id))
+        if len(calls) == 1:
+            raise RuntimeError("database went away")
+        return cancel(session, command)
+
+    monkeypatch.setattr(kafka.consumer, "cancel_order_command", flaky_cancel)
+    response = client.delete(f"/api/v1/order/{sell_id}", headers=auth(seller))
+    assert response.status_code == 202
+    buy_id = place(client, buyer, "BUY", ticker, 10, 10)
+    coin_id = place(client, coin_seller, "SELL", coin, 5, 3)
+
+    # Отмена повторена и прошла раньше покупки: сделки не было
+    wait_status(client, seller, sell_id, "CANCELLED")
+    wait_status(client, buyer, buy_id, "NEW")
+    wait_status(client, coin_seller, coin_id, "NEW")
+    assert calls == [sell_id, sell_id]
+    assert messages(TRADES_TOPIC) == []
+
+    # Смещения зафиксированы за последней командой каждой партиции
+    partitions = broker.topics[ORDER_COMMANDS_TOPIC]
+    deadline = time.monotonic() + 10
+    while True:
+        committed = {
+            tp.partition: offset
+            for (group, tp), offset in broker.committed.items()
+            if group == settings.KAFKA_ORDERS_GROUP
+        }
+        expected = {p: len(log) for p, log in enumerate(partitions) if log}
+        if all(committed.get(p) == n for p, n in expected.items()):
+            break
+        assert time.monotonic() < deadline, committed
+        time.sleep(0.05)
+
+
+def test_node_local_endpoints_are_rejected(seller, ticker, client):
+    order_id = place(client, seller, "SELL", ticker, 10, 10)
+    wait_status(client, seller, order_id, "NEW")
+
+    responses = [
+        client.patch(
+            f"/api/v1/order/{order_id}", json={"qty": 5}, headers=auth(seller)
+        ),
+        client.post(
+            "/api/v1/orders/batch",
+            json={"orders": [], "cancels": [order_id]},
+            headers=auth(seller),
+        ),
+        client.delete("/api/v1/order", headers=auth(seller)),
+    ]
+
+    for response in responses:
+        assert response.status_code == 409
+        assert response.json()["detail"] == "Not available with Kafka order ingestion"
+    assert wait_status(client, seller, order_id, "NEW")["body"]["qty"] == 10
@@ -0,0 +1,226 @@
+import os
+import shutil
+from uuid import uuid4
+
+import pytest
+from sqlalchemy import event
+
+import crud
+import models
+from config import settings
+from database import WriterSessionLocal
+from matching.book import BookOrder, OrderBook, books
+from matching.journal import (
+    ABORT,
+    COMMIT,
+    FIELDS,
+    ORDER,
+    SIDES,
+    encode_frame,
+    journal,
+    list_segments,
+    read_frames,
+    replay,
+    write_snapshot,
+)
+
+
+def state(book: OrderBook):
+    return [(o.id, o.direction, o.price, o.remaining) for o in book.resting()]
+
+
+@pytest.fixture
+def journal_dir(db, tmp_path, monkeypatch):
+    directory = str(tmp_path / "journal")
+    monkeypatch.setattr(settings, "JOURNAL_DIR", directory)
+    journal.open()
+    yield directory
+    if journal.enabled:
+        journal.close()
+
+
+def limit(direction, qty, price):
+    return models.LimitOrderBody(
+        direction=direction, ticker="MEME", qty=qty, price=price
+    )
+
+
+def crash_copy(directory: str) -> str:
+    """Копия журнала, как после падения процесса в этот момент"""
+    # Отметка COMMIT последней транзакции пишется после коммита в БД
+    journal._wait(journal._seq)
+    crashed = directory + ".crash"
+    shutil.copytree(directory, crashed)
+    return crashed
+
+
+def records(directory: str):
+    return [r for _, path in list_segments(directory) for r in read_frames(path)]
+
+
+@pytest.fixture
+def trading(db, ticker, make_user, journal_dir):
+    """Стакан после сделок, отмены и частичного исполнения"""
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=20)
+
+    crud.create_order(db, limit("SELL", 5, 10), seller.id)
+    far = crud.create_order(db, limit("SELL", 3, 11), seller.id)
+    crud.create_order(db, limit("BUY", 4, 10), buyer.id)
+    crud.create_order(db, limit("BUY", 2, 9), buyer.id)
+    crud.cancel_order(db, far.id, seller.id)
+
+    book = crud.get_book(db, ticker)
+    assert book.bids.top(None) == [(9, 2)]
+    assert book.asks.top(None) == [(10, 1)]
+    return state(book)
+
+
+def test_crash_recovery_replays_journal_tail(db, ticker, trading, journal_dir):
+    result = replay(crash_copy(journal_dir))
+
+    assert ticker not in result.failed
+    assert result.applied > 0
+    assert state(result.books[ticker]) == trading
+    assert result.books[ticker].bids.top(None) == [(9, 2)]
+    assert result.books[ticker].asks.top(None) == [(10, 1)]
+
+
+def test_failed_batch_commit_is_not_replayed(db, ticker, make_user, journal_dir):
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=20)
+    crud.create_order(db, limit("SELL", 5, 10), seller.id)
+    before = journal._seq
+
+    def fail(session):
+        if not session.in_nested_transaction():
+            raise RuntimeError("commit failed")
+
+    # После обработчика журнала: записи пакета уже на диске
+    event.listen(WriterSessionLocal, "before_commit", fail)
+    try:
+        with pytest.raises(RuntimeError):
+            crud.execute_batch(
+                db, ticker, buyer.id, [limit("BUY", 2, 10), limit("BUY", 1, 9)], []
+            )
+    finally:
+        event.remove(WriterSessionLocal, "before_commit", fail)
+
+    crashed = crash_copy(journal_dir)
+    batch = [r for r in records(crashed) if r.seq > before]
+    orders = [r for r in batch if r.kind == ORDER]
+    # Весь пакет — одна транзакция журнала, отменённая вместе с коммитом
+    assert len(orders) == 2
+    assert {r.txn for r in batch} == {orders[0].txn}
+    assert [r.kind for r in batch if r.kind in (COMMIT, ABORT)] == [ABORT]
+
+    result = replay(crashed)
+
+    assert ticker not in result.failed
+    assert state(result.books[ticker]) == state(crud.load_book(db, ticker))
+    assert result.books[ticker].asks.top(None) == [(10, 5)]
+    assert result.books[ticker].bids.top(None) == []
+
+
+def test_rolled_back_batch_item_keeps_the_rest(db, ticker, make_user, journal_dir):
+    buyer = make_user("buyer", RUB=100)
+    seller = make_user("seller", MEME=20)
+    crud.create_order(db, limit("SELL", 5, 10), seller.id)
+
+    # Вторая заявка не проходит по резерву, её точка сохранения откатывается
+    cancelled, placed = crud.execute_batch(
+        db,
+        ticker,
+        buyer.id,
+        [limit("BUY", 2, 10), limit("BUY", 50, 9), limit("BUY", 1, 8)],
+        [],
+    )
+    assert [error for _, error in placed] == [None, "Insufficient balance", None]
+
+    result = replay(crash_copy(journal_dir))
+
+    assert ticker not in result.failed
+    assert state(result.books[ticker]) == state(crud.get_book(db, ticker))
+    assert result.books[ticker].asks.top(None) == [(10, 3)]
+    assert result.books[ticker].bids.top(None) == [(8, 1)]
+
+
+def test_snapshot_due_at_cancel_all_has_no_cancelled_orders(
+    db, ticker, make_user, journal_dir, monkeypatch
+):
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=20)
+    for price in (10, 11, 12):
+        crud.create_order(db, limit("SELL", 2, price), seller.id)
+    crud.create_order(db, limit("BUY", 1, 9), buyer.id)
+
+    # Снимок после каждого коммита: он приходится и на отмену всех заявок
+    monkeypatch.setattr(journal, "_snapshot_every", 1)
+    assert len(crud.cancel_all_orders(db, ticker, seller.id)) == 3
+
+    result = replay(crash_copy(journal_dir))
+
+    assert ticker not in result.failed
+    assert result.books[ticker].asks.top(None) == []
+    assert result.books[ticker].bids.top(None) == [(9, 1)]
+    assert state(result.books[ticker]) == state(crud.load_book(db, ticker))
+
+
+def test_restart_restores_book_from_snapshot(db, ticker, trading):
+    journal.close()
+    books.reset_all()
+
+    journal.open()
+
+    assert state(journal.recovered(ticker)) == trading
+    assert state(crud.get_book(db, ticker)) == trading
+
+
+def test_unfinished_transaction_falls_back_to_database(tmp_path):
+    directory = str(tmp_path)
+    book = OrderBook("MEME")
+    resting = BookOrder(uuid4(), uuid4(), "SELL", 10, 5)
+    book.add(resting)
+    write_snapshot(directory, book, 0)
+
+    def order(seq, txn):
+        payload = FIELDS[ORDER].pack(
+            uuid4().bytes, uuid4().bytes, SIDES.index("BUY"), True, 10, 1, -1
+        )
+        return encode_frame(seq, txn, ORDER, "MEME", payload)
+
+    # Транзакция 1 без отметки, а следующая по тому же стакану закоммичена:
+    # процесс упал посередине коммита первой
+    frames = [order(1, 1), order(2, 2), encode_frame(3, 2, COMMIT, "", b"")]
+    with open(os.path.join(directory, f"journal.{1:020d}.log"), "wb") as f:
+        f.write(b"".join(frames))
+
+    result = replay(directory)
+
+    assert "MEME" in result.failed
+    assert "MEME" not in result.books
+    assert result.last_seq == 3
+
+
+def test_committed_tail_is_applied_to_snapshot(tmp_path):
+    directory = str(tmp_path)
+    book = OrderBook("MEME")
+    resting = BookOrder(uuid4(), uuid4(), "SELL", 10, 5)
+    book.add(resting)
+    write_snapshot(directory, book, 0)
+
+    buy = FIELDS[ORDER].pack(
+        uuid4().bytes, uuid4().bytes, SIDES.index("BUY"), True, 10, 2, -1
+    )
+    frames = [
+        encode_frame(1, 1, ORDER, "MEME", buy),
+        encode_frame(2, 1, COMMIT, "", b""),
+    ]
+    with open(os.path.join(directory, f"journal.{1:020d}.log"), "wb") as f:
+        f.write(b"".join(frames))
+
+    result = replay(directory)
+
+    assert result.failed == set()
+    assert result.books["MEME"].asks.top(None) == [(10, 3)]
+    assert result.books["MEME"].orders[resting.id].remaining == 3
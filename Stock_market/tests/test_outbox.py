@@ -0,0 +1,84 @@
+import asyncio
+
+import crud
+import kafka.producer
+import schemas
+from kafka.outbox import OutboxRelay
+
+
+def add_events(db, count: int):
+    for number in range(count):
+        crud.add_event(db, ("topic", f"key-{number}", {"number": number}, None))
+    db.commit()
+
+
+def test_claimed_batch_is_held_until_released(db):
+    add_events(db, 5)
+
+    batch = crud.claim_outbox_batch(db, 3, 30)
+
+    assert [event.key for event in batch] == ["key-0", "key-1", "key-2"]
+    # Пока пачка закреплена, следующие события тоже ждут: иначе порядок
+    # по ключу нарушится
+    assert crud.claim_outbox_batch(db, 3, 30) == []
+
+    crud.release_outbox_events(db, [event.id for event in batch])
+
+    again = crud.claim_outbox_batch(db, 3, 30)
+    assert [event.id for event in again] == [event.id for event in batch]
+
+
+def test_expired_claim_is_taken_over(db):
+    add_events(db, 2)
+    batch = crud.claim_outbox_batch(db, 10, 0)
+
+    assert [event.id for event in crud.claim_outbox_batch(db, 10, 30)] == [
+        event.id for event in batch
+    ]
+
+
+def test_delivered_events_are_deleted(db):
+    add_events(db, 4)
+    batch = crud.claim_outbox_batch(db, 2, 30)
+
+    crud.delete_outbox_events(db, [event.id for event in batch])
+
+    assert [event.key for event in crud.claim_outbox_batch(db, 10, 30)] == [
+        "key-2",
+        "key-3",
+    ]
+    assert db.query(schemas.OutboxEvent).count() == 2
+
+
+class SlowProducer:
+    """Подтверждает каждое сообщение с задержкой"""
+
+    def __init__(self):
+        self.sent = []
+        self.sending = asyncio.Event()
+
+    async def send(self, topic, value=None, key=None, headers=None):
+        self.sending.set()
+        await asyncio.sleep(0.05)
+        self.sent.append(key)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+
+
+def test_stopped_relay_finishes_its_batch(db, monkeypatch):
+    add_events(db, 3)
+
+    async def run() -> SlowProducer:
+        producer = SlowProducer()
+        monkeypatch.setattr(kafka.producer, "producer", producer)
+        relay = OutboxRelay(batch_size=10, poll_interval=60, claim_timeout=30)
+        await relay.start()
+        await producer.sending.wait()
+        await relay.stop()
+        return producer
+
+    producer = asyncio.run(run())
+
+    assert producer.sent == ["key-0", "key-1", "key-2"]
+    assert db.query(schemas.OutboxEvent).count() == 0
@@ -0,0 +1,117 @@
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import pytest
+
+import crud
+import models
+import schemas
+from pagination import decode_cursor, encode_cursor, next_cursor
+
+
+def limit(direction: str, qty: int, price: int) -> models.LimitOrderBody:
+    return models.LimitOrderBody(
+        direction=direction, ticker="MEME", qty=qty, price=price
+    )
+
+
+def pages(fetch, size: int, cursor=None):
+    """Все страницы подряд по курсору следующей"""
+    result = []
+    while True:
+        rows = fetch(cursor, size)
+        result.append([row.id for row in rows])
+        page_cursor = next_cursor(rows, size)
+        if page_cursor is None:
+            return result
+        cursor = decode_cursor(page_cursor)
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc)
+    row_id = uuid4()
+
+    assert decode_cursor(encode_cursor(created_at, row_id)) == (created_at, row_id)
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+
+def test_order_pages_cover_history_once(db, ticker, make_user):
+    trader = make_user("trader", RUB=1000)
+    for price in range(1, 8):
+        crud.create_order(db, limit("BUY", 1, price), trader.id)
+    # Одинаковое время: порядок страниц держится на id
+    db.query(schemas.Order).update(
+        {schemas.Order.created_at: datetime(2025, 1, 1, tzinfo=timezone.utc)}
+    )
+    db.commit()
+    everything = [order.id for order in crud.get_orders(db, trader.id)]
+
+    result = pages(
+        lambda cursor, size: crud.get_orders(db, trader.id, cursor=cursor, limit=size),
+        3,
+    )
+
+    assert [len(page) for page in result] == [3, 3, 1]
+    assert sum(result, []) == everything
+    assert everything == sorted(everything, reverse=True)
+
+
+def test_order_filters_apply_to_every_page(db, ticker, make_user):
+    trader = make_user("trader", RUB=1000, MEME=10)
+    cancelled = crud.create_order(db, limit("BUY", 1, 1), trader.id)
+    crud.cancel_order(db, cancelled.id, trader.id)
+    buys = [crud.create_order(db, limit("BUY", 1, p), trader.id) for p in (2, 3, 4)]
+    sell = crud.create_order(db, limit("SELL", 1, 20), trader.id)
+
+    result = pages(
+        lambda cursor, size: crud.get_orders(
+            db, trader.id, order_status="NEW", cursor=cursor, limit=size
+        ),
+        2,
+    )
+
+    assert sorted(sum(result, [])) == sorted(order.id for order in buys + [sell])
+    assert crud.get_orders(db, trader.id, active=True, ticker="NOPE") == []
+
+
+@pytest.fixture
+def trades(db, ticker, make_user):
+    """Пять сделок по цене 10..14, от старых к новым"""
+    buyer = make_user("buyer", RUB=1000)
+    seller = make_user("seller", MEME=10)
+    for price in range(10, 15):
+        crud.create_order(db, limit("SELL", 1, price), seller.id)
+        crud.create_order(db, limit("BUY", 1, price), buyer.id)
+    return [t.id for t in crud.get_transactions(db, ticker, limit=None)][::-1]
+
+
+def test_trade_pages_go_back_with_before(db, ticker, trades):
+    result = pages(
+        lambda cursor, size: crud.get_transactions(db, ticker, size, before=cursor),
+        2,
+    )
+
+    assert sum(result, []) == trades[::-1]
+
+
+def test_trade_pages_go_forward_with_after(db, ticker, trades):
+    oldest = db.get(schemas.Transaction, trades[0])
+    start = (oldest.created_at, oldest.id)
+
+    result = pages(
+        lambda cursor, size: crud.get_transactions(db, ticker, size, after=cursor),
+        2,
+        start,
+    )
+
+    # После самой старой — остальные по порядку исполнения
+    assert sum(result, []) == trades[1:]
+
+
+def test_export_reads_trades_in_chunks(db, ticker, trades):
+    chunks = list(crud.iter_transactions(db, ticker, chunk_size=2))
+
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert [row.id for chunk in chunks for row in chunk] == trades[::-1]
+    assert [row.price for row in chunks[0]] == [14, 13]
@@ -0,0 +1,57 @@
+import crud
+import models
+import schemas
+
+
+def limit(direction: str, qty: int, price: int) -> models.LimitOrderBody:
+    return models.LimitOrderBody(
+        direction=direction, ticker="MEME", qty=qty, price=price
+    )
+
+
+def amounts(db, *users):
+    db.expire_all()
+    return {
+        (user.name, row.ticker): row.amount
+        for user in users
+        for row in crud.get_balances(db, user.id)
+    }
+
+
+def test_sweep_settles_every_maker_in_one_order(db, ticker, make_user):
+    buyer = make_user("buyer", RUB=1000)
+    first = make_user("first", MEME=10)
+    second = make_user("second", MEME=10)
+
+    crud.create_order(db, limit("SELL", 2, 10), first.id)
+    crud.create_order(db, limit("SELL", 3, 11), second.id)
+    crud.create_order(db, limit("SELL", 1, 12), first.id)
+
+    order = crud.create_order(db, limit("BUY", 6, 12), buyer.id)
+
+    assert order.status == "EXECUTED"
+    assert amounts(db, buyer, first, second) == {
+        ("buyer", "RUB"): 1000 - 20 - 33 - 12,
+        ("buyer", "MEME"): 6,
+        ("first", "RUB"): 20 + 12,
+        ("first", "MEME"): 7,
+        ("second", "RUB"): 33,
+        ("second", "MEME"): 7,
+    }
+    trades = db.query(schemas.Transaction).order_by(schemas.Transaction.price).all()
+    assert [(t.price, t.quantity, t.seller_id) for t in trades] == [
+        (10, 2, first.id),
+        (11, 3, second.id),
+        (12, 1, first.id),
+    ]
+
+
+def test_trade_between_own_orders_keeps_totals(db, ticker, make_user):
+    trader = make_user("trader", RUB=500, MEME=5)
+
+    crud.create_order(db, limit("SELL", 5, 20), trader.id)
+    crud.create_order(db, limit("BUY", 5, 20), trader.id)
+
+    assert amounts(db, trader) == {("trader", "RUB"): 500, ("trader", "MEME"): 5}
+    assert crud.get_balance(db, trader.id, "RUB").locked == 0
+    assert crud.get_balance(db, trader.id, "MEME").locked == 0
@@ -0,0 +1,59 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import crud
+from database import SessionLocal, WriterSessionLocal
+from matching.sequencer import Sequencer
+
+
+def deposit_concurrently(session_factory, user_id, workers: int, times: int):
+    def deposit():
+        session = session_factory()
+        try:
+            for _ in range(times):
+                crud.update_balance(session, user_id, "RUB", 1)
+        finally:
+            session.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(deposit) for _ in range(workers)]:
+            future.result()
+
+
+def test_writers_serialize_read_modify_write(db, make_user):
+    user_id = make_user("trader", RUB=0).id
+    # Сессия фикстуры не должна держать блокировку записи
+    db.rollback()
+
+    deposit_concurrently(WriterSessionLocal, user_id, workers=4, times=25)
+
+    assert crud.get_balance(db, user_id, "RUB").amount == 100
+
+
+def test_reader_session_does_not_lock(db, make_user):
+    user_id = make_user("trader", RUB=0).id
+    db.rollback()
+    reader = SessionLocal()
+    try:
+        # Отложенный BEGIN: открытое чтение не мешает писателям
+        crud.get_balance(reader, user_id, "RUB")
+        deposit_concurrently(WriterSessionLocal, user_id, workers=2, times=5)
+    finally:
+        reader.close()
+
+    assert crud.get_balance(db, user_id, "RUB").amount == 10
+
+
+def test_lanes_run_in_writer_sessions():
+    def immediate(session):
+        return session.get_bind().get_execution_options().get("sqlite_immediate")
+
+    async def run():
+        sequencer = Sequencer(max_workers=2)
+        await sequencer.start()
+        try:
+            return await sequencer.submit("MEME", immediate)
+        finally:
+            await sequencer.stop()
+
+    assert asyncio.run(run()) is True